@@ -0,0 +1,259 @@
+import numpy as np
+import pandas as pd
+
+from . import exoplanet_catalog as ec
+
+# Counts of the catalog broken down by everything the charts, the report and the dashboards ask about, computed once per
+# version of the catalog. Each planet falls in one cell of a multi-dimensional cube (discovery method x discovery year x
+# solution type x planet type x habitable x distance bin x planets in its system), which holds the number of planets in the
+# cell and the number of systems with a planet in it. A histogram, pie chart or ad hoc breakdown is then a sum of the cells
+# over the other axes, never another group-by over the whole table.
+#
+# A system can have planets in several cells, so systems can't simply be summed. The cube also keeps each distinct (host star,
+# cell) pair with the number of the host's planets in that cell - a breakdown counts the distinct host stars of the cells it
+# adds up, so every host is counted once in each result it has a planet in, whatever is selected. The same pairs give the
+# planets per star of a selection (e.g. only the habitable planets of each system).
+#
+# Only a few thousand of the million or so cells are ever occupied, so the cube is kept sparse: the coordinates and counts of
+# the occupied cells. A breakdown bins them with np.bincount.
+#
+# Each dimension ends with a None label for the planets where it isn't known, so the totals always add up to the catalog.
+
+DIMENSIONS = ['discoverymethod', 'disc_year', 'solution_type', 'planet_type', 'is_planet_habitable', 'distance_bin',
+	'planets_in_system']
+MEASURES = ['planets', 'systems']
+
+# is_planet_gas_giant -> planet type (see phys_and_math.classify_planet_by_density)
+PLANET_TYPES = ['rocky', 'gas', 'iron']
+
+# light years, the last bin is open ended
+DISTANCE_BIN_EDGES = [0, 10, 50, 100, 500, 1000, 5000]
+
+# systems with this many planets or more share the last bin
+MAX_PLANETS_IN_SYSTEM = 10
+
+
+class AggregateCube:
+	'''
+	The occupied cells (their position along each dimension and their count of each measure) and the labels of each
+	dimension. Select cells by label with keyword arguments, e.g. cube.total(is_planet_habitable=1, discoverymethod=['Transit',
+	'Imaging']).
+	'''
+	__slots__ = ('labels', 'coords', 'measures', 'system_hosts', 'system_cells', 'system_planets')
+
+	def __init__(self, labels, coords, measures, system_hosts, system_cells, system_planets):
+		self.labels = labels				# dimension -> object array of labels
+		self.coords = coords				# dimension -> position of each occupied cell along it
+		self.measures = measures			# measure -> int64 count in each occupied cell
+		self.system_hosts = system_hosts	# for each distinct (host star, cell) pair: the host's code,
+		self.system_cells = system_cells	# the occupied cell
+		self.system_planets = system_planets	# and the number of the host's planets in the cell
+
+	def __repr__(self):
+		return "AggregateCube({}, {} occupied cells)".format(' x '.join('{} {}'.format(len(self.labels[dim]), dim) for dim in DIMENSIONS),
+			len(self.measures['planets']))
+
+	@property
+	def shape(self):
+		return tuple(len(self.labels[dim]) for dim in DIMENSIONS)
+
+	@property
+	def nbytes(self):
+		arrays = list(self.coords.values()) + list(self.measures.values()) + [self.system_hosts, self.system_cells, self.system_planets]
+		return sum(values.nbytes for values in arrays)
+
+	def get_indices(self, dimension, values):
+		'''
+		Positions along a dimension of one label or a list of them. Labels are matched on their text, so values from a
+		query string work too.
+		'''
+		if not isinstance(values, (list, tuple, np.ndarray)):
+			values = [values]
+
+		label_text = [str(label) for label in self.labels[dimension]]
+		indices = []
+		for value in values:
+			if str(value) not in label_text:
+				raise KeyError("No '{}' of {!r}, expected one of {}".format(dimension, value, label_text))
+			indices.append(label_text.index(str(value)))
+		return indices
+
+	def get_cell_mask(self, **selection):
+		'''
+		Boolean mask of the occupied cells with the selected labels.
+		'''
+		mask = np.ones(len(self.measures['planets']), dtype=bool)
+		for dimension, values in selection.items():
+			mask &= np.isin(self.coords[dimension], self.get_indices(dimension, values))
+		return mask
+
+	def count_by(self, dimensions, measure='planets', **selection):
+		'''
+		Counts broken down by the given dimensions (summed over all the others), as an array with an axis per dimension, and
+		the labels of those axes. A selected dimension only has the labels selected.
+		'''
+		if isinstance(dimensions, str):
+			dimensions = [dimensions]
+
+		mask = self.get_cell_mask(**selection)
+
+		axes = []
+		labels = []
+		for dim in dimensions:
+			# position along each axis of the result - all of the dimension's labels, or only those selected
+			positions = np.arange(len(self.labels[dim])) if dim not in selection else np.array(self.get_indices(dim, selection[dim]))
+			lookup = np.full(len(self.labels[dim]), -1, dtype=np.int64)
+			lookup[positions] = np.arange(len(positions))
+			axes.append(lookup[self.coords[dim][mask]])
+			labels.append(self.labels[dim][positions])
+
+		shape = tuple(len(axis_labels) for axis_labels in labels)
+		n_results = int(np.prod(shape))
+		cells = np.ravel_multi_index(axes, shape) if axes else np.zeros(int(mask.sum()), dtype=np.int64)
+
+		if measure == 'systems':
+			counts = self.count_distinct_systems(mask, cells, n_results)
+		else:
+			counts = np.bincount(cells, weights=self.measures[measure][mask], minlength=n_results)
+		return counts.astype(np.int64).reshape(shape), labels
+
+	def count_distinct_systems(self, mask, cells, n_results):
+		'''
+		The number of distinct host stars in each result cell, where cells is the result cell of each occupied cell in mask.
+		'''
+		result_of_cell = np.full(len(mask), -1, dtype=np.int64)
+		result_of_cell[mask] = cells
+
+		result_of_pair = result_of_cell[self.system_cells]
+		selected = result_of_pair >= 0
+		pairs = np.unique(self.system_hosts[selected] * n_results + result_of_pair[selected])
+		return np.bincount(pairs % n_results, minlength=n_results)
+
+	def total(self, measure='planets', **selection):
+		mask = self.get_cell_mask(**selection)
+		if measure == 'systems':
+			return int(len(np.unique(self.system_hosts[mask[self.system_cells]])))
+		return int(self.measures[measure][mask].sum())
+
+	def to_series(self, dimensions, measure='planets', drop_empty=True, **selection):
+		'''
+		count_by as a pandas Series indexed by the labels, for printing / JSON. Empty cells are left out unless drop_empty=False.
+		'''
+		if isinstance(dimensions, str):
+			dimensions = [dimensions]
+
+		counts, labels = self.count_by(dimensions, measure, **selection)
+		if len(dimensions) > 1:
+			index = pd.MultiIndex.from_product(labels, names=dimensions)
+		else:
+			index = pd.Index(labels[0], name=dimensions[0], dtype=object)
+		series = pd.Series(counts.ravel(), index=index, name=measure)
+		return series[series != 0] if drop_empty else series
+
+	def get_systems_per_size(self, **selection):
+		'''
+		Number of systems with each number of planets, as (sizes, counts). Only the selected planets of each system are
+		counted, e.g. is_planet_habitable=1 gives the number of habitable planets per star, over the systems with at least one.
+		The last size is MAX_PLANETS_IN_SYSTEM or more, systems without a host star name aren't counted.
+		'''
+		selected = self.get_cell_mask(**selection)[self.system_cells]
+		planets_per_host = np.bincount(self.system_hosts[selected], weights=self.system_planets[selected]).astype(np.int64)
+		planets_per_host = planets_per_host[planets_per_host > 0]
+
+		sizes = np.arange(1, MAX_PLANETS_IN_SYSTEM + 1)
+		counts = np.bincount(np.minimum(planets_per_host, MAX_PLANETS_IN_SYSTEM) - 1, minlength=MAX_PLANETS_IN_SYSTEM)
+		return sizes, counts
+
+
+def get_category_codes(values):
+	'''
+	Code of each value along a dimension, and the labels: the sorted distinct values then None for missing values.
+	'''
+	codes, uniques = pd.factorize(pd.Series(np.asarray(values, dtype=object)), sort=True)
+	labels = [int(label) if isinstance(label, float) and label.is_integer() else label for label in uniques]
+
+	codes = np.where(codes < 0, len(labels), codes)
+	return codes.astype(np.int64), np.array(labels + [None], dtype=object)
+
+
+def get_distance_bin_codes(distance_ly):
+	distance_ly = np.asarray(distance_ly, dtype=float)
+	codes = np.digitize(distance_ly, DISTANCE_BIN_EDGES) - 1
+
+	labels = ['{}-{}'.format(low, high) for low, high in zip(DISTANCE_BIN_EDGES[:-1], DISTANCE_BIN_EDGES[1:])]
+	labels.append('{}+'.format(DISTANCE_BIN_EDGES[-1]))
+
+	codes[np.isnan(distance_ly) | (codes < 0)] = len(labels)
+	return codes, np.array(labels + [None], dtype=object)
+
+
+def get_system_codes(host_names):
+	'''
+	Number of planets in each planet's system (capped at MAX_PLANETS_IN_SYSTEM) as codes, the labels, and the code of each
+	planet's host star (-1 without a name).
+	'''
+	host_codes, _ = pd.factorize(pd.Series(np.asarray(host_names, dtype=object)), sort=False)
+	known = host_codes >= 0
+
+	planets_in_system = np.zeros(len(host_codes), dtype=np.int64)
+	planets_in_system[known] = np.bincount(host_codes[known])[host_codes[known]]
+
+	codes = np.where(known, np.minimum(planets_in_system, MAX_PLANETS_IN_SYSTEM) - 1, MAX_PLANETS_IN_SYSTEM)
+	labels = np.array(list(range(1, MAX_PLANETS_IN_SYSTEM + 1)) + [None], dtype=object)
+
+	return codes, labels, host_codes
+
+
+def build_cube(exoplanets):
+	'''
+	Build the cube of a cleaned catalog (DataFrame or ExoplanetCatalog) in one pass: every planet's cell is worked out as a
+	flat index and the planets in each occupied cell counted with np.bincount.
+	'''
+	columns = ['discoverymethod', 'disc_year', 'solution_type', 'is_planet_gas_giant', 'is_planet_habitable',
+		'distance_to_system_in_light_years', 'name_of_host_star']
+	exo = ec.as_catalog(exoplanets, columns)
+	n_planets = len(exo)
+
+	def get_column(name):
+		return exo[name] if name in exo else np.full(n_planets, None, dtype=object)
+
+	planet_type = np.asarray(get_column('is_planet_gas_giant'), dtype=float)
+	planet_type_codes = np.where(np.isin(planet_type, np.arange(len(PLANET_TYPES))), np.nan_to_num(planet_type),
+		len(PLANET_TYPES)).astype(np.int64)
+	system_codes, system_labels, host_codes = get_system_codes(get_column('name_of_host_star'))
+
+	codes_and_labels = {
+		'discoverymethod': get_category_codes(get_column('discoverymethod')),
+		'disc_year': get_category_codes(get_column('disc_year')),
+		'solution_type': get_category_codes(get_column('solution_type')),
+		'planet_type': (planet_type_codes, np.array(PLANET_TYPES + [None], dtype=object)),
+		'is_planet_habitable': get_category_codes(get_column('is_planet_habitable')),
+		'distance_bin': get_distance_bin_codes(np.asarray(get_column('distance_to_system_in_light_years'), dtype=float)),
+		'planets_in_system': (system_codes, system_labels)
+	}
+
+	labels = {dim: codes_and_labels[dim][1] for dim in DIMENSIONS}
+	shape = tuple(len(labels[dim]) for dim in DIMENSIONS)
+	cells = np.ravel_multi_index([codes_and_labels[dim][0] for dim in DIMENSIONS], shape)
+
+	# count each occupied cell
+	occupied, cell_of_planet = np.unique(cells, return_inverse=True)
+
+	# the distinct (host star, cell) pairs, with the number of the host's planets in the cell
+	known = host_codes >= 0
+	pairs, system_planets = np.unique(host_codes[known] * len(occupied) + cell_of_planet[known], return_counts=True)
+	system_hosts, system_cells = np.divmod(pairs, len(occupied))
+
+	measures = {
+		'planets': np.bincount(cell_of_planet, minlength=len(occupied)),
+		'systems': np.bincount(system_cells, minlength=len(occupied))
+	}
+	coords = dict(zip(DIMENSIONS, np.unravel_index(occupied, shape)))
+	return AggregateCube(labels, coords, measures, system_hosts, system_cells, system_planets)
+
+
+def as_cube(data):
+	'''
+	Pass cubes through, build one from a catalog / DataFrame. Lets the chart functions take either.
+	'''
+	return data if isinstance(data, AggregateCube) else build_cube(data)
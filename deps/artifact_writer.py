@@ -0,0 +1,180 @@
+import os
+import atexit
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from . import consts as consts
+from . import exoplanet_catalog as ec
+
+# Writes the non-critical outputs (the santisised xl for manual checking, a CSV copy, the SQLite copies) in the background, so
+# the analysis doesn't wait on them - xlsx serialisation in particular is slow. Jobs are queued to a single background worker,
+# a thread by default or a separate process, and the program joins it before exiting: close() waits for everything queued and
+# reports anything that failed.
+#
+# Each file is written under a temporary name and moved into place once complete, so nothing (the catalog service watching the
+# xl, the stage cache checking its outputs) ever sees a half written file.
+
+EXPORT_FORMATS = ('xlsx', 'csv', 'sqlite')
+FILE_EXTENSIONS = {'xlsx': '.xlsx', 'csv': '.csv', 'sqlite': '.db'}
+
+# the writer used by export / submit, created on first use with the formats from consts unless configure is called first
+default_writer = None
+default_writer_lock = threading.Lock()
+
+
+def write_artifact(df, path, export_format, table_name='exoplanets'):
+	'''
+	Write a dataframe (or catalog) to path in one of EXPORT_FORMATS. Runs on the background worker, so it has to be a plain
+	function.
+	'''
+	df = ec.as_dataframe(df)
+	path = Path(path)
+	partial_path = path.with_name(path.stem + '.partial' + path.suffix)
+
+	if export_format == 'xlsx':
+		df.to_excel(partial_path)
+	elif export_format == 'csv':
+		df.to_csv(partial_path)
+	elif export_format == 'sqlite':
+		if partial_path.exists():
+			partial_path.unlink()
+		sql_con = sqlite3.connect(partial_path)
+		try:
+			df.to_sql(table_name, sql_con, if_exists='replace', index=False)
+			sql_con.commit()
+		finally:
+			sql_con.close()
+	else:
+		raise ValueError("Unknown export format '{}', expected one of {}".format(export_format, EXPORT_FORMATS))
+
+	os.replace(partial_path, path)
+	return str(path)
+
+
+def get_export_paths(path, formats):
+	'''
+	Where each format is written for an export to path - the same name with the format's extension.
+	'''
+	path = Path(path)
+	return {export_format: str(path.with_suffix(FILE_EXTENSIONS[export_format])) for export_format in formats}
+
+
+class ArtifactWriter:
+	'''
+	A queue of background writes. formats are the formats export() writes (an empty list turns exporting off), use_process
+	runs the writes in a separate process rather than a thread, which keeps a slow xlsx from competing with the analysis for
+	the GIL.
+	'''
+
+	def __init__(self, formats=EXPORT_FORMATS[:1], use_process=False):
+		for export_format in formats:
+			if export_format not in EXPORT_FORMATS:
+				raise ValueError("Unknown export format '{}', expected one of {}".format(export_format, EXPORT_FORMATS))
+
+		self.formats = tuple(formats)
+		self.use_process = use_process
+		self.executor = None
+		self.jobs = [] # (description, future)
+		self.lock = threading.Lock()
+
+	def submit(self, description, func, *args, **kwargs):
+		'''
+		Queue func(*args, **kwargs) on the background worker. With use_process, func and its arguments must be picklable.
+		'''
+		with self.lock:
+			if self.executor is None:
+				self.executor = ProcessPoolExecutor(max_workers=1) if self.use_process else ThreadPoolExecutor(max_workers=1,
+					thread_name_prefix='artifact-writer')
+
+			self.jobs.append((description, self.executor.submit(func, *args, **kwargs)))
+
+	def export(self, df, path, formats=None, table_name='exoplanets'):
+		'''
+		Queue writing df (a DataFrame or ExoplanetCatalog) in each of the formats (the writer's formats by default). path is the
+		xlsx path, the other formats go next to it with their own extension. A DataFrame is copied first, so the caller can
+		carry on changing it; a frozen catalog can't change, so is written as it is.
+		Returns the paths that will be written.
+		'''
+		formats = self.formats if formats is None else formats
+		paths = get_export_paths(path, formats)
+
+		if paths and not (isinstance(df, ec.ExoplanetCatalog) and df.frozen):
+			df = ec.copy_frame(ec.as_dataframe(df))
+		for export_format, export_path in paths.items():
+			self.submit("{} export to {}".format(export_format, export_path), write_artifact, df, export_path, export_format, table_name)
+
+		return list(paths.values())
+
+	def close(self):
+		'''
+		Wait for everything queued to be written and stop the worker. Returns a list of (description, exception) for the writes
+		which failed, each is also printed.
+		'''
+		with self.lock:
+			jobs, self.jobs = self.jobs, []
+			executor, self.executor = self.executor, None
+
+		pending = sum(not future.done() for _, future in jobs)
+		if pending:
+			print("Info - Waiting for {} background export(s) to finish..".format(pending))
+
+		errors = []
+		for description, future in jobs:
+			error = future.exception()
+			if error is not None:
+				print("Error - {} failed: {!r}".format(description, error))
+				errors.append((description, error))
+
+		if executor is not None:
+			executor.shutdown(wait=True)
+
+		return errors
+
+
+def configure(formats=None, use_process=False):
+	'''
+	Set up the writer used by export / submit for this run. formats defaults to consts.get_export_formats(), an empty list turns
+	the exports off. Anything still queued on the previous writer is finished first.
+	'''
+	global default_writer
+
+	with default_writer_lock:
+		previous, default_writer = default_writer, ArtifactWriter(consts.get_export_formats() if formats is None else formats, use_process)
+
+	if previous is not None:
+		previous.close()
+
+	return default_writer
+
+
+def get_writer():
+	with default_writer_lock:
+		writer = default_writer
+	return writer if writer is not None else configure()
+
+
+def get_formats():
+	return get_writer().formats
+
+
+def export(df, path, formats=None, table_name='exoplanets'):
+	return get_writer().export(df, path, formats, table_name)
+
+
+def submit(description, func, *args, **kwargs):
+	get_writer().submit(description, func, *args, **kwargs)
+
+
+def close():
+	'''
+	Join the background writer, returns the failed writes (see ArtifactWriter.close). Also run at exit, so the queue is always
+	flushed even if the program didn't call it.
+	'''
+	with default_writer_lock:
+		writer = default_writer
+	return writer.close() if writer is not None else []
+
+
+atexit.register(close)
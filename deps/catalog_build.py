@@ -0,0 +1,173 @@
+from . import data_cleansing as dc
+from . import downloader as dl
+from . import name_index as ni
+from . import phys_and_math as pam
+from . import consts as consts
+from . import merge_policy as mp
+from . import pipeline as pp
+from . import spectrum as spec
+from . import mass_radius as mr
+from . import exoplanet_catalog as ec
+from . import artifact_writer as aw
+from . import predicates as pred
+from . import ingest_profile as ip
+from . import orbital_stability as stab
+from . import occurrence as occ
+
+# The stages that turn the archive export into the catalog the plots, report, service and snapshots are made from: read ->
+# select -> profile -> merge -> impute -> derive -> publish -> screen -> detect -> subset. explore.py runs them as the first
+# stages of its pipeline (with the cache), deps/snapshot_store.py runs them on dated exports with build_catalog (without it).
+
+# the stages that turn the raw table into the catalog, in the order they run
+CATALOG_STAGES = ('selected_table', 'ingest_profile', 'null_counts', 'merged_table', 'imputed_table', 'derived_catalog',
+	'published_catalog', 'screened_catalog', 'detected_catalog', 'exoplanet_catalog')
+
+
+def read_raw_table(input_data_path, len_of_list, filters=None):
+	'''
+	Ingest stage - read the archive export and check it was read correctly.
+
+	With filters, only the rows of the matching planets are read from the SQLite copy of the archive (see deps/predicates.py).
+	If there isn't a copy of this file yet the xl is read and filtered, and the copy is made (or remade) for next time.
+	'''
+	# the copy is kept with the hash of the file it was made from, so a copy of an older export is never read
+	source_hash = pp.hash_file(input_data_path)
+
+	if pred.is_active(filters):
+		master_data = pred.read_filtered_from_sqlite(filters, consts.get_database_path(), source_hash=source_hash)
+		if master_data is not None:
+			print("Shape of the import: {} (rows of the planets matching {})".format(master_data.shape, filters))
+			return master_data
+
+		print("Info - No SQLite copy of this archive file yet, reading the full xl this time..")
+
+	# first create data frame with CSV in, ~ 30 000 rows.
+	master_data = dc.read_archive_table(input_data_path)
+
+	# create sqlite database for the master data, in the background
+	if 'sqlite' in aw.get_formats():
+		aw.submit('SQLite copy of the archive', dc.convert_xl_to_sql, 'exoplanets', master_data, source_hash)
+
+	# Examine the shape
+	print("Shape of the import: {}".format(master_data.shape))
+
+	# check the dataset was read correctly - the columns the cleaning needs are there (the rest is checked by the profile)
+	ip.check_archive_columns(master_data)
+
+	if pred.is_active(filters):
+		master_data = pred.filter_raw_table(master_data, filters)
+
+	return master_data
+
+
+def profile_selected_table(exoplanets, len_of_list, check_length=True):
+	'''
+	Validate and profile the selected columns in one pass (see deps/ingest_profile.py). This also counts the nulls in each row,
+	to help with choosing the best case duplicate (i.e. the one with the most data). A row count other than len_of_list is
+	reported rather than stopping the run (not checked at all for a filtered run).
+	'''
+	return ip.profile_table(exoplanets, len_of_list if check_length else None)
+
+
+def get_null_counts(profile):
+	return profile['null_counts']
+
+
+def impute_planet_sizes(merged):
+	'''
+	Fill in a missing planet mass or radius from the other using the mass-radius relation (see deps/mass_radius.py).
+	'''
+	# copied as the merged table may be shared with other stages
+	return mr.impute_mass_and_radius(ec.copy_frame(merged))
+
+
+def derive_catalog(merged, null_list, albedo):
+	'''
+	Derived quantities for every planet. albedo is the Bond albedo used for the model equilibrium temperatures.
+	'''
+	# copied as the derived columns are written in place and the merged table may be shared with other stages
+	exoplanets = dc.derive_exoplanet_columns(ec.copy_frame(merged), null_list)
+
+	# peak wavelength and fraction of each host star's output in the UV / photosynthetic / near-IR bands
+	exoplanets = spec.add_band_flux_columns(exoplanets)
+
+	# flux at the planet and a model equilibrium temperature, filling in the temperatures the archive doesn't have
+	exoplanets = pam.add_equilibrium_temperature_columns(exoplanets, albedo)
+
+	return exoplanets
+
+
+def subset_catalog(exoplanets, filters=None):
+	'''
+	For a filtered run, apply the filters again to the final values - only now, as the whole systems read were needed for the
+	stability screening (see deps/predicates.py). The catalog is passed on as it is for a full run.
+	'''
+	if pred.is_active(filters):
+		return pred.filter_catalog(exoplanets, filters)
+	return exoplanets
+
+
+def publish_catalog(exoplanets):
+	'''
+	The derived catalog as arrays, frozen - every stage after this one reads the same catalog at the same time, and a stage
+	adding columns makes a new version of it (sharing the columns it doesn't change).
+	'''
+	return ec.ExoplanetCatalog.from_dataframe(exoplanets).freeze()
+
+
+
+def get_catalog_stages(input_data_path, len_of_list, albedo=None, filters=None):
+	'''
+	Declare the catalog stages, from reading input_data_path to 'exoplanet_catalog'. albedo defaults to
+	consts.get_bond_albedo(), filters restricts the run to some planets (see deps/predicates.py).
+	'''
+	filters = pred.clean_filters(filters)
+	subset_params = {'filters': filters} if filters else {}
+
+	if albedo is None:
+		albedo = consts.get_bond_albedo()
+
+	return [
+		pp.Stage('raw_table', read_raw_table, params={'input_data_path': input_data_path, 'len_of_list': len_of_list, **subset_params},
+			files=[input_data_path], code=[dc, dl, ip, pred]),
+
+		# Start with only the colums I am interested in and rename them
+		pp.Stage('selected_table', dc.select_columns_exoplanets, inputs=['raw_table']),
+		pp.Stage('ingest_profile', profile_selected_table, inputs=['selected_table'],
+			params={'len_of_list': len_of_list, 'check_length': not filters and len_of_list is not None}, code=[ip, ni]),
+		pp.Stage('null_counts', get_null_counts, inputs=['ingest_profile']),
+		pp.Stage('merged_table', dc.merge_data_rows, inputs=['selected_table'], code=[mp, ni]),
+		pp.Stage('imputed_table', impute_planet_sizes, inputs=['merged_table'], code=[mr]),
+		pp.Stage('derived_catalog', derive_catalog, inputs=['imputed_table', 'null_counts'], params={'albedo': albedo},
+			code=[ec, pam, spec]),
+
+		# the catalog as numpy arrays for the plotting / report code, read-only from here on
+		pp.Stage('published_catalog', publish_catalog, inputs=['derived_catalog'], code=[ec]),
+
+		# neighbouring planets of each system: separation in mutual Hill radii, period ratios and near resonances - a new
+		# version of the catalog with these columns added
+		pp.Stage('screened_catalog', stab.add_stability_columns, inputs=['published_catalog'],
+			params={'n_draws': consts.get_stability_draws()}, code=[stab, ec]),
+
+		# the chance each planet's discovery method would have found it, to correct the counts for what each method can see
+		pp.Stage('detected_catalog', occ.add_detection_columns, inputs=['screened_catalog'], code=[occ, ec]),
+
+		# a filtered run read whole systems, this leaves just the planets matching the filters
+		pp.Stage('exoplanet_catalog', subset_catalog, inputs=['detected_catalog'], params=subset_params, code=[pred, ec]),
+	]
+
+
+def build_catalog(raw, albedo=None):
+	'''
+	Run the catalog stages in order on an archive table that has already been read, without the cache - for tables which
+	aren't the input file, e.g. the dated exports of deps/snapshot_store.py. The result has the same columns as the catalog
+	the plots and report are made from.
+	'''
+	stages = {stage.name: stage for stage in get_catalog_stages(consts.get_input_data_path(), None, albedo)}
+	values = {'raw_table': raw}
+
+	for name in CATALOG_STAGES:
+		stage = stages[name]
+		values[name] = stage.func(*[values[input_name] for input_name in stage.inputs], **stage.params)
+
+	return values['exoplanet_catalog']
@@ -0,0 +1,358 @@
+import numpy as np
+import io
+import json
+import os
+import socketserver
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import matplotlib
+matplotlib.use('Agg') # no display when running as a service, only ever render to bytes
+
+from . import data_cleansing as dc
+from . import plot_logic as pl
+from . import exoplanet_catalog as ec
+from . import name_index as ni
+from . import aggregate_cube as agg
+from . import similarity as sim
+from . import catalog_versions as cv
+from . import consts as consts
+
+# A long running service which loads the cleaned catalog once and keeps it (and some indexes) in memory so scripts
+# and dashboards can ask questions without paying the load / clean start up cost every time.
+#
+# Endpoints (all GET, JSON unless stated):
+#	/candidates				- the planets that pass the habitability tests in print_optimal_planets_for_life
+#	/star?name=TRAPPIST-1	- every planet orbiting a host star (any spelling / alias of its name)
+#	/counts					- aggregate counts (planets, hosts, habitable, by discovery method, planets per star)
+#	/breakdown?by=discoverymethod,disc_year&is_planet_habitable=1
+#							- planets (or &measure=systems) broken down by any of the aggregate cube's dimensions, optionally
+#							  only counting the cells with the given labels (see deps/aggregate_cube.py)
+#	/ranking?k=10			- the k most Earth-like planets by their Earth Similarity Index (&habitable=1 for only those in
+#							  the habitable zone)
+#	/similar?name=TRAPPIST-1 e&k=10
+#							- the k planets most like the named one (see deps/similarity.py)
+#	/plot?kind=...			- render one of the charts on demand, returns a png
+#	/health					- which version of the catalog is being served and when it was loaded
+#
+# The catalog is the newest version published by explore.py (see deps/catalog_versions.py), memory mapped rather than read in,
+# or the santisised xl if nothing has been published yet. Requests keep the version they started with while a new one loads.
+
+
+class CatalogState:
+	'''
+	Holds the loaded catalog and its indexes. A new snapshot is built on reload and swapped in under a lock,
+	so a request always sees one consistent catalog.
+	'''
+
+	def __init__(self, clean_data_file_path, input_data_path, len_of_list, versions_dir=None):
+		self.clean_data_file_path = clean_data_file_path
+		self.input_data_path = input_data_path
+		self.len_of_list = len_of_list
+		self.versions_dir = versions_dir or consts.get_catalog_versions_dir()
+		self.versions = cv.CatalogVersions()
+
+		self.lock = threading.Lock()
+		self.plot_lock = threading.Lock() # pyplot keeps global state, so only render one chart at a time
+		self.snapshot = None
+		self.loaded_mtime = None
+
+		self.reload()
+
+	def get_cache_mtime(self):
+		# a newly published version replaces current.json
+		path = Path(self.versions_dir) / 'current.json'
+		if not path.is_file():
+			path = Path(self.clean_data_file_path)
+		return path.stat().st_mtime if path.is_file() else None
+
+	def reload(self):
+		'''
+		(Re)load the catalog - the newest published version, or the cleaned data cache - and rebuild the indexes.
+		'''
+		mtime = self.get_cache_mtime()
+		if cv.get_current_version_number(self.versions_dir) is not None:
+			# keep the number it was published as, so /health matches the versions directory
+			opened = cv.open_version(self.versions_dir)
+			version = self.versions.publish(opened.catalog, opened.note, opened.number)
+		else:
+			version = self.versions.publish(ec.ExoplanetCatalog.from_dataframe(dc.load_exoplanets(self.clean_data_file_path,
+				self.input_data_path, self.len_of_list).reset_index(drop=True)))
+		catalog = version.catalog
+
+		snapshot = build_snapshot(catalog)
+		snapshot['version'] = version.number
+
+		with self.lock:
+			self.snapshot = snapshot
+			self.loaded_mtime = mtime
+
+		print("Info - Catalog version {} loaded: {} planets around {} host stars".format(version.number, len(catalog),
+			len(snapshot['star_index'])))
+
+	def reload_if_changed(self):
+		mtime = self.get_cache_mtime()
+		if mtime is not None and mtime != self.loaded_mtime:
+			print("Info - The catalog has changed, reloading it..")
+			self.reload()
+
+	def get_snapshot(self):
+		with self.lock:
+			return self.snapshot
+
+
+def build_snapshot(exoplanets):
+	'''
+	Build everything the endpoints need up front, so a request is only ever a lookup or a slice. Takes a (frozen)
+	ExoplanetCatalog, or a DataFrame.
+	'''
+	# the plotting / report code works on the catalog as arrays, the JSON is written from a DataFrame
+	if isinstance(exoplanets, ec.ExoplanetCatalog):
+		catalog = exoplanets
+		exoplanets = catalog.to_dataframe()
+	else:
+		exoplanets = exoplanets.reset_index(drop=True)
+		catalog = ec.ExoplanetCatalog.from_dataframe(exoplanets).freeze()
+
+	# host star name -> row positions, and an index to resolve other spellings / aliases of the names
+	star_index = exoplanets.groupby('name_of_host_star').indices
+	host_index = ni.NameIndex(list(star_index), ni.load_alias_table())
+	habitable = catalog[catalog['is_planet_habitable'] == 1]
+
+	# the counts are all slices of the aggregate cube
+	cube = agg.build_cube(catalog)
+
+	planets_per_star, n_stars = cube.get_systems_per_size()
+	per_star_counts, _ = np.histogram(planets_per_star, bins=range(1, 10), weights=n_stars)
+	by_discovery_method = cube.to_series('discoverymethod').drop(labels=[None], errors='ignore').sort_values(ascending=False, kind='stable')
+
+	counts = {
+		'planets': cube.total(),
+		'host_stars': cube.total('systems'),
+		'habitable_zone': int(cube.to_series('is_planet_habitable').get(1, 0)),
+		'by_discovery_method': {k: int(v) for k, v in by_discovery_method.items()},
+		'planets_per_star': {str(n): int(c) for n, c in zip(range(1, 9), per_star_counts)}
+	}
+
+	# the feature matrix for the rankings / similar planets, rows are those of exoplanets
+	similarity = sim.SimilarityIndex.from_catalog(catalog)
+
+	candidates = pl.filter_optimal_planets_for_life(catalog).to_dataframe()
+	counts['candidates'] = int(len(candidates))
+
+	return {
+		'exoplanets': exoplanets,
+		'catalog': catalog,
+		'habitable': habitable,
+		'cube': cube,
+		'star_index': star_index,
+		'host_index': host_index,
+		'similarity': similarity,
+		'candidates': candidates,
+		'counts': counts,
+		'candidates_json': candidates.to_json(orient='records'),
+		'counts_json': json.dumps(counts)
+	}
+
+
+def render_plot(snapshot, kind):
+	'''
+	Render one of the plot_logic charts into png bytes. Returns None for an unknown chart.
+	'''
+	exoplanets = snapshot['catalog']
+	habitable = snapshot['habitable']
+	buf = io.BytesIO()
+
+	if kind == 'scatter_plot_mass_vs_temp':
+		pl.scatter_plot_for_planet_mass_vs_solar_temp(exoplanets, buf,
+			'A graph to show the mass (1e29) (kg) of known exoplanets orbiting stars of a \ncertain temperature (K), with earth denoted as an orange dot.')
+	elif kind == 'habitable_scatter_plot_mass_vs_temp':
+		pl.scatter_plot_for_planet_mass_vs_solar_temp(habitable, buf,
+			'A graph to show the mass (1e28) (kg) of known exoplanets in the habitable zone orbiting \nstars of a certain temperature (K), ' +
+			'with earth \ndenoted as an orange dot.')
+	elif kind == 'histogram_exoplanets_per_star':
+		pl.histogram_exoplanets_per_star(snapshot['cube'], buf, 'A histogram to show the frequency of exoplanets orbiting a host star.')
+	elif kind == 'habitable_histogram_exoplanets_per_star':
+		pl.histogram_exoplanets_per_star(snapshot['cube'], buf,
+			'A histogram to show the frequency of exoplanets with at least one \nin the habitable range orbiting a host star.',
+			{'is_planet_habitable': 1})
+	else:
+		return None
+
+	return buf.getvalue()
+
+
+def get_breakdown(cube, dimensions, measure='planets', selection=None):
+	'''
+	A breakdown of the cube as a list of records, one per non-empty combination of the dimensions' labels.
+	'''
+	for dim in dimensions:
+		if dim not in agg.DIMENSIONS:
+			raise ValueError("Unknown dimension '{}'".format(dim))
+	if measure not in agg.MEASURES:
+		raise ValueError("Unknown measure '{}'".format(measure))
+	if not dimensions:
+		return [{measure: cube.total(measure, **(selection or {}))}]
+
+	series = cube.to_series(dimensions, measure, **(selection or {}))
+	labels = series.index.tolist() if len(dimensions) > 1 else [(label,) for label in series.index]
+	return [dict(zip(dimensions, [to_json_value(label) for label in key]), **{measure: int(count)}) for key, count in zip(labels, series)]
+
+
+def to_json_value(value):
+	if value is None or (isinstance(value, float) and np.isnan(value)):
+		return None
+	return value.item() if isinstance(value, np.generic) else value
+
+
+PLOT_KINDS = ('scatter_plot_mass_vs_temp', 'habitable_scatter_plot_mass_vs_temp', 'histogram_exoplanets_per_star',
+	'habitable_histogram_exoplanets_per_star')
+
+
+class CatalogRequestHandler(BaseHTTPRequestHandler):
+	'''
+	Answers queries against the state attached to the server.
+	'''
+
+	def do_GET(self):
+		state = self.server.catalog_state
+		snapshot = state.get_snapshot()
+
+		url = urlparse(self.path)
+		query = parse_qs(url.query)
+
+		if url.path == '/candidates':
+			self.send_body(200, snapshot['candidates_json'])
+
+		elif url.path == '/counts':
+			self.send_body(200, snapshot['counts_json'])
+
+		elif url.path == '/star':
+			name = query.get('name', [''])[0]
+			host_index = snapshot['host_index']
+			host = host_index.lookup_fuzzy(name)
+			if host == ni.NOT_FOUND:
+				self.send_body(404, json.dumps({'error': "No host star named '{}'".format(name), 'did_you_mean': host_index.suggest(name)}))
+			else:
+				rows = snapshot['star_index'][host_index.names[host]]
+				self.send_body(200, snapshot['exoplanets'].iloc[rows].to_json(orient='records'))
+
+		elif url.path == '/breakdown':
+			dimensions = [dim for dim in query.get('by', [''])[0].split(',') if dim]
+			measure = query.get('measure', ['planets'])[0]
+			selection = {dim: values for dim, values in query.items() if dim in agg.DIMENSIONS}
+			try:
+				breakdown = get_breakdown(snapshot['cube'], dimensions, measure, selection)
+			except (KeyError, ValueError) as e:
+				self.send_body(400, json.dumps({'error': str(e), 'dimensions': agg.DIMENSIONS, 'measures': agg.MEASURES}))
+			else:
+				self.send_body(200, json.dumps(breakdown))
+
+		elif url.path in ('/ranking', '/similar'):
+			try:
+				k = int(query.get('k', ['10'])[0])
+			except ValueError:
+				self.send_body(400, json.dumps({'error': 'k must be a whole number'}))
+				return
+
+			similarity = snapshot['similarity']
+			if url.path == '/ranking':
+				habitable = snapshot['catalog']['is_planet_habitable'] == 1 if query.get('habitable', ['0'])[0] == '1' else None
+				positions, scores = similarity.most_earth_like(k, habitable)
+				self.send_body(200, similarity.to_dataframe(positions, scores, 'earth_similarity_index').to_json(orient='records'))
+			else:
+				name = query.get('name', [''])[0]
+				try:
+					positions, scores = similarity.most_similar(name, k)
+				except KeyError:
+					self.send_body(404, json.dumps({'error': "No planet named '{}'".format(name),
+						'did_you_mean': similarity.name_index.suggest(name)}))
+				else:
+					self.send_body(200, similarity.to_dataframe(positions, scores).to_json(orient='records'))
+
+		elif url.path == '/plot':
+			kind = query.get('kind', [''])[0]
+			with state.plot_lock:
+				png = render_plot(snapshot, kind)
+			if png is None:
+				self.send_body(404, json.dumps({'error': "Unknown plot '{}'".format(kind), 'kinds': PLOT_KINDS}))
+			else:
+				self.send_body(200, png, 'image/png')
+
+		elif url.path == '/health':
+			self.send_body(200, json.dumps({'version': snapshot.get('version'), 'loaded_mtime': state.loaded_mtime,
+				'planets': snapshot['counts']['planets']}))
+
+		else:
+			self.send_body(404, json.dumps({'error': 'Unknown endpoint',
+				'endpoints': ['/candidates', '/star?name=', '/counts', '/breakdown?by=', '/ranking?k=', '/similar?name=', '/plot?kind=',
+					'/health']}))
+
+	def send_body(self, status, body, content_type='application/json'):
+		if isinstance(body, str):
+			body = body.encode('utf-8')
+
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def address_string(self):
+		# unix sockets don't have a (host, port) client address
+		return self.client_address[0] if self.client_address else 'unix-socket'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	'''
+	Same HTTP handler, served over a unix socket instead of a tcp port.
+	'''
+	daemon_threads = True
+
+
+def watch_for_changes(state, stop_event, poll_seconds):
+	'''
+	Poll the published versions (or the cleaned data cache) and hot reload the catalog when it changes. A failed reload keeps the old catalog.
+	'''
+	while not stop_event.wait(poll_seconds):
+		try:
+			state.reload_if_changed()
+		except Exception as e:
+			print("Error - Reloading the catalog failed, still serving the previous one: {}".format(e))
+
+
+def serve(host='127.0.0.1', port=8765, socket_path=None, poll_seconds=5):
+	'''
+	Load the catalog once and serve queries until interrupted. Listens on localhost by default, or on a unix socket if
+	socket_path is given.
+	'''
+	state = CatalogState(consts.get_clean_data_file_path(), consts.get_input_data_path(), consts.get_len_list())
+
+	if socket_path is not None:
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+		server = ThreadingUnixHTTPServer(socket_path, CatalogRequestHandler)
+		where = socket_path
+	else:
+		server = ThreadingHTTPServer((host, port), CatalogRequestHandler)
+		where = "http://{}:{}".format(host, port)
+
+	server.catalog_state = state
+
+	stop_event = threading.Event()
+	watcher = threading.Thread(target=watch_for_changes, args=(state, stop_event, poll_seconds), daemon=True)
+	watcher.start()
+
+	print("Info - Serving the catalog on {}".format(where))
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		print("Info - Stopping the catalog service")
+	finally:
+		stop_event.set()
+		server.server_close()
+		if socket_path is not None and os.path.exists(socket_path):
+			os.remove(socket_path)
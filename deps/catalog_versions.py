@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+	import fcntl
+except ImportError: # Windows
+	fcntl = None
+	import msvcrt
+
+import numpy as np
+
+from . import exoplanet_catalog as ec
+
+# Published versions of the catalog. Once published a version never changes: its ExoplanetCatalog is frozen (read-only
+# arrays), and an update - a refresh of the archive, a stage adding derived columns - publishes a new version rather than
+# changing the current one. The columns it doesn't change are the same arrays as in the version before (see
+# ExoplanetCatalog.assign), so a version costs only the columns that are new.
+#
+# Readers take the current version and keep working on it for as long as they like, however many versions are published in
+# the meantime; swapping in a new version is the only thing done under the lock.
+#
+# For readers in other processes (the catalog service, notebooks) versions are also written to a directory:
+#	columns/<hash>.npy	- one file per column, named by the hash of its contents, so a column which hasn't changed between
+#						  versions is the same file
+#	version-<n>.json	- which column files make up version n, created exclusively (mode 'x') so two processes writing at
+#						  the same time can't both take number n - the second takes the next number. It is written before
+#						  the column files, so a prune in another process never removes the files of a version being written
+#	current.json		- the number of the newest version, replaced in one step once all of its files are written. The
+#						  check that no newer version is current and the replace are done holding an exclusive lock on
+#						  current.lock, so two writers finishing together can't put the older version back
+# open_version memory maps the numeric columns read-only, so every process reading a version shares the same pages of it.
+#
+# The files of GRACE_VERSIONS more versions than are kept are left on disk when older versions are removed, so a reader which
+# read current.json just before a new version was written can still open the version it named. open_version also starts over
+# from current.json if the files go while it is opening the current version.
+
+MAX_VERSIONS = 5
+GRACE_VERSIONS = 1
+
+# times open_version re-reads current.json when the version it named has been removed in the meantime
+OPEN_RETRIES = 3
+
+
+class CatalogVersion:
+	'''
+	One published version: its number, the frozen catalog, the number of the version it was made from (None for the first)
+	and the columns that are new in it.
+	'''
+	__slots__ = ('number', 'catalog', 'parent', 'changed_columns', 'note')
+
+	def __init__(self, number, catalog, parent=None, changed_columns=None, note=''):
+		self.number = number
+		self.catalog = catalog
+		self.parent = parent
+		self.changed_columns = list(catalog.columns) if changed_columns is None else changed_columns
+		self.note = note
+
+	def __repr__(self):
+		return "CatalogVersion({}, {!r}, {} new columns{})".format(self.number, self.catalog, len(self.changed_columns),
+			', ' + self.note if self.note else '')
+
+
+class CatalogVersions:
+	'''
+	The published versions of the catalog in this process, the newest max_versions of them are kept.
+	'''
+
+	def __init__(self, max_versions=MAX_VERSIONS):
+		self.max_versions = max_versions
+		self.lock = threading.Lock()
+		self.versions = {}
+		self.latest = None
+
+	def __len__(self):
+		return len(self.versions)
+
+	def publish(self, catalog, note='', number=None):
+		'''
+		Freeze catalog and make it the current version, numbered number if it was numbered elsewhere (e.g. by write_version),
+		otherwise the one after the current version. Returns the CatalogVersion.
+		'''
+		catalog.freeze()
+
+		with self.lock:
+			parent = self.latest
+			shared = [] if parent is None else catalog.get_shared_columns(parent.catalog)
+			changed = [name for name in catalog.columns if name not in shared]
+			if number is None:
+				number = 1 if parent is None else parent.number + 1
+			version = CatalogVersion(number, catalog, parent and parent.number, changed, note)
+
+			self.versions[version.number] = version
+			self.latest = version
+			for number in sorted(self.versions)[:-self.max_versions]:
+				# readers still holding one of these keep it, the store just forgets it
+				del self.versions[number]
+
+		return version
+
+	def current(self):
+		'''
+		The newest version (None if nothing has been published yet).
+		'''
+		with self.lock:
+			return self.latest
+
+	def get(self, number):
+		with self.lock:
+			return self.versions[number]
+
+
+def get_column_file_name(values):
+	'''
+	The file name of a column - the hash of its dtype and contents.
+	'''
+	h = hashlib.sha256(str(values.dtype).encode())
+	if values.dtype == object:
+		h.update(pickle.dumps(values.tolist(), protocol=pickle.HIGHEST_PROTOCOL))
+	else:
+		h.update(np.ascontiguousarray(values).tobytes())
+	return h.hexdigest()[:32] + '.npy'
+
+
+def get_tmp_path(path):
+	# a temp file of this process / thread, as other processes may be writing the same file at the same time
+	return '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+def write_json(path, data):
+	tmp_path = get_tmp_path(path)
+	with open(tmp_path, 'w') as f:
+		json.dump(data, f)
+	os.replace(tmp_path, path)
+
+
+def create_manifest(directory, number, manifest):
+	'''
+	Write the manifest of a new version as version-<number>.json, or of the first number after it which isn't taken (another
+	process may have written a version since number was picked). Returns the number used.
+	'''
+	while True:
+		try:
+			# one write of the whole manifest, to a file no other process can have created
+			with open(Path(directory) / 'version-{}.json'.format(number), 'x') as f:
+				f.write(json.dumps(dict(manifest, version=number)))
+			return number
+		except FileExistsError:
+			number += 1
+
+
+@contextmanager
+def current_lock(directory):
+	'''
+	Hold the exclusive lock on current.json of directory (a lock on the file current.lock, released when the block exits or
+	the process dies).
+	'''
+	with open(Path(directory) / 'current.lock', 'a+b') as f:
+		if fcntl is not None:
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+		else:
+			f.seek(0)
+			msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+		try:
+			yield
+		finally:
+			if fcntl is not None:
+				fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+			else:
+				f.seek(0)
+				msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def get_current_version_number(directory):
+	'''
+	Number of the newest version written to directory, None if there isn't one.
+	'''
+	path = Path(directory) / 'current.json'
+	if not path.is_file():
+		return None
+	with open(path) as f:
+		return json.load(f)['version']
+
+
+def write_version(catalog, directory, note='', keep=MAX_VERSIONS):
+	'''
+	Write catalog as the next version in directory, for other processes to open. Only the columns which aren't already there
+	(from an earlier version) are written. Versions older than the newest keep (and GRACE_VERSIONS more) are then removed, along
+	with the column files only they used - a reader which already has one of them open carries on reading it. Returns the
+	version number.
+	'''
+	directory = Path(directory)
+	columns_dir = directory / 'columns'
+	columns_dir.mkdir(parents=True, exist_ok=True)
+
+	column_files = {name: get_column_file_name(values) for name, values in catalog.columns.items()}
+
+	# the manifest goes first, so a prune by another process sees the column files as in use before they are written
+	parent = get_current_version_number(directory)
+	number = create_manifest(directory, 1 if parent is None else parent + 1, {'parent': parent, 'note': note,
+		'length': len(catalog), 'columns': column_files})
+
+	for name, values in catalog.columns.items():
+		path = columns_dir / column_files[name]
+		try:
+			# a file already there is touched, so a prune which started before the manifest was written leaves it
+			os.utime(path)
+		except FileNotFoundError:
+			tmp_path = get_tmp_path(path)
+			with open(tmp_path, 'wb') as f:
+				np.save(f, values, allow_pickle=values.dtype == object)
+			os.replace(tmp_path, path)
+	# the version is only visible once this is replaced - unless another process has made a newer version current already
+	with current_lock(directory):
+		current = get_current_version_number(directory)
+		if current is None or current < number:
+			write_json(directory / 'current.json', {'version': number})
+
+	prune_versions(directory, keep)
+	return number
+
+
+def read_manifest(directory, number):
+	with open(Path(directory) / 'version-{}.json'.format(number)) as f:
+		return json.load(f)
+
+
+def prune_versions(directory, keep=MAX_VERSIONS):
+	'''
+	Remove all but the newest keep versions in directory (and GRACE_VERSIONS more), and the column files none of those use.
+	Column files changed since the prune started are left, they may be of a version another process is writing.
+	'''
+	directory = Path(directory)
+	started = time.time()
+	keep += GRACE_VERSIONS
+	numbers = sorted(int(path.stem.split('-')[1]) for path in directory.glob('version-*.json'))
+	for number in numbers[:-keep]:
+		(directory / 'version-{}.json'.format(number)).unlink(missing_ok=True)
+
+	in_use = set()
+	for number in numbers[-keep:]:
+		try:
+			in_use.update(read_manifest(directory, number)['columns'].values())
+		except (FileNotFoundError, ValueError):
+			# being written or removed by another process at the same time - leave the column files for the next prune
+			return
+	for path in (directory / 'columns').glob('*.npy'):
+		if path.name in in_use:
+			continue
+		try:
+			if path.stat().st_mtime < started:
+				path.unlink()
+		except FileNotFoundError:
+			pass
+
+
+def open_version(directory, number=None):
+	'''
+	Open a version written by write_version (the current one by default) as a CatalogVersion. Numeric columns are memory
+	mapped read-only rather than read in.
+
+	If the current version is removed while it is being opened (a reader far behind several new versions), current.json is
+	read again and the new current version opened instead, up to OPEN_RETRIES times.
+	'''
+	if number is not None:
+		return read_version(directory, number)
+
+	for attempt in range(OPEN_RETRIES + 1):
+		number = get_current_version_number(directory)
+		if number is None:
+			raise FileNotFoundError("No catalog versions in {}".format(directory))
+		try:
+			return read_version(directory, number)
+		except FileNotFoundError:
+			if attempt == OPEN_RETRIES:
+				raise
+			print("Info - Version {} of the catalog was removed while opening it, opening the current version again..".format(number))
+
+
+def read_version(directory, number):
+	'''
+	Open version number of directory, see open_version.
+	'''
+	directory = Path(directory)
+	manifest = read_manifest(directory, number)
+	columns = {}
+	for name, file_name in manifest['columns'].items():
+		path = directory / 'columns' / file_name
+		try:
+			columns[name] = np.load(path, mmap_mode='r')
+		except ValueError:
+			# object columns (names..) can't be memory mapped
+			columns[name] = np.load(path, allow_pickle=True)
+
+	catalog = ec.ExoplanetCatalog(columns, length=manifest['length'], frozen=True)
+	return CatalogVersion(number, catalog, manifest['parent'], note=manifest['note'])
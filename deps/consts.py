@@ -4,5 +4,43 @@ def get_len_list():
 def get_clean_data_file_path():
 	return './cleaned_data.xlsx'
 
+def get_cache_dir():
+	return './cache'
+
+def get_catalog_versions_dir():
+	# published versions of the catalog, for the catalog service / other processes to read (see deps/catalog_versions.py)
+	return './cache/catalog_versions'
+
+def get_database_path():
+	# the SQLite copy of the archive
+	return 'exoplanet_data.db'
+
+def get_bond_albedo():
+	# used for the model equilibrium temperature of planets, 0.3 is about the Earth's
+	return 0.3
+
+def get_stability_draws():
+	# Monte Carlo draws of the orbits for the probability a planet's neighbours are far enough apart (see deps/orbital_stability.py)
+	return 200
+
+def get_bootstrap_draws():
+	# resamples of the host stars for the confidence intervals of the occurrence rates (see deps/occurrence.py)
+	return 1000
+
+def get_export_formats():
+	# debug / copy outputs written in the background, any of 'xlsx', 'csv', 'sqlite' (see deps/artifact_writer.py)
+	return ['xlsx', 'sqlite']
+
 def get_input_data_path():
-	return './deps/PS_2022.06.01_08.42.24.xlsx'
\ No newline at end of file
+	return './deps/PS_2022.06.01_08.42.24.xlsx'
+def get_alias_table_path():
+	# other designations of planets / host stars (see deps/name_index.py)
+	return './deps/name_aliases.csv'
+
+def get_archive_url():
+	# the planetary systems table of the NASA exoplanet archive, as csv (see deps/downloader.py)
+	return 'https://exoplanetarchive.ipac.caltech.edu/TAP/sync?query=select+*+from+ps&format=csv'
+
+def get_downloaded_archive_path():
+	# kept as sent by the archive, usually gzipped
+	return './deps/downloads/PS_latest.csv.gz'
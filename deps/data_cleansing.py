@@ -1,29 +1,45 @@
 import numpy as np
 import pandas as pd
 from pathlib import Path
-import requests
 import re
 from bs4 import BeautifulSoup
-import sys
 import sqlite3
 
 from . import phys_and_math as pam
+from . import merge_policy as mp
+from . import mass_radius as mr
+from . import exoplanet_catalog as ec
+from . import artifact_writer as aw
+from . import name_index as ni
+from . import downloader as dl
+from . import ingest_profile as ip
+from . import predicates as pred
+from . import pipeline as pp
 from . import consts as consts
 
 # A list of methods to clean up the data. I did consider doing this with classes and OOP, but it isnt neccessary.
 
-def connect_to_db(db_name="exoplanet_data.db"):
+def connect_to_db(db_name=None):
 	'''
-	A method to connect to a database, with default param for db name.
+	A method to connect to a database, with default param for db name (consts.get_database_path()).
 	Returns - connection and cursor.
 	'''
-	return sqlite3.connect(db_name), sqlite3.connect(db_name).cursor()
+	db_name = db_name or consts.get_database_path()
+	# the cursor has to be of the same connection, or its writes wait on (and lock out) the connection's own
+	sql_con = sqlite3.connect(db_name)
+	return sql_con, sql_con.cursor()
 
 
-def convert_xl_to_sql(table_name="exoplanets"):
+def convert_xl_to_sql(table_name="exoplanets", df=None, source_hash=None):
 	'''
 	A function to convert the excel input data to sqllite in an attempt to speed up the program, would also provide
 	flexibility if the dataset grew much larger. Hoepfully this has some positive speed implications.
+
+	Pass in df if the input data has already been read, to save reading the xl a second time. Usually queued on the
+	background artifact writer rather than called directly.
+
+	source_hash is the content hash of the file df was read from. It is stored with the table, and a table made from a
+	different file is rebuilt rather than kept (without source_hash an existing table is always kept).
 	'''
 
 	print("INFO - creating SQL table from dataframe")
@@ -31,18 +47,26 @@ def convert_xl_to_sql(table_name="exoplanets"):
 	# connect
 	sql_con, cursor = connect_to_db()
 
-	# First check if the table exists, if it does, exit the function
+	# First check if the table exists and is of the same file, if it is, exit the function
 	cursor.execute("""
-		SELECT count(*) FROM sqlite_master WHERE type='table' AND name='exoplanets'
-		""")
+		SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?
+		""", (table_name,))
 
 	if cursor.fetchone()[0] == 1:
-		sql_con.close()
-		print("RETURNING")
-		return True
+		if source_hash is None or pred.get_source_hash(sql_con, table_name) == source_hash:
+			sql_con.close()
+			print("RETURNING")
+			return True
+
+		print("Info - The SQL table is of an older copy of the archive, rebuilding it")
+		# forget the old hash first, so a filtered run reading at the same time sees the table as out of date
+		cursor.execute("DELETE FROM {} WHERE table_name = ?".format(pred.SOURCE_TABLE), (table_name,))
+		cursor.execute("DROP TABLE {}".format(table_name))
+		sql_con.commit()
 
 
-	df = pd.read_excel(consts.get_input_data_path())
+	if df is None:
+		df = pd.read_excel(consts.get_input_data_path())
 	# get column names from df
 	col_names = df.columns.values.tolist()
 	updated_col_names = []
@@ -75,120 +99,102 @@ def convert_xl_to_sql(table_name="exoplanets"):
 	
 	sql_con.commit()
 
-	df.to_sql('exoplanets', sql_con, if_exists='replace', index = False)
+	df.to_sql(table_name, sql_con, if_exists='replace', index = False)
+
+	# record which file the table is of
+	if source_hash is not None:
+		cursor.execute("CREATE TABLE IF NOT EXISTS {}(table_name text PRIMARY KEY, source_hash text)".format(pred.SOURCE_TABLE))
+		cursor.execute("INSERT OR REPLACE INTO {} VALUES (?, ?)".format(pred.SOURCE_TABLE), (table_name, source_hash))
+		sql_con.commit()
 
 	sql_con.close()
 
 
 
-def merge_data_rows(exoplanets):
+def merge_data_rows(exoplanets, merge_policy=None):
 	'''
 	A method to merge data rows as there is a problem at the moment where some data nmay be missed because of empty rows
 	The idea of this method is to consolidate missing values where data exists over multiple rows into one single row as a new
 	dataframe.
 
-	Takes in the exoplanet dataframe
+	Takes in the exoplanet dataframe, and optionally a merge policy (dict of column -> strategy, see deps/merge_policy.py).
 	Returns another dataframe which sould be more complete than the first.
 
-	By sorting the data alphabetically via planet name, it creates a faster search method for finding if that planet name exists elsewhere
-	in the data.
+	Originally this iterated through every row and filled in the gaps of the first row from its duplicates. When several
+	publications report the same parameter, the first one isn't always the best one - so now each column has a strategy:
+	first non-null, smallest relative uncertainty, most recent, or an inverse-variance weighted mean. (The old loop filled
+	the gaps of the first row from each later duplicate in turn, so the last of them won.) By default measured values with
+	error bars keep the most precise measurement and the rest keep their first non-null value. Everything is done as grouped
+	array operations, so it is much faster than the old row loop on the full archive.
+
+	Rows are grouped on the normalised planet name (see deps/name_index.py), so 'Kepler-22 b' and 'Kepler 22b' are merged
+	into one planet. The name of the first row is kept. A row without a name is kept as it is, as the old loop did.
 
 	'''
 
 	print('Info - Removing duplicates and condensing any missing data from duplicate rows into one single row...')
 
-	# sort the dataframe alphabetically by planet name.
-	exoplanets.sort_values('name_of_planet')
-
-	# properties for the new dataframe
-	len_of_df = len(exoplanets.index)
-
-	index_of_t_df = -1 # start counter from -1 so we dont need a flag system - the actual used value will never be -1 as its incremented
-
-    	# Create a temp dataframe with the columns of exoplanet that we will
-    	# build the final dataset to in the below code.
-	t_df = pd.DataFrame(columns = exoplanets.columns)
-    
-	# create a list of planet names to establish if we are on a new planet, or the same on
-	list_of_planets_processed = []
-
-	# variable to store the name of the planet being iterated over where it is a duplicate
-	name_of_planet_iterating = ""
+	exoplanets = exoplanets.assign(planet_name_key=ni.normalise_names(exoplanets['name_of_planet']))
+	return mp.apply_merge_policy(exoplanets, 'planet_name_key', merge_policy).drop(columns='planet_name_key')
 
-	# start the iteration
-	for index, row in exoplanets.iterrows():
-        
-        # get the name of the current planet we are iterating over from the dataframe
-		name_of_current_planet = exoplanets.loc[index,'name_of_planet']
 
-		# ensure we don't go out of bounds
-		if index < len_of_df - 1:
-			# Check if the planet in the next or previous row is a match of the planet being iterated over
-			if name_of_current_planet == exoplanets.loc[index + 1,'name_of_planet'] or name_of_current_planet == exoplanets.loc[index - 1,'name_of_planet']:
-
-				# set the name of planet being iterated over which is duplicated in the raw data
-				name_of_planet_iterating = name_of_current_planet
-
-				# check if planet name is in list, if not it is a fresh insert,
-				# if it is in the list then we need to check what rows we need to fill!
-				if name_of_current_planet not in list_of_planets_processed:
+def data_cleansing_methods(master_data, LENGTH_OF_LIST, output_file):
+	'''
+	Methods to clean the data up and produce an excel document for manual checking. Keeps the main method tidy.
+	'''
+	# check the dataset was read correctly
+	check_data_read_okay(master_data, LENGTH_OF_LIST)
+	ip.check_archive_columns(master_data)
 
-					index_of_t_df += 1 # do this first, as it starts from -1
+	### Data clensing ###
 
-					list_of_planets_processed.append(name_of_current_planet) # add to the list
-					t_df.loc[index_of_t_df] = exoplanets.loc[index] # add the row to the temp database
+	# Start with only the colums I am interested in and rename them
+	exoplanets = clean_data_exoplanets(master_data, LENGTH_OF_LIST)
 
-					# create a list for the missing values that we want to search for in the subsequent rows in the below else
-					missing_data_list = create_dict_of_missing_values_from_row(exoplanets, index)
+	# output a file for debugging, and to read in after cleansed for a faster spool up of the program.
+	# Written in the background (in the formats configured for the run) so the analysis can carry on.
+	aw.export(exoplanets, output_file)
 
-				else:
-					# Search through the row for any missing values and insert into the row at t_df
+	return exoplanets
 
-					# Iterate through the missing data for the current row, if the data exists then insert into the temp df that gets returned
-					for col in missing_data_list:
-						if pd.notnull(exoplanets.loc[index, col]):
-							t_df.loc[index_of_t_df, col] = exoplanets.loc[index, col]
 
+def load_exoplanets(clean_data_file_path, input_data_path, len_of_list):
+	'''
+	Load the cleaned catalog. If the santisised xl exists it is read straight in, otherwise it is the first run (or changes to code)
+	so import the large dataset and clean it, which also writes the santisised xl for next time.
 
-			# if name of current planet isnt something being iterated over, then it is not a duplicate and needs inserting
-			if name_of_current_planet != name_of_planet_iterating:
-				# this will include the rows where there is only 1 row of data for an exoplanet
-				index_of_t_df += 1 # do this first, as it starts from -1
-				t_df.loc[index_of_t_df] = exoplanets.loc[index]
+	Used by explore.main and by the catalog service so both load the data the same way.
+	'''
+	if Path(clean_data_file_path).is_file():
+		print("Importing sanitised data..")
+		return pd.read_excel(clean_data_file_path)
 
-	# Manually tested and no rows missing! Brilliant!
+	print("Importing un-sanitised data.. This could take a while depending on the size of the input data.")
 
-	return t_df
+	# first create data frame with CSV in, ~ 30 000 rows.
+	master_data = read_archive_table(input_data_path)
 
+	# create sqlite database for the master data, in the background
+	if 'sqlite' in aw.get_formats():
+		aw.submit('SQLite copy of the archive', convert_xl_to_sql, 'exoplanets', master_data, pp.hash_file(input_data_path))
 
-def create_dict_of_missing_values_from_row(exoplanets, index):
-	''' 
-	Create a dictionary of missing / nan values from the row that we need to search for in any duplicate data sets
+	# Examine the shape
+	print("Shape of the import: {}".format(master_data.shape))
 
-	Returns a list
-	'''
-	missing_data_list = exoplanets.iloc[index].isnull().tolist() # iterate through row and ret true or false for if nan
-	missing_data_dict = dict(zip(exoplanets.columns, missing_data_list)) # convert the list of bools to a dict
-	missing_data_dict = {k: v for k, v in missing_data_dict.items() if v == True} # filter only by true - i.e. the missing ones
-	return list(missing_data_dict.keys()) # return list of keys (i.e. column names)
+	# Clean & format the data
+	return data_cleansing_methods(master_data, len_of_list, clean_data_file_path)
 
 
-def data_cleansing_methods(master_data, LENGTH_OF_LIST, output_file):
+def read_archive_table(path):
 	'''
-	Methods to clean the data up and produce an excel document for manual checking. Keeps the main method tidy.
+	Read an export of the archive: an xl downloaded by hand, or a csv (gzipped or not) from deps/downloader.py, which is
+	decompressed as it is parsed.
 	'''
-	# check the dataset was read correctly
-	check_data_read_okay(master_data, LENGTH_OF_LIST)
-
-	### Data clensing ###
-
-	# Start with only the colums I am interested in and rename them
-	exoplanets = clean_data_exoplanets(master_data, LENGTH_OF_LIST)
+	if Path(path).suffix in ('.xlsx', '.xls'):
+		return pd.read_excel(path)
 
-	# output a file for debugging, and to read in after cleansed for a faster spool up of the program.
-	exoplanets.to_excel(output_file)
-
-	return exoplanets
+	with dl.open_stream(path) as stream:
+		return pd.read_csv(stream, comment='#', low_memory=False)
 
 
 def scrape_wikipedia_data_regarding_state_change():
@@ -208,9 +214,11 @@ def scrape_wikipedia_data_regarding_state_change():
 	url_melting = "https://en.wikipedia.org/wiki/Melting_points_of_the_elements_(data_page)"
 	url_boiling = "https://en.wikipedia.org/wiki/Boiling_points_of_the_elements_(data_page)"
 
+	# both pages are fetched at the same time
+	melting_page, boiling_page = dl.fetch_all_bytes([url_melting, url_boiling])
+
 	### get data related to the melting points ###
-	webpage = requests.get(url_melting)
-	soup = BeautifulSoup(webpage.content, "html.parser")
+	soup = BeautifulSoup(melting_page, "html.parser")
 
 	# Scrape the table and convert to a df
 	melting_point_table_scrape = soup.find(id='Melting_point').findNext('table')
@@ -221,8 +229,7 @@ def scrape_wikipedia_data_regarding_state_change():
 
 
 	### get data relating to the boiling points ###
-	webpage = requests.get(url_boiling)
-	soup = BeautifulSoup(webpage.content, "html.parser")
+	soup = BeautifulSoup(boiling_page, "html.parser")
 
 	# Scrape the table and convert to a df
 	melting_point_table_scrape = soup.find(id='Boiling_point').findNext('table')
@@ -296,10 +303,14 @@ def parse_scraped_data_from_wikipedia_regarding_state_change(df_element_change_o
 
 def check_data_read_okay(df, len_of_list):
 	###There are 32 542 rows, note there are 32 543 INCLUDING the column headers not included in the count.###
-	if len(df) == len_of_list:
+	if len_of_list is None:
+		# a freshly downloaded export, there's no known length to check against
+		print("Info - Data read, {} rows".format(len(df)))
+	elif len(df) == len_of_list:
 		print("Info - Data read correctly")
 	else:
-		sys.exit("Error - Error reading data.. exiting.")
+		# a newer export of the archive, not an error - see deps/ingest_profile.py for the checks on the data itself
+		print("Warning - Expected {} rows, read {}".format(len_of_list, len(df)))
 
 
 def clean_data_exoplanets(df, len_of_list):
@@ -308,8 +319,35 @@ def clean_data_exoplanets(df, len_of_list):
 	A method to clean the dataset, and perform some balancing. 
 	'''
 
+	# Start with only the colums I am interested in and rename them
+	exoplanets = select_columns_exoplanets(df)
+
+	# Validate and profile the columns, which also counts the null values in each row to help below with choosing the best
+	# case duplicate (i.e. the one with the most data)
+	profile = ip.profile_table(exoplanets, len_of_list)
+	for issue in profile['issues']:
+		print("Warning - {}".format(issue))
+	null_list = profile['null_counts']
+
+	condensed_exoplanets = merge_data_rows(exoplanets)
+
+	# fill in a missing mass or radius from the other, so these planets aren't dropped from the gravity / density / habitability analysis
+	condensed_exoplanets = mr.impute_mass_and_radius(condensed_exoplanets)
+
+	exoplanets = derive_exoplanet_columns(condensed_exoplanets, null_list)
+
+	# flux at the planet and a model equilibrium temperature, filling in the temperatures the archive doesn't have
+	return pam.add_equilibrium_temperature_columns(exoplanets, consts.get_bond_albedo())
+
+
+def select_columns_exoplanets(df):
+	'''
+	Choose the columns of the archive I am interested in, rename them to something more sensible and add the empty columns
+	which are filled in by derive_exoplanet_columns.
+	'''
+
 	# Choose the columns I want to load
-	exoplanets = df[[
+	columns_to_load = [
 	'pl_name',
 	'hostname',
 	'discoverymethod',
@@ -339,7 +377,15 @@ def clean_data_exoplanets(df, len_of_list):
 	'st_masserr2',
 	'sy_dist',
 	'sy_disterr1',
-	'sy_disterr2']]
+	'sy_disterr2']
+
+	# optional columns, not every export of the archive includes them:
+	# the publication date is used by the 'most recent' merge strategy, ra / dec place the systems on the star map
+	for col in ['pl_pubdate', 'ra', 'dec']:
+		if col in df.columns:
+			columns_to_load.append(col)
+
+	exoplanets = df[columns_to_load]
 
 	# Rename colums to something more sensible..
 
@@ -371,36 +417,51 @@ def clean_data_exoplanets(df, len_of_list):
 		'st_masserr2' : 'mass_of_star_compared_to_sol_error_min',
 		'sy_dist' : 'distance_to_system_in_light_years',
 		'sy_disterr1' : 'distance_to_system_in_light_years_error_max',
-		'sy_disterr2' : 'distance_to_system_in_light_years_error_min'
+		'sy_disterr2' : 'distance_to_system_in_light_years_error_min',
+		'pl_pubdate' : 'publication_date',
+		'ra' : 'right_ascension_degrees',
+		'dec' : 'declination_degrees'
 		}
 
 	exoplanets.rename(columns=rename_cols, inplace = True)
 
-	# Create a count of null values to help below with choosing the best case duplicate (i.e. the one with the most data)
-	null_list = exoplanets.isnull().sum(axis=1).tolist()
-
-	# Check the null list is the length of the actual list otherwise there will be an issue..
-	if len(null_list) != len_of_list:
-		sys.exit("Error - Error matching NaN / null list.. exiting.")
-
 	# create empty col's as required
 	exoplanets['planet_mass_in_kg'] = np.nan
 	exoplanets['planet_actual_radius'] = np.nan
 	exoplanets['planet_density'] = np.nan
 	exoplanets['is_planet_gas_giant'] = np.nan
 
-	condensed_exoplanets = merge_data_rows(exoplanets)
+	return exoplanets
+
+
+def derive_exoplanet_columns(condensed_exoplanets, null_list):
+	'''
+	Compute the derived columns (unit conversions, habitability zone, gravity, density, planet type) for the merged
+	dataframe, then sort by distance and completeness.
+
+	The physics is done on whole columns at once with an ExoplanetCatalog (pam.compute_physics_columns). The original row by row
+	version, compute_data_each_row_of_exoplanet_df, is kept as the reference for it in deps/equivalence.py.
+	'''
+	parsec_to_ly = 3.261563776976 # 1 parsec to 13.s.f.
+
+	# parsec to ly conversion to 13.s.f. Can quote to 3 s.f. in any display data.
+	for col in ['distance_to_system_in_light_years', 'distance_to_system_in_light_years_error_max', 'distance_to_system_in_light_years_error_min']:
+		condensed_exoplanets[col] = condensed_exoplanets[col] * parsec_to_ly
+
+	# Add a col to count nuls
+	condensed_exoplanets['null_counter'] = np.asarray(null_list, dtype=float)[condensed_exoplanets.index.to_numpy()]
 
-	# Remove duplicates from the 
-	for index, row in condensed_exoplanets.iterrows():
-		compute_data_each_row_of_exoplanet_df(index, row, condensed_exoplanets, null_list)
+	catalog = ec.ExoplanetCatalog.from_dataframe(condensed_exoplanets, pam.PHYSICS_INPUT_COLUMNS)
+	pam.compute_physics_columns(catalog)
 
+	for col in pam.PHYSICS_OUTPUT_COLUMNS:
+		condensed_exoplanets[col] = catalog[col]
 
 	# Sort exoplanets by distance from our solar system AND sort by the least NaNs
 	condensed_exoplanets.sort_values(['distance_to_system_in_light_years', 'null_counter'], ascending=[True, True], inplace = True)
 
 	# Drop the null counter, as it's no longer needed.
-	condensed_exoplanets.drop('null_counter', 1, inplace = True)
+	condensed_exoplanets.drop('null_counter', axis=1, inplace = True)
 
 	return condensed_exoplanets
 
@@ -0,0 +1,419 @@
+import asyncio
+import argparse
+import email.utils
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import urllib3
+
+from . import consts as consts
+
+# Fetching the archive export and the auxiliary tables, instead of downloading them by hand.
+#
+#	* Conditional requests - the ETag / Last-Modified of each download is kept in a sidecar file (<file>.meta.json) and sent
+#	  back as If-None-Match / If-Modified-Since, so when nothing has changed the server answers 304 and nothing is transferred.
+#	* Resumable - the body is written to <file>.part as it arrives. If the transfer is interrupted, the next attempt asks for
+#	  the rest with a Range request (guarded by If-Range, so a changed file starts again from scratch).
+#	* Concurrent - several downloads run at once with asyncio, each blocking transfer on a worker thread, with a semaphore
+#	  bounding how many are in flight.
+#	* Compressed - bodies are stored as sent (gzip if the server compresses them, which for a csv is ~5x smaller) and are
+#	  decompressed with zlib while being read, straight into pandas.
+#
+# Run 'python3 -m deps.downloader' to refresh the archive export, or with --self-check to exercise all of the above against a
+# local stand-in HTTP server.
+
+CHUNK_SIZE = 1 << 16
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 60
+
+# what happened to each download
+DOWNLOADED = 'downloaded'
+RESUMED = 'resumed'
+UNCHANGED = 'unchanged'
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def get_metadata_path(path):
+	return Path(str(path) + '.meta.json')
+
+
+def get_partial_path(path):
+	return Path(str(path) + '.part')
+
+
+def read_metadata(path):
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+
+def write_metadata(path, metadata):
+	partial_path = Path(str(path) + '.tmp')
+	with open(partial_path, 'w') as f:
+		json.dump(metadata, f, indent=1)
+	os.replace(partial_path, path)
+
+
+def get_validators(response):
+	return {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+
+
+def download(url, path, session=None, timeout=DEFAULT_TIMEOUT):
+	'''
+	Download url to path, skipping it if unchanged since the last download and resuming an interrupted one.
+	Returns a dict of the url, path, status (DOWNLOADED, RESUMED or UNCHANGED) and bytes transferred.
+	'''
+	path = Path(path)
+	path.parent.mkdir(parents=True, exist_ok=True)
+	partial_path = get_partial_path(path)
+	partial_metadata_path = get_metadata_path(partial_path)
+
+	# bodies are kept as sent, so ask for gzip and never let requests decode it (ranges are over the stored bytes)
+	headers = {'Accept-Encoding': 'gzip'}
+
+	metadata = read_metadata(get_metadata_path(path))
+	partial_metadata = read_metadata(partial_metadata_path)
+	offset = partial_path.stat().st_size if partial_path.is_file() and partial_metadata.get('url') == url else 0
+
+	if offset:
+		# only get the rest if the file hasn't changed since the part was downloaded
+		headers['Range'] = 'bytes={}-'.format(offset)
+		validator = partial_metadata.get('etag') or partial_metadata.get('last_modified')
+		if validator:
+			headers['If-Range'] = validator
+	elif path.is_file() and metadata.get('url') == url:
+		if metadata.get('etag'):
+			headers['If-None-Match'] = metadata['etag']
+		if metadata.get('last_modified'):
+			headers['If-Modified-Since'] = metadata['last_modified']
+
+	with (session or requests).get(url, headers=headers, stream=True, timeout=timeout) as response:
+		if response.status_code == 304:
+			return {'url': url, 'path': str(path), 'status': UNCHANGED, 'bytes': 0}
+
+		if response.status_code == 416:
+			# the part is no use (e.g. the file got shorter), start again next time
+			partial_path.unlink(missing_ok=True)
+			partial_metadata_path.unlink(missing_ok=True)
+			raise IOError("Range not satisfiable resuming {}, the partial download was discarded".format(url))
+
+		response.raise_for_status()
+
+		resumed = response.status_code == 206
+		if resumed and not response.headers.get('Content-Range', '').startswith('bytes {}-'.format(offset)):
+			raise IOError("Unexpected Content-Range '{}' resuming {} at {}".format(response.headers.get('Content-Range'), url, offset))
+
+		validators = get_validators(response) if not resumed else {key: partial_metadata.get(key) for key in ('etag', 'last_modified')}
+		if not resumed:
+			write_metadata(partial_metadata_path, dict(validators, url=url))
+
+		transferred = 0
+		with open(partial_path, 'ab' if resumed else 'wb') as f:
+			try:
+				for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+					f.write(chunk)
+					transferred += len(chunk)
+			except urllib3.exceptions.HTTPError as e:
+				# what arrived is kept in the part file for next time
+				raise requests.ConnectionError("Download of {} interrupted after {} bytes, run again to resume".format(url,
+					offset + transferred)) from e
+
+	os.replace(partial_path, path)
+	write_metadata(get_metadata_path(path), dict(validators, url=url, size=path.stat().st_size,
+		content_encoding=response.headers.get('Content-Encoding'), downloaded_at=email.utils.formatdate(usegmt=True)))
+	partial_metadata_path.unlink(missing_ok=True)
+
+	return {'url': url, 'path': str(path), 'status': RESUMED if resumed else DOWNLOADED, 'bytes': transferred}
+
+
+async def download_all_async(downloads, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+	'''
+	Run the downloads (a list of (url, path)) concurrently, at most max_concurrency at a time. Returns a result (see download)
+	or the exception for each, in the same order.
+	'''
+	semaphore = asyncio.Semaphore(max_concurrency)
+
+	async def run(url, path):
+		async with semaphore:
+			return await asyncio.to_thread(download, url, path, None, timeout)
+
+	return await asyncio.gather(*(run(url, path) for url, path in downloads), return_exceptions=True)
+
+
+def download_all(downloads, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+	return asyncio.run(download_all_async(downloads, max_concurrency, timeout))
+
+
+def fetch_bytes(url, timeout=DEFAULT_TIMEOUT):
+	with requests.get(url, timeout=timeout) as response:
+		response.raise_for_status()
+		return response.content
+
+
+async def fetch_all_bytes_async(urls, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+	semaphore = asyncio.Semaphore(max_concurrency)
+
+	async def run(url):
+		async with semaphore:
+			return await asyncio.to_thread(fetch_bytes, url, timeout)
+
+	return await asyncio.gather(*(run(url) for url in urls))
+
+
+def fetch_all_bytes(urls, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+	'''
+	The bodies of several small pages (e.g. the auxiliary tables), fetched concurrently and kept in memory.
+	'''
+	return asyncio.run(fetch_all_bytes_async(urls, max_concurrency, timeout))
+
+
+class DecompressingReader(io.RawIOBase):
+	'''
+	A read-only stream over an iterator of byte chunks, gunzipped on the fly if they start with the gzip magic number (and
+	passed through otherwise). Wrap in io.BufferedReader / io.TextIOWrapper to hand it to pandas.
+	'''
+
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.decompressor = None
+		self.is_compressed = None
+		self.buffer = b''
+		self.finished = False
+
+	def readable(self):
+		return True
+
+	def next_chunk(self):
+		for chunk in self.chunks:
+			if not chunk:
+				continue
+			if self.is_compressed is None:
+				self.is_compressed = chunk[:2] == GZIP_MAGIC
+				# wbits 16 + MAX_WBITS: a gzip stream
+				self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if self.is_compressed else None
+			data = self.decompressor.decompress(chunk) if self.decompressor else chunk
+			if data:
+				return data
+
+		self.finished = True
+		return self.decompressor.flush() if self.decompressor else b''
+
+	def readinto(self, buffer):
+		while not self.buffer and not self.finished:
+			self.buffer = self.next_chunk()
+
+		n = min(len(buffer), len(self.buffer))
+		buffer[:n] = self.buffer[:n]
+		self.buffer = self.buffer[n:]
+		return n
+
+
+def iter_file_chunks(path, chunk_size=CHUNK_SIZE):
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(chunk_size), b''):
+			yield chunk
+
+
+def open_stream(path):
+	'''
+	A binary stream of the (decompressed) contents of a downloaded file.
+	'''
+	return io.BufferedReader(DecompressingReader(iter_file_chunks(path)), CHUNK_SIZE)
+
+
+def open_url_stream(url, timeout=DEFAULT_TIMEOUT):
+	'''
+	A binary stream of the (decompressed) body of url, read as it arrives without saving it. Close it when done.
+	'''
+	response = requests.get(url, stream=True, timeout=timeout)
+	response.raise_for_status()
+	return io.BufferedReader(DecompressingReader(response.iter_content(CHUNK_SIZE)), CHUNK_SIZE)
+
+
+def refresh_archive(url=None, path=None, auxiliary=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+	'''
+	Bring the local copy of the archive export (and any auxiliary (url, path) downloads) up to date.
+	Returns the path of the archive export and the results of all the downloads.
+	'''
+	url = url or consts.get_archive_url()
+	path = path or consts.get_downloaded_archive_path()
+
+	results = download_all([(url, path)] + list(auxiliary or []), max_concurrency)
+	for result in results:
+		if isinstance(result, Exception):
+			print("Error - Download failed: {!r}".format(result))
+		else:
+			print("Info - {status} {url} ({bytes} bytes)".format(**result))
+
+	if isinstance(results[0], Exception) and not Path(path).is_file():
+		raise results[0]
+	return str(path), results
+
+
+# A stand-in for the archive, to check the downloader without the network.
+
+class StandInHandler(BaseHTTPRequestHandler):
+	'''
+	Serves the bytes in server.files (path -> bytes) with an ETag and Last-Modified, honouring If-None-Match /
+	If-Modified-Since, Range / If-Range, and gzip. Drops the connection halfway through a body while server.drop_next is set.
+	'''
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		body = self.server.files.get(self.path)
+		if body is None:
+			self.send_error(404)
+			return
+
+		if 'gzip' in self.headers.get('Accept-Encoding', ''):
+			body = gzip.compress(body, mtime=0)
+			encoding = 'gzip'
+		else:
+			encoding = None
+
+		etag = '"{:08x}"'.format(zlib.crc32(body))
+		last_modified = email.utils.formatdate(self.server.modified_time, usegmt=True)
+		self.server.requests.append((self.path, dict(self.headers)))
+
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		start = 0
+		range_header = self.headers.get('Range')
+		if range_header and self.headers.get('If-Range', etag) in (etag, last_modified):
+			start = int(range_header.split('=')[1].split('-')[0])
+			if start >= len(body):
+				self.send_response(416)
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+				return
+
+		self.send_response(206 if start else 200)
+		self.send_header('ETag', etag)
+		self.send_header('Last-Modified', last_modified)
+		if encoding:
+			self.send_header('Content-Encoding', encoding)
+		if start:
+			self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body)))
+		self.send_header('Content-Length', str(len(body) - start))
+		self.end_headers()
+
+		if self.server.drop_next:
+			self.server.drop_next = False
+			self.wfile.write(body[start:start + (len(body) - start) // 2])
+			self.wfile.flush()
+			self.close_connection = True
+			return
+
+		self.wfile.write(body[start:])
+
+
+def start_stand_in_server(files):
+	'''
+	Serve files (url path -> bytes) on a free localhost port from a background thread. Returns the server, stop it with
+	server.shutdown().
+	'''
+	server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+	server.files = files
+	server.modified_time = time.time()
+	server.drop_next = False
+	server.requests = []
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+def self_check(directory):
+	'''
+	Download from a stand-in server: a fresh download, an unchanged one, an interrupted then resumed one, a changed file,
+	and several at once. Returns a list of (check, ok).
+	'''
+	import pandas as pd
+
+	directory = Path(directory)
+	table = pd.DataFrame({'pl_name': ['Planet {}'.format(i) for i in range(20000)], 'sy_dist': range(20000)})
+	csv = table.to_csv(index=False).encode()
+
+	server = start_stand_in_server({'/ps.csv': csv, '/aux1.csv': b'a,b\n1,2\n', '/aux2.csv': b'c\n3\n'})
+	base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+	path = directory / 'ps.csv.gz'
+	checks = []
+
+	try:
+		first = download(base + '/ps.csv', path)
+		checks.append(('fresh download', first['status'] == DOWNLOADED))
+
+		with open_stream(path) as stream:
+			checks.append(('decompressed while reading', pd.read_csv(stream).equals(table)))
+
+		second = download(base + '/ps.csv', path)
+		checks.append(('unchanged file skipped (304)', second['status'] == UNCHANGED and second['bytes'] == 0))
+
+		# a new version, interrupted halfway then resumed
+		server.files['/ps.csv'] = csv.replace(b'Planet 1,', b'Planet one,')
+		server.drop_next = True
+		try:
+			download(base + '/ps.csv', path)
+			checks.append(('interrupted download raises', False))
+		except requests.ConnectionError:
+			checks.append(('interrupted download raises', get_partial_path(path).is_file()))
+
+		third = download(base + '/ps.csv', path)
+		with open_stream(path) as stream:
+			resumed_table = pd.read_csv(stream)
+		checks.append(('interrupted download resumed', third['status'] == RESUMED and server.requests[-1][1].get('Range') is not None
+			and resumed_table['pl_name'].iloc[1] == 'Planet one'))
+
+		results = download_all([(base + '/aux1.csv', directory / 'aux1.csv'), (base + '/aux2.csv', directory / 'aux2.csv'),
+			(base + '/missing.csv', directory / 'missing.csv')], max_concurrency=2)
+		checks.append(('concurrent downloads', [r['status'] for r in results[:2]] == [DOWNLOADED, DOWNLOADED]
+			and isinstance(results[2], requests.HTTPError)))
+
+		with open_url_stream(base + '/ps.csv') as stream:
+			checks.append(('streamed from the url', len(pd.read_csv(stream)) == len(table)))
+	finally:
+		server.shutdown()
+
+	return checks
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Download the latest archive export (if it has changed).')
+	parser.add_argument('--url', default=None, help='export to download (default: consts.get_archive_url())')
+	parser.add_argument('--output', default=None, help='where to save it (default: consts.get_downloaded_archive_path())')
+	parser.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY)
+	parser.add_argument('--self-check', action='store_true', help='check the downloader against a local stand-in server')
+	args = parser.parse_args(argv)
+
+	if args.self_check:
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			checks = self_check(directory)
+		for check, ok in checks:
+			print("{} {}".format('OK  ' if ok else 'FAIL', check))
+		return 0 if all(ok for _, ok in checks) else 1
+
+	refresh_archive(args.url, args.output, max_concurrency=args.max_concurrency)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,680 @@
+import numpy as np
+import pandas as pd
+import argparse
+import sys
+from pathlib import Path
+
+from . import data_cleansing as dc
+from . import merge_policy as mp
+from . import phys_and_math as pam
+from . import consts as consts
+from . import name_index as ni
+
+# A differential test harness. The original row-wise code is kept here as a reference 'oracle', and any faster implementation
+# is run on the same input and compared column by column. The inputs are the real archive snapshot (if it is on disk) and
+# randomised synthetic tables shaped like the archive.
+#
+# Run with: python3 -m deps.equivalence (add --help for options). Exits with status 1 if anything disagrees.
+
+# differences smaller than this are treated as floating point noise
+DEFAULT_RTOL = 1e-9
+DEFAULT_ATOL = 1e-12
+
+
+# The merge_data_rows of the original program, kept verbatim (only renamed) as the reference for data_cleansing.merge_data_rows.
+# Where the two are meant to differ, the difference is one of MERGE_EXCEPTIONS, and check_merge_data_rows explains each
+# differing row / value by one of them - anything it can't explain is a failure.
+def baseline_merge_data_rows(exoplanets):
+	'''
+	A method to merge data rows as there is a problem at the moment where some data nmay be missed because of empty rows
+	The idea of this method is to consolidate missing values where data exists over multiple rows into one single row as a new
+	dataframe.
+
+	Takes in the exoplanet dataframe
+	Returns another dataframe which sould be more complete than the first.
+
+	By sorting the data alphabetically via planet name, it creates a faster search method for finding if that planet name exists elsewhere
+	in the data.
+
+	'''
+
+	print('Info - Removing duplicates and condensing any missing data from duplicate rows into one single row...')
+
+	# sort the dataframe alphabetically by planet name.
+	exoplanets.sort_values('name_of_planet')
+
+	# properties for the new dataframe
+	len_of_df = len(exoplanets.index)
+
+	index_of_t_df = -1 # start counter from -1 so we dont need a flag system - the actual used value will never be -1 as its incremented
+
+    	# Create a temp dataframe with the columns of exoplanet that we will
+    	# build the final dataset to in the below code.
+	t_df = pd.DataFrame(columns = exoplanets.columns)
+    
+	# create a list of planet names to establish if we are on a new planet, or the same on
+	list_of_planets_processed = []
+
+	# variable to store the name of the planet being iterated over where it is a duplicate
+	name_of_planet_iterating = ""
+
+	# start the iteration
+	for index, row in exoplanets.iterrows():
+        
+        # get the name of the current planet we are iterating over from the dataframe
+		name_of_current_planet = exoplanets.loc[index,'name_of_planet']
+
+		# ensure we don't go out of bounds
+		if index < len_of_df - 1:
+			# Check if the planet in the next or previous row is a match of the planet being iterated over
+			if name_of_current_planet == exoplanets.loc[index + 1,'name_of_planet'] or name_of_current_planet == exoplanets.loc[index - 1,'name_of_planet']:
+
+				# set the name of planet being iterated over which is duplicated in the raw data
+				name_of_planet_iterating = name_of_current_planet
+
+				# check if planet name is in list, if not it is a fresh insert,
+				# if it is in the list then we need to check what rows we need to fill!
+				if name_of_current_planet not in list_of_planets_processed:
+
+					index_of_t_df += 1 # do this first, as it starts from -1
+
+					list_of_planets_processed.append(name_of_current_planet) # add to the list
+					t_df.loc[index_of_t_df] = exoplanets.loc[index] # add the row to the temp database
+
+					# create a list for the missing values that we want to search for in the subsequent rows in the below else
+					missing_data_list = create_dict_of_missing_values_from_row(exoplanets, index)
+
+				else:
+					# Search through the row for any missing values and insert into the row at t_df
+
+					# Iterate through the missing data for the current row, if the data exists then insert into the temp df that gets returned
+					for col in missing_data_list:
+						if pd.notnull(exoplanets.loc[index, col]):
+							t_df.loc[index_of_t_df, col] = exoplanets.loc[index, col]
+
+
+			# if name of current planet isnt something being iterated over, then it is not a duplicate and needs inserting
+			if name_of_current_planet != name_of_planet_iterating:
+				# this will include the rows where there is only 1 row of data for an exoplanet
+				index_of_t_df += 1 # do this first, as it starts from -1
+				t_df.loc[index_of_t_df] = exoplanets.loc[index]
+
+	# Manually tested and no rows missing! Brilliant!
+
+	return t_df
+
+
+def create_dict_of_missing_values_from_row(exoplanets, index):
+	''' 
+	Create a dictionary of missing / nan values from the row that we need to search for in any duplicate data sets
+
+	Returns a list
+	'''
+	missing_data_list = exoplanets.iloc[index].isnull().tolist() # iterate through row and ret true or false for if nan
+	missing_data_dict = dict(zip(exoplanets.columns, missing_data_list)) # convert the list of bools to a dict
+	missing_data_dict = {k: v for k, v in missing_data_dict.items() if v == True} # filter only by true - i.e. the missing ones
+	return list(missing_data_dict.keys()) # return list of keys (i.e. column names)
+
+
+# the intended differences between baseline_merge_data_rows and data_cleansing.merge_data_rows
+MERGE_EXCEPTIONS = {
+	'first_row_lookup': "the baseline looks up row -1 for the first row, a KeyError unless it is a duplicate of the second - "
+		"the first row is given to the baseline twice, which doesn't change the merge (checked)",
+	'last_row_not_read': "the baseline never reads the last row of the table, so misses its planet or the values only it has",
+	'later_duplicate_wins': "the baseline fills a gap from every later duplicate in turn so the last one wins, the merge keeps "
+		"the first non-null value",
+	'merge_policy': "measured values (and their error bars) are chosen by the default merge policy, the smallest relative "
+		"uncertainty (checked against get_expected_merged_row)",
+	'name_key': "rows are grouped on the normalised name, the baseline on the exact name",
+	'not_adjacent': "the baseline only merges duplicates in adjacent rows (its sort_values result is discarded)"
+}
+
+
+def get_row_values(selected, positions, col):
+	return selected[col].iloc[positions].tolist()
+
+
+def values_match(first, second, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Whether two cell values are the same - both missing, numbers within the tolerance, or otherwise equal as text.
+	'''
+	if pd.isnull(first) or pd.isnull(second):
+		return pd.isnull(first) and pd.isnull(second)
+	try:
+		first, second = float(first), float(second)
+	except (TypeError, ValueError):
+		return str(first) == str(second)
+	return abs(first - second) <= atol + rtol * abs(first)
+
+
+def is_one_of(value, values, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	return any(values_match(value, other, rtol, atol) for other in values)
+
+
+def get_relative_uncertainty(value, err_max, err_min):
+	'''
+	The relative uncertainty the default merge policy ranks a measurement by, worked out for one row: the mean of the
+	absolute errors (or the one that is given) over the absolute value, inf without error bars.
+	'''
+	errors = [abs(err) for err in (err_max, err_min) if pd.notnull(err)]
+	if not errors or value == 0:
+		return np.inf
+	rel = (sum(errors) / len(errors)) / abs(value)
+	return rel if np.isfinite(rel) else np.inf
+
+
+def get_expected_merged_row(selected, rows, error_columns):
+	'''
+	What the merge should make of the rows of one planet, worked out row by row: a measured column and its error bars come from
+	the row with the smallest relative uncertainty (the earliest on a tie), every other column is its first non-null value.
+	'''
+	expected = {}
+	for col in selected.columns:
+		values = get_row_values(selected, rows, col)
+		expected[col] = next((value for value in values if pd.notnull(value)), np.nan)
+
+	for col, (err_max, err_min) in error_columns.items():
+		best = None
+		for row in rows:
+			value = selected[col].iloc[row]
+			if pd.isnull(value):
+				continue
+			rel = get_relative_uncertainty(value, selected[err_max].iloc[row], selected[err_min].iloc[row])
+			if best is None or rel < best[0]:
+				best = (rel, row)
+
+		for merged_col in (col, err_max, err_min):
+			expected[merged_col] = np.nan if best is None else selected[merged_col].iloc[best[1]]
+
+	return expected
+
+
+def check_merge_data_rows(selected, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Compare the baseline merge with the one the program runs (data_cleansing.merge_data_rows, default merge policy) on a
+	selected table. Every row or value which differs has to be explained by one of MERGE_EXCEPTIONS, and every value of the
+	merge has to be the one get_expected_merged_row picks from the planet's rows.
+
+	Returns a dict with:
+		exceptions	- exception name -> number of rows / values it explains
+		unexplained	- (planet, column, baseline value, merged value) of the differences none of them explain, column None for
+					  a planet only one side has
+		equivalent	- True if there are none of those
+	'''
+	selected = selected.reset_index(drop=True)
+	names = selected['name_of_planet']
+	exceptions = dict.fromkeys(MERGE_EXCEPTIONS, 0)
+	unexplained = []
+
+	candidate = dc.merge_data_rows(selected.copy())
+
+	baseline_input = selected
+	if len(selected) > 1 and names.iloc[0] != names.iloc[1]:
+		exceptions['first_row_lookup'] += 1
+		baseline_input = pd.concat([selected.iloc[:1], selected], ignore_index=True)
+		# the repeated row mustn't change the merge
+		if not compare_frames(candidate, dc.merge_data_rows(baseline_input.copy()), rtol=rtol, atol=atol)['equivalent']:
+			unexplained.append((names.iloc[0], None, 'first row repeated', 'merge changed'))
+	reference = baseline_merge_data_rows(baseline_input.copy())
+
+	keys = ni.normalise_names(names)
+	rows_of_name = names.groupby(names.to_numpy(), sort=False).indices
+	rows_of_key = pd.Series(np.arange(len(selected))).groupby(keys, sort=False).indices
+	key_of_name = dict(zip(names, keys))
+	last_planet = names.iloc[-1] if len(names) else None
+	error_columns = mp.find_error_columns(selected.columns)
+	policy_columns = set()
+	for col, error_cols in error_columns.items():
+		policy_columns.update((col,) + error_cols)
+
+	def is_not_adjacent(name):
+		rows = rows_of_name[name]
+		return rows[-1] - rows[0] + 1 != len(rows)
+
+	def has_other_spellings(name):
+		return len(rows_of_key[key_of_name[name]]) != len(rows_of_name[name])
+
+	# planets only one side has, or which the baseline has more than once
+	reference_names = reference['name_of_planet']
+	for name in reference_names[reference_names.duplicated()].unique():
+		if is_not_adjacent(name):
+			exceptions['not_adjacent'] += 1
+		else:
+			unexplained.append((name, None, 'duplicate row', None))
+	ref = reference.drop_duplicates('name_of_planet').set_index('name_of_planet')
+	cand = candidate.set_index('name_of_planet')
+
+	for name in ref.index.difference(cand.index):
+		if name in key_of_name and has_other_spellings(name):
+			exceptions['name_key'] += 1
+		else:
+			unexplained.append((name, None, 'row', None))
+	for name in cand.index.difference(ref.index):
+		if name == last_planet:
+			exceptions['last_row_not_read'] += 1
+		else:
+			unexplained.append((name, None, None, 'row'))
+
+	# the values of the planets both have
+	for name in ref.index.intersection(cand.index):
+		rows = rows_of_name[name]
+		expected = get_expected_merged_row(selected, rows_of_key[key_of_name[name]], error_columns)
+		for col in [col for col in ref.columns if col in cand.columns]:
+			ref_value, cand_value = ref.at[name, col], cand.at[name, col]
+
+			# the merge has to pick exactly the value the policy says, whatever the baseline did
+			if not values_match(cand_value, expected[col], rtol, atol):
+				unexplained.append((name, col, ref_value, cand_value))
+				continue
+			if values_match(ref_value, cand_value, rtol, atol):
+				continue
+
+			# the baseline can only have one of the values of the rows it merged (or nothing)
+			if not is_one_of(ref_value, get_row_values(selected, rows, col) + [np.nan], rtol, atol):
+				unexplained.append((name, col, ref_value, cand_value))
+			elif name == last_planet:
+				exceptions['last_row_not_read'] += 1
+			elif has_other_spellings(name):
+				exceptions['name_key'] += 1
+			elif is_not_adjacent(name):
+				exceptions['not_adjacent'] += 1
+			elif col in policy_columns:
+				exceptions['merge_policy'] += 1
+			else:
+				later_values = [value for value in get_row_values(selected, rows[1:], col) if pd.notnull(value)]
+				if pd.isnull(selected[col].iloc[rows[0]]) and later_values and values_match(ref_value, later_values[-1], rtol, atol):
+					exceptions['later_duplicate_wins'] += 1
+				else:
+					unexplained.append((name, col, ref_value, cand_value))
+
+	return {'exceptions': exceptions, 'unexplained': unexplained, 'equivalent': not unexplained}
+
+
+def check_missing_names(selected, missing_fraction=0.05, seed=0, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Rows without a planet name, for every merge strategy. Like the baseline (a missing name never equals its neighbour's),
+	each of them has to be merged as a planet of its own - the same as if it had a name no other row has.
+	'''
+	selected = selected.reset_index(drop=True)
+	is_missing = np.random.default_rng(seed).random(len(selected)) < missing_fraction
+	is_missing[:1] = True
+	with_missing = selected.assign(name_of_planet=selected['name_of_planet'].where(~is_missing, np.nan))
+	placeholders = ['no name {}'.format(i) for i in range(len(selected))]
+	with_placeholders = selected.assign(name_of_planet=selected['name_of_planet'].where(~is_missing, placeholders))
+
+	results = {}
+	for strategy in mp.STRATEGIES:
+		policy = dict.fromkeys(mp.find_error_columns(selected.columns), strategy)
+		try:
+			merged = dc.merge_data_rows(with_missing.copy(), policy)
+		except Exception as e:
+			results[strategy] = {'error': repr(e), 'equivalent': False}
+			continue
+
+		expected = dc.merge_data_rows(with_placeholders.copy(), policy)
+		expected['name_of_planet'] = expected['name_of_planet'].where(~expected['name_of_planet'].isin(placeholders), np.nan)
+		results[strategy] = compare_frames(expected.assign(row=np.arange(len(expected))), merged.assign(row=np.arange(len(merged))),
+			'row', rtol, atol)
+
+	return results
+
+
+def legacy_derive_exoplanet_columns(merged, null_list):
+	'''
+	The row-wise derived columns (compute_data_each_row_of_exoplanet_df called for every row), on a copy of the input.
+	This was derive_exoplanet_columns before the physics moved onto whole columns.
+	'''
+	condensed_exoplanets = merged.copy()
+
+	for index, row in condensed_exoplanets.iterrows():
+		dc.compute_data_each_row_of_exoplanet_df(index, row, condensed_exoplanets, null_list)
+
+	condensed_exoplanets.sort_values(['distance_to_system_in_light_years', 'null_counter'], ascending=[True, True], inplace = True)
+	condensed_exoplanets.drop('null_counter', axis=1, inplace = True)
+
+	return condensed_exoplanets
+
+
+def make_synthetic_archive(n_planets=300, seed=0, max_duplicates=4, missing_fraction=0.3, name_variant_fraction=0.0):
+	'''
+	A random table with the archive's column names: several rows per planet (one per 'publication') with values that
+	scatter a few percent around the planet's true value, error bars, and gaps. name_variant_fraction of the rows write the
+	planet's name another way ('STAR 12b' for 'Star 12 b').
+	'''
+	rng = np.random.default_rng(seed)
+
+	measured = {
+		'pl_orbper': (1, 500), 'pl_orbsmax': (0.01, 3), 'pl_eqt': (150, 1500), 'st_teff': (2500, 7000), 'st_rad': (0.1, 2),
+		'st_mass': (0.1, 2), 'sy_dist': (1, 1000)
+	}
+	unmeasured = {'pl_rade': (0.5, 15), 'pl_radj': (0.05, 1.5), 'pl_bmasse': (0.1, 500), 'pl_bmassj': (0.001, 2)}
+
+	n_rows_per_planet = rng.integers(1, max_duplicates + 1, n_planets)
+	n_rows = int(n_rows_per_planet.sum())
+	planet = np.repeat(np.arange(n_planets), n_rows_per_planet)
+	host = planet // 2
+
+	is_variant = rng.random(n_rows) < name_variant_fraction
+	table = {
+		'pl_name': np.array(['STAR {}{}'.format(h, 'bc'[p % 2]) if variant else 'Star {} {}'.format(h, 'bc'[p % 2])
+			for p, h, variant in zip(planet, host, is_variant)]),
+		'hostname': np.array(['Star {}'.format(h) for h in host]),
+		'discoverymethod': rng.choice(['Transit', 'Radial Velocity', 'Imaging', 'Microlensing'], n_planets)[planet],
+		'disc_year': rng.integers(1995, 2023, n_planets)[planet],
+		'soltype': np.full(n_rows, 'Published Confirmed'),
+		'ra': rng.uniform(0, 360, n_planets)[planet],
+		'dec': rng.uniform(-90, 90, n_planets)[planet]
+	}
+
+	def scatter_values(low, high):
+		true_values = rng.uniform(low, high, n_planets)[planet]
+		values = true_values * rng.uniform(0.95, 1.05, n_rows)
+		values[rng.random(n_rows) < missing_fraction] = np.nan
+		return values
+
+	for col, (low, high) in unmeasured.items():
+		table[col] = scatter_values(low, high)
+
+	for col, (low, high) in measured.items():
+		values = scatter_values(low, high)
+		errors = np.abs(values) * rng.uniform(0.01, 0.2, n_rows)
+		table[col] = values
+		table[col + 'err1'] = np.where(rng.random(n_rows) < missing_fraction, np.nan, errors)
+		table[col + 'err2'] = np.where(rng.random(n_rows) < missing_fraction, np.nan, -errors)
+
+	# the archive is sorted by planet name, so duplicates sit next to each other
+	return pd.DataFrame(table).sort_values('pl_name', kind='stable').reset_index(drop=True)
+
+
+def load_snapshot(input_data_path=None):
+	'''
+	The real archive export, or None if it isn't on disk.
+	'''
+	input_data_path = input_data_path or consts.get_input_data_path()
+	if not Path(input_data_path).is_file():
+		return None
+	return pd.read_excel(input_data_path)
+
+
+def compare_frames(reference, candidate, key_column='name_of_planet', rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Compare two tables row by row, matched on key_column.
+
+	Returns a dict with:
+		rows_only_in_reference / rows_only_in_candidate	- keys present in one table only
+		columns_only_in_reference / columns_only_in_candidate
+		columns	- per column: max absolute difference, max relative difference, rows where only one side is NaN,
+				  and rows that differ beyond the tolerance (non-numeric columns compare as strings)
+		equivalent	- True if there are no row-set mismatches and no differences beyond the tolerance
+	'''
+	report = {}
+
+	ref = reference.drop_duplicates(key_column).set_index(key_column)
+	cand = candidate.drop_duplicates(key_column).set_index(key_column)
+
+	report['duplicate_keys_in_reference'] = int(len(reference) - len(ref))
+	report['duplicate_keys_in_candidate'] = int(len(candidate) - len(cand))
+	report['rows_only_in_reference'] = sorted(map(str, ref.index.difference(cand.index)))
+	report['rows_only_in_candidate'] = sorted(map(str, cand.index.difference(ref.index)))
+	report['columns_only_in_reference'] = sorted(map(str, ref.columns.difference(cand.columns)))
+	report['columns_only_in_candidate'] = sorted(map(str, cand.columns.difference(ref.columns)))
+
+	common_rows = ref.index.intersection(cand.index)
+	common_cols = [col for col in ref.columns if col in cand.columns]
+	ref = ref.loc[common_rows, common_cols]
+	cand = cand.loc[common_rows, common_cols]
+
+	columns = {}
+	equivalent = not (report['rows_only_in_reference'] or report['rows_only_in_candidate'] or
+		report['columns_only_in_reference'] or report['columns_only_in_candidate'] or
+		report['duplicate_keys_in_reference'] or report['duplicate_keys_in_candidate'])
+
+	for col in common_cols:
+		ref_values = pd.to_numeric(ref[col], errors='coerce').to_numpy(dtype=float)
+		cand_values = pd.to_numeric(cand[col], errors='coerce').to_numpy(dtype=float)
+		is_numeric = np.isnan(ref_values).sum() == ref[col].isnull().sum() and np.isnan(cand_values).sum() == cand[col].isnull().sum()
+
+		if is_numeric:
+			ref_nan = np.isnan(ref_values)
+			cand_nan = np.isnan(cand_values)
+			both = ~ref_nan & ~cand_nan
+
+			abs_diff = np.abs(ref_values[both] - cand_values[both])
+			with np.errstate(divide='ignore', invalid='ignore'):
+				rel_diff = np.where(abs_diff == 0, 0, abs_diff / np.abs(ref_values[both]))
+
+			n_nan_mismatch = int((ref_nan != cand_nan).sum())
+			n_different = int((abs_diff > atol + rtol * np.abs(ref_values[both])).sum()) + n_nan_mismatch
+
+			columns[col] = {
+				'max_abs_diff': float(abs_diff.max()) if len(abs_diff) else 0.0,
+				'max_rel_diff': float(rel_diff.max()) if len(rel_diff) else 0.0,
+				'nan_mismatches': n_nan_mismatch,
+				'rows_different': n_different
+			}
+		else:
+			ref_strings = ref[col].astype(str).where(ref[col].notnull(), None)
+			cand_strings = cand[col].astype(str).where(cand[col].notnull(), None)
+			n_different = int((ref_strings != cand_strings).sum() - (ref_strings.isnull() & cand_strings.isnull()).sum())
+			columns[col] = {'rows_different': n_different}
+
+		if n_different:
+			equivalent = False
+
+	report['columns'] = columns
+	report['equivalent'] = equivalent
+	return report
+
+
+def compare_implementations(reference_fn, candidate_fn, args, key_column='name_of_planet', rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Run the reference and candidate on (copies of) the same arguments and compare their output tables.
+	'''
+	reference = reference_fn(*[copy_arg(arg) for arg in args])
+	candidate = candidate_fn(*[copy_arg(arg) for arg in args])
+	return compare_frames(reference, candidate, key_column, rtol, atol)
+
+
+def copy_arg(arg):
+	return arg.copy() if hasattr(arg, 'copy') else arg
+
+
+def compare_arrays(reference, candidate, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Same summary as compare_frames, for one pair of arrays.
+	'''
+	reference = np.asarray(reference, dtype=float)
+	candidate = np.asarray(candidate, dtype=float)
+
+	ref_nan = np.isnan(reference)
+	cand_nan = np.isnan(candidate)
+	both = ~ref_nan & ~cand_nan
+
+	abs_diff = np.abs(reference[both] - candidate[both])
+	with np.errstate(divide='ignore', invalid='ignore'):
+		rel_diff = np.where(abs_diff == 0, 0, abs_diff / np.abs(reference[both]))
+
+	n_different = int((abs_diff > atol + rtol * np.abs(reference[both])).sum() + (ref_nan != cand_nan).sum())
+	return {
+		'max_abs_diff': float(abs_diff.max()) if len(abs_diff) else 0.0,
+		'max_rel_diff': float(rel_diff.max()) if len(rel_diff) else 0.0,
+		'nan_mismatches': int((ref_nan != cand_nan).sum()),
+		'rows_different': n_different,
+		'equivalent': n_different == 0
+	}
+
+
+# The phys_and_math functions of the original program, for one planet at a time, kept as the reference for the ones the program
+# runs on whole columns (only renamed, and without the hand-checked workings in their docstrings - see phys_and_math).
+
+def baseline_calc_habitable_AU_values(radius, temp_of_star):
+	sb_const = 5.67e-8 # Stefan-Boltzmann constant
+
+	area_of_star = (4 * np.pi * (radius**2)) * 1e6 #4(pi)(R^2), multipled by 1e6 to unit convert from km^2 to m^2 to get into S.I. units
+
+	# Calculate the lumin output of the star
+	lumin = sb_const * area_of_star * (temp_of_star**4) # watts
+
+	# calculate solar luminosity based off of sol's luminosity 
+	one_sol = 3.850753858550298e26
+
+	# convert absolute luminosity of the star against the absolute luminosity of our sun
+	lumin = lumin / one_sol
+
+	inner_hab_zone = np.sqrt(lumin/1.1) # hab zone is now in AU
+	outer_hab_zone = np.sqrt(lumin/0.53) # hab zone is now in AU
+
+	return inner_hab_zone, outer_hab_zone, lumin
+
+
+def baseline_compute_density_of_planet(planet_mass_in_kg, planet_radius_compared_to_earth):
+
+	earths_radius = 6371 # km
+	
+	volume = (4/3) * np.pi * ((planet_radius_compared_to_earth * (earths_radius * 1000)) ** 3) # x 1000 for unit conv km to m 
+
+	density = planet_mass_in_kg / volume # kg is the SI for density so doesnt need converting
+
+	return density
+
+
+def baseline_compute_radius_of_star(data_radius):
+
+	radius_of_sun = 695700 # mean radius of the sun to 4.s.f.
+
+	# The stellar_radius from the dataset is measured in units of radius of the sun, so do a simple conversion:
+	actual_radius = radius_of_sun * data_radius
+	return actual_radius
+
+
+def check_phys_and_math(merged, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Compare the original phys_and_math functions called once per row (the baseline_ copies above) with the program's
+	called once on whole columns.
+	'''
+	results = {}
+
+	stellar_radius = merged['stellar_radius'].to_numpy(dtype=float)
+	teff = merged['stellar_effective_temperature_black_body_radiation'].to_numpy(dtype=float)
+	mass_kg = merged['planet_mass_compared_to_earth'].to_numpy(dtype=float) * 5.972e24
+	radius_earth = merged['planet_radius_compared_to_earth'].to_numpy(dtype=float)
+
+	star_radius_km = pam.compute_radius_of_star(stellar_radius)
+	results['compute_radius_of_star'] = compare_arrays(
+		[baseline_compute_radius_of_star(r) for r in stellar_radius], star_radius_km, rtol, atol)
+
+	row_wise = np.array([baseline_calc_habitable_AU_values(r, t) for r, t in zip(star_radius_km, teff)]).reshape(-1, 3)
+	inner, outer, lumin = pam.calc_habitable_AU_values(star_radius_km, teff)
+	results['calc_habitable_AU_values.inner'] = compare_arrays(row_wise[:, 0], inner, rtol, atol)
+	results['calc_habitable_AU_values.outer'] = compare_arrays(row_wise[:, 1], outer, rtol, atol)
+	results['calc_habitable_AU_values.luminosity'] = compare_arrays(row_wise[:, 2], lumin, rtol, atol)
+
+	results['compute_density_of_planet'] = compare_arrays(
+		[baseline_compute_density_of_planet(m, r) for m, r in zip(mass_kg, radius_earth)],
+		pam.compute_density_of_planet(mass_kg, radius_earth), rtol, atol)
+
+	return results
+
+
+def check_spot_values():
+	'''
+	The hand-checked values from the docstrings in phys_and_math, so an optimised version can't drift from them.
+	'''
+	results = {}
+
+	# HD 219134 b: radius 1.602 earths, mass 4.74 earths (2.83e25 kg to 3.s.f) -> 6356.223812 kg m^-3
+	density = pam.compute_density_of_planet(4.74 * 5.972e24, 1.602)
+	results['HD 219134 b density'] = compare_arrays([6356.223812], [density], rtol=1e-6)
+
+	# Proxima Centauri: 0.1542 suns, 3042 K -> 0.001823 L(*) by hand
+	_, _, lumin = pam.calc_habitable_AU_values(pam.compute_radius_of_star(0.1542), 3042)
+	results['Proxima Centauri luminosity'] = compare_arrays([0.001823], [lumin], rtol=1e-3)
+
+	# NY Virginis: 0.151 suns, 32740 K -> 23.46171561 L(*) by hand
+	_, _, lumin = pam.calc_habitable_AU_values(pam.compute_radius_of_star(0.151), 32740)
+	results['NY Virginis luminosity'] = compare_arrays([23.46171561], [lumin], rtol=1e-3)
+
+	return results
+
+
+def run_checks(tables, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+	'''
+	Run every reference / fast pair on each (name, raw archive table). Returns a dict of check name -> report.
+	'''
+	results = {'spot values': check_spot_values()}
+
+	for name, raw in tables:
+		selected = dc.select_columns_exoplanets(raw)
+		null_list = selected.isnull().sum(axis=1).tolist()
+
+		results[name + ': merge_data_rows'] = check_merge_data_rows(selected, rtol, atol)
+		results[name + ': merge_data_rows, rows without a name'] = check_missing_names(selected, rtol=rtol, atol=atol)
+
+		merged = dc.merge_data_rows(selected)
+		results[name + ': phys_and_math'] = check_phys_and_math(merged, rtol, atol)
+
+		results[name + ': derive_exoplanet_columns'] = compare_implementations(legacy_derive_exoplanet_columns,
+			dc.derive_exoplanet_columns, [merged, null_list], rtol=rtol, atol=atol)
+
+	return results
+
+
+def is_equivalent(report):
+	if 'equivalent' in report:
+		return report['equivalent']
+	return all(is_equivalent(sub_report) for sub_report in report.values())
+
+
+def print_report(results):
+	for check, report in results.items():
+		status = 'OK  ' if is_equivalent(report) else 'FAIL'
+		print("{} {}".format(status, check))
+
+		if 'unexplained' in report:
+			for exception, count in report['exceptions'].items():
+				if count:
+					print("\texpected difference, {}: {}".format(exception, count))
+			for difference in report['unexplained'][:10]:
+				print("\tunexplained (planet, column, baseline, merged): {}".format(difference))
+		elif 'columns' in report:
+			for key in ('rows_only_in_reference', 'rows_only_in_candidate', 'columns_only_in_reference', 'columns_only_in_candidate'):
+				if report[key]:
+					print("\t{}: {}".format(key, report[key][:10]))
+			for col, stats in report['columns'].items():
+				if stats['rows_different']:
+					print("\t{}: {}".format(col, stats))
+		else:
+			for sub_check, stats in report.items():
+				if not stats['equivalent']:
+					print("\t{}: {}".format(sub_check, stats))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Compare the row-wise reference implementations against the fast paths.')
+	parser.add_argument('--seeds', type=int, default=5, help='number of random synthetic tables')
+	parser.add_argument('--planets', type=int, default=300, help='planets per synthetic table')
+	parser.add_argument('--name-variants', type=float, default=0.05,
+		help='fraction of the synthetic rows with the planet name written another way')
+	parser.add_argument('--no-snapshot', action='store_true', help="don't include the real archive snapshot")
+	parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL)
+	parser.add_argument('--atol', type=float, default=DEFAULT_ATOL)
+	args = parser.parse_args(argv)
+
+	tables = [('synthetic seed {}'.format(seed), make_synthetic_archive(args.planets, seed,
+		name_variant_fraction=args.name_variants)) for seed in range(args.seeds)]
+
+	if not args.no_snapshot:
+		snapshot = load_snapshot()
+		if snapshot is None:
+			print("Info - Archive snapshot not found, only checking synthetic tables.")
+		else:
+			tables.insert(0, ('snapshot', snapshot))
+
+	results = run_checks(tables, args.rtol, args.atol)
+	print_report(results)
+
+	return 0 if all(is_equivalent(report) for report in results.values()) else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
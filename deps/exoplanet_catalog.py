@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+# The cleaned catalog as a struct of arrays: one contiguous, typed numpy array per column, all the same length. The plotting,
+# report and physics code work on this rather than on a DataFrame, so they aren't paying for pandas indexing or copying columns
+# into temporary dicts / frames over and over. DataFrames are only used at the edges (loading, the xl export, the service).
+#
+# Numeric and boolean columns keep their numpy dtype, everything else (names, discovery method, dates) is an object array.
+#
+# A catalog handed to other stages / threads / the service is frozen first (see deps/catalog_versions.py): its arrays are made
+# read-only, so nothing can change a version while someone is reading it. A derived column is then added with assign(), which
+# returns a new catalog holding the new arrays and sharing every other array with the old one - copy on write, column by
+# column, rather than copying the whole catalog.
+
+
+class ExoplanetCatalog:
+	'''
+	Columns of the catalog as numpy arrays. Index it with a column name to get the array, or with a boolean mask (or array of
+	row positions) to get the matching rows as a new catalog.
+	'''
+	__slots__ = ('columns', 'length', 'frozen')
+
+	def __init__(self, columns, length=None, frozen=False):
+		self.columns = {}
+		self.length = length
+		self.frozen = False
+
+		for name, values in columns.items():
+			self[name] = values
+
+		if self.length is None:
+			self.length = 0
+		if frozen:
+			self.freeze()
+
+	def __getstate__(self):
+		return {'columns': self.columns, 'length': self.length, 'frozen': self.frozen}
+
+	def __setstate__(self, state):
+		# arrays come back from a pickle writeable, so a frozen catalog is frozen again
+		self.columns = state['columns']
+		self.length = state['length']
+		self.frozen = False
+		if state.get('frozen'):
+			self.freeze()
+
+	@classmethod
+	def from_dataframe(cls, df, columns=None):
+		'''
+		Build a catalog from a DataFrame, optionally only from some of its columns (columns it doesn't have are skipped).
+		'''
+		if columns is None:
+			columns = df.columns
+		else:
+			columns = [col for col in columns if col in df.columns]
+
+		return cls({col: to_array(df[col]) for col in columns}, length=len(df))
+
+	def to_dataframe(self, columns=None, index=None):
+		return pd.DataFrame({col: self.columns[col] for col in (columns or self.columns)}, index=index)
+
+	def __len__(self):
+		return self.length
+
+	def __contains__(self, name):
+		return name in self.columns
+
+	def __iter__(self):
+		return iter(self.columns)
+
+	def __getitem__(self, key):
+		if isinstance(key, str):
+			return self.columns[key]
+		return self.subset(key)
+
+	def __setitem__(self, name, values):
+		if self.frozen:
+			raise TypeError("Can't set '{}', the catalog is frozen - use assign() for a new catalog with the column".format(name))
+
+		values = np.asarray(values)
+		if values.ndim == 0:
+			values = np.full(self.length or 0, values)
+		values = np.ascontiguousarray(values)
+
+		if self.length is None:
+			self.length = len(values)
+		elif len(values) != self.length:
+			raise ValueError("Column '{}' has {} rows, the catalog has {}".format(name, len(values), self.length))
+
+		self.columns[name] = values
+
+	def __repr__(self):
+		return "ExoplanetCatalog({} rows, {} columns{})".format(self.length, len(self.columns), ', frozen' if self.frozen else '')
+
+	def freeze(self):
+		'''
+		Make the catalog (and every one of its arrays) read-only, in place. Returns the catalog.
+
+		An array which is a view of memory something else can still write to (e.g. a column of a DataFrame, from to_numpy) is
+		copied first, as marking the view read-only wouldn't stop the DataFrame changing it. Arrays the catalog owns, views of
+		read-only arrays (other frozen catalogs) and memory maps are shared as they are.
+		'''
+		for name, values in self.columns.items():
+			if is_writeable_elsewhere(values):
+				values = self.columns[name] = values.copy()
+			values.setflags(write=False)
+		self.frozen = True
+		return self
+
+	def assign(self, columns):
+		'''
+		A new catalog with the given columns (dict of name -> values) added or replaced. The other arrays are shared with this
+		catalog, not copied. The new catalog is frozen if this one is.
+		'''
+		catalog = ExoplanetCatalog(self.columns, length=self.length)
+		for name, values in columns.items():
+			catalog[name] = values
+		return catalog.freeze() if self.frozen else catalog
+
+	def get_shared_columns(self, other):
+		'''
+		Columns whose array is the same one in both catalogs.
+		'''
+		return [name for name, values in self.columns.items() if other.columns.get(name) is values]
+
+	@property
+	def column_names(self):
+		return list(self.columns)
+
+	@property
+	def nbytes(self):
+		return sum(values.nbytes for values in self.columns.values())
+
+	def get(self, name, default=None):
+		return self.columns.get(name, default)
+
+	def select(self, columns):
+		'''
+		A catalog of just these columns. The arrays are shared, not copied.
+		'''
+		return ExoplanetCatalog({col: self.columns[col] for col in columns}, length=self.length, frozen=self.frozen)
+
+	def subset(self, rows, columns=None):
+		'''
+		The rows picked out by a boolean mask or array of row positions, as a new catalog. Only the given columns are gathered
+		(all of them by default), so taking a subset for one chart doesn't copy the whole catalog.
+		'''
+		rows = np.asarray(rows)
+		length = int(rows.sum()) if rows.dtype == bool else len(rows)
+		return ExoplanetCatalog({col: self.columns[col][rows] for col in (columns or self.columns)}, length=length, frozen=self.frozen)
+
+	def is_complete(self, columns):
+		'''
+		Boolean mask of the rows which have a value in every one of the columns.
+		'''
+		mask = np.ones(self.length, dtype=bool)
+		for col in columns:
+			mask &= ~pd.isnull(self.columns[col])
+		return mask
+
+	def dropna(self, columns):
+		'''
+		Only the given columns, for the rows that have a value in all of them - as we need both x and y values to plot.
+		'''
+		return self.subset(self.is_complete(columns), columns)
+
+
+def is_writeable_elsewhere(values):
+	'''
+	Whether an array is a view into another array which is still writeable.
+	'''
+	base = values
+	while isinstance(base.base, np.ndarray):
+		base = base.base
+	return base is not values and base.flags.writeable
+
+
+def is_copy_on_write():
+	'''
+	Whether pandas shares the data of copies until one is written to (always from pandas 3, an option in pandas 2).
+	'''
+	return int(pd.__version__.split('.')[0]) >= 3 or bool(getattr(pd.options.mode, 'copy_on_write', False))
+
+
+def enable_copy_on_write():
+	'''
+	Turn on pandas copy on write where it's an option, so shallow copies of DataFrames are safe to change (see copy_frame).
+	'''
+	if not is_copy_on_write() and hasattr(pd.options.mode, 'copy_on_write'):
+		pd.options.mode.copy_on_write = True
+
+
+def copy_frame(df):
+	'''
+	A copy of a DataFrame which can be changed without changing df. With copy on write only the columns which are written
+	to are ever copied, otherwise it's a full copy.
+	'''
+	return df.copy(deep=not is_copy_on_write())
+
+
+def to_array(series):
+	'''
+	A column as a contiguous array: numeric / boolean columns keep their dtype, anything else becomes an object array.
+	'''
+	if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+		# nullable extension types (Int64 etc) have to become float to hold the missing values as NaN
+		if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+			return np.ascontiguousarray(series.to_numpy(dtype=float, na_value=np.nan))
+		return np.ascontiguousarray(series.to_numpy())
+
+	return np.ascontiguousarray(series.to_numpy(dtype=object))
+
+
+def as_catalog(data, columns=None):
+	'''
+	Pass catalogs through, convert DataFrames (only the columns asked for, if given). Lets the plotting / report functions take
+	either.
+	'''
+	if isinstance(data, ExoplanetCatalog):
+		return data
+	return ExoplanetCatalog.from_dataframe(data, columns)
+
+
+def as_dataframe(data):
+	'''
+	Pass DataFrames through, convert catalogs - for the code which needs pandas (group-bys, exports).
+	'''
+	if isinstance(data, ExoplanetCatalog):
+		return data.to_dataframe()
+	return data
+
+
+def is_in(values, test_values):
+	'''
+	Boolean mask of the values which are in test_values. Hash based, so it works on object arrays of names.
+	'''
+	return pd.Index(values).isin(np.asarray(test_values, dtype=object))
+
+
+def is_first_occurrence(values):
+	'''
+	Boolean mask which is True for the first time each value appears.
+	'''
+	return ~pd.Index(values).duplicated(keep='first')
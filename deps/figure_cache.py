@@ -0,0 +1,118 @@
+import numpy as np
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import matplotlib
+
+# Fingerprinting for the charts in plot_logic. Each figure's fingerprint is a hash of the exact arrays plotted, the title, the
+# styling, the matplotlib version and the source of the chart code (CHART_SOURCES - the labels, colours and layout written into
+# the plotting functions are part of how a chart looks too). It is stored in a manifest next to the png, so if nothing has
+# changed since the last run the figure isn't drawn and saved again.
+
+MANIFEST_NAME = 'figure_manifest.json'
+
+# the files of this package the charts are drawn by, any change to them renders every chart again
+CHART_SOURCES = ('plot_logic.py', 'figure_manager.py')
+
+# hash of CHART_SOURCES, worked out once per run
+chart_code_hash = None
+
+# set to True (explore.py --force-plots) to re-render every figure regardless of the manifest
+force_render = False
+
+# manifest path -> dict of png name -> fingerprint, loaded once per run
+loaded_manifests = {}
+
+
+def set_force_render(force):
+	global force_render
+	force_render = bool(force)
+
+
+def get_chart_code_hash():
+	global chart_code_hash
+	if chart_code_hash is None:
+		h = hashlib.sha256()
+		for file_name in CHART_SOURCES:
+			h.update((Path(__file__).parent / file_name).read_bytes())
+		chart_code_hash = h.hexdigest()
+	return chart_code_hash
+
+
+def compute_fingerprint(arrays, title, style):
+	'''
+	Hash the inputs of a figure. arrays is a list of the exact arrays plotted, style a dict of anything else which changes the
+	look of the chart (labels, marker sizes, bins, extra points etc.) that isn't written into the chart code.
+	'''
+	h = hashlib.sha256()
+	h.update(matplotlib.__version__.encode())
+	h.update(get_chart_code_hash().encode())
+	h.update(str(title).encode())
+	h.update(json.dumps(style, sort_keys=True, default=str).encode())
+
+	for arr in arrays:
+		arr = np.ascontiguousarray(arr)
+		h.update(str(arr.dtype).encode())
+		h.update(str(arr.shape).encode())
+		if arr.dtype == object:
+			h.update(json.dumps(arr.tolist(), default=str).encode())
+		else:
+			h.update(arr.tobytes())
+
+	return h.hexdigest()
+
+
+def can_cache(savepath):
+	# charts rendered into a buffer (e.g. by the catalog service) have no file to compare against
+	return isinstance(savepath, (str, Path))
+
+
+def get_manifest_path(savepath):
+	return Path(savepath).parent / MANIFEST_NAME
+
+
+def load_manifest(manifest_path):
+	key = str(manifest_path)
+	if key not in loaded_manifests:
+		try:
+			with open(manifest_path) as f:
+				loaded_manifests[key] = json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			loaded_manifests[key] = {}
+
+	return loaded_manifests[key]
+
+
+def is_figure_up_to_date(savepath, fingerprint):
+	'''
+	True if the png exists and was rendered from exactly the same inputs, in which case the caller can skip it.
+	'''
+	if force_render or not can_cache(savepath) or not Path(savepath).is_file():
+		return False
+
+	manifest = load_manifest(get_manifest_path(savepath))
+	if manifest.get(Path(savepath).name) == fingerprint:
+		print("Info - {} is unchanged, skipping.".format(savepath))
+		return True
+
+	return False
+
+
+def record_figure(savepath, fingerprint):
+	'''
+	Store the fingerprint of a figure that has just been saved. The manifest is written to a temp file and swapped in
+	so a crash mid-write can't leave it corrupt.
+	'''
+	if not can_cache(savepath):
+		return
+
+	manifest_path = get_manifest_path(savepath)
+	manifest = load_manifest(manifest_path)
+	manifest[Path(savepath).name] = fingerprint
+
+	tmp_path = str(manifest_path) + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.replace(tmp_path, manifest_path)
@@ -0,0 +1,68 @@
+import threading
+from contextlib import contextmanager
+
+import matplotlib.pyplot as plt
+
+# Owns the matplotlib figures the charts in plot_logic are drawn on. pyplot keeps every figure it creates alive until it is
+# closed, so drawing on the implicit global figure, or calling plt.figure() for each chart, grows the process for as long as
+# it keeps rendering (the catalog service, loops over subsets / snapshots).
+#
+# Each chart is drawn inside 'with figure_manager.figure(figsize):'. There is one figure per size, created the first time it
+# is needed and then cleared and reused by every chart of that size; the pyplot calls inside the block draw on it as the
+# current figure. When the block exits the figure is cleared so none of its artists (or the data they hold) outlive the chart.
+#
+# The soak check that memory stays flat however many charts are drawn is in deps/figure_soak.py.
+
+# figsize (None for matplotlib's default) -> the figure used for charts of that size
+figures = {}
+FIGURE_LABEL = 'plot_logic {}'
+
+# only one chart can be drawn at a time, as the pyplot calls all act on the current figure
+figure_lock = threading.RLock()
+
+
+def get_figure(figsize=None):
+	'''
+	The figure for charts of this size, cleared and made the current pyplot figure.
+	'''
+	key = tuple(figsize) if figsize is not None else None
+
+	fig = figures.get(key)
+	if fig is None or not plt.fignum_exists(fig.number):
+		fig = figures[key] = plt.figure(num=FIGURE_LABEL.format(key or 'default'), figsize=figsize)
+	else:
+		plt.figure(fig.number)
+		fig.clf()
+
+	return fig
+
+
+@contextmanager
+def figure(figsize=None):
+	'''
+	Draw a chart: the pyplot calls inside the block draw on the managed figure of this size, which is cleared afterwards.
+	'''
+	with figure_lock:
+		fig = get_figure(figsize)
+		try:
+			yield fig
+		finally:
+			fig.clf()
+
+
+def get_unmanaged_figure_count():
+	'''
+	Number of open pyplot figures which aren't managed here, i.e. left open by something.
+	'''
+	prefix = FIGURE_LABEL.format('')
+	return sum(not label.startswith(prefix) for label in plt.get_figlabels())
+
+
+def close_all():
+	'''
+	Close the managed figures (they are created again if needed).
+	'''
+	with figure_lock:
+		for fig in figures.values():
+			plt.close(fig)
+		figures.clear()
@@ -0,0 +1,101 @@
+import gc
+import io
+import os
+import sys
+import argparse
+
+import matplotlib
+
+from . import figure_manager as fm
+from . import equivalence as eq
+from . import catalog_build as cb
+
+# Soak check for deps/figure_manager.py: render every plot_logic chart over and over (into memory, nothing is written) on a
+# synthetic catalog and check the memory use of the process stays flat and no figures are left open. Kept out of the modules
+# the charts import, as it builds its own catalog.
+#
+# Run with: python3 -m deps.figure_soak. The default is a real soak of 300 rounds (about 3600 charts, six minutes or so);
+# '--rounds 20' is a quick smoke run.
+
+DEFAULT_ROUNDS = 300
+
+
+def get_rss_mb():
+	'''
+	Resident memory of this process in MB (Linux reads /proc, elsewhere the peak from getrusage).
+	'''
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+	except OSError:
+		import resource
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		# kB on Linux, bytes on macOS
+		return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def render_charts(exoplanets, habitable):
+	'''
+	Draw every plot_logic chart once, into memory.
+	'''
+	from . import plot_logic as pl
+
+	pl.scatter_plot_for_planet_mass_vs_solar_temp(exoplanets, io.BytesIO(), 'scatter')
+	pl.histogram_exoplanets_per_star(exoplanets, io.BytesIO(), 'histogram')
+	pl.graph_density(exoplanets, io.BytesIO(), io.BytesIO(), hab=0)
+	pl.graph_density(habitable, io.BytesIO(), io.BytesIO(), hab=1)
+	pl.graph_gravity(exoplanets, habitable, io.BytesIO(), io.BytesIO(), io.BytesIO(), io.BytesIO(), io.BytesIO())
+	pl.graph_black_body_spectrum(exoplanets, io.BytesIO(), 'spectrum')
+
+
+def soak_check(n_rounds=DEFAULT_ROUNDS, warmup_rounds=5, max_growth_mb=25.0, n_planets=500):
+	'''
+	Render all the charts n_rounds times (on a synthetic catalog, built by the same stages as a normal run) and check the
+	memory use after the warm up rounds doesn't grow by more than max_growth_mb, and that no figures are left open besides
+	the managed ones. Returns (ok, message).
+	'''
+	exoplanets = cb.build_catalog(eq.make_synthetic_archive(n_planets, seed=0))
+	habitable = exoplanets[exoplanets['is_planet_habitable'] == 1]
+
+	for _ in range(warmup_rounds):
+		render_charts(exoplanets, habitable)
+	gc.collect()
+	start_mb = get_rss_mb()
+
+	for _ in range(n_rounds):
+		render_charts(exoplanets, habitable)
+	gc.collect()
+	end_mb = get_rss_mb()
+
+	unmanaged_figures = fm.get_unmanaged_figure_count()
+	ok = end_mb - start_mb <= max_growth_mb and unmanaged_figures == 0
+	message = "{} rounds of every chart: {:.1f} MB -> {:.1f} MB ({:+.1f} MB, limit {} MB), {} unmanaged figures open".format(
+		n_rounds, start_mb, end_mb, end_mb - start_mb, max_growth_mb, unmanaged_figures)
+	return ok, message
+
+
+def check_memory_is_flat(rounds=DEFAULT_ROUNDS, max_growth_mb=25.0, verbose=False):
+	'''
+	The memory check: True if rendering every chart rounds times (after a few warm up rounds) grows the process by no more
+	than max_growth_mb and leaves no unmanaged figures open.
+	'''
+	ok, message = soak_check(rounds, max_growth_mb=max_growth_mb)
+	if verbose or not ok:
+		print(("OK   " if ok else "FAIL ") + message)
+	return ok
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Render the charts many times and check the memory use stays flat.')
+	parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+		help='rounds of rendering every chart (about 12 charts a round), 20 for a smoke run (default: %(default)s)')
+	parser.add_argument('--max-growth-mb', type=float, default=25.0)
+	args = parser.parse_args(argv)
+
+	matplotlib.use('Agg')
+
+	return 0 if check_memory_is_flat(args.rounds, args.max_growth_mb, verbose=True) else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
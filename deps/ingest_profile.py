@@ -0,0 +1,229 @@
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from . import name_index as ni
+
+# Checks and profiles the archive table as it is read in, in one pass over it. The selected table (after
+# data_cleansing.select_columns_exoplanets) is split into its numeric and text columns once, and from those two blocks:
+#	- the expected columns are there, with the expected kind of values (numbers / text)
+#	- the number of nulls in each row, which the merge uses to prefer the most complete rows (the null_counter)
+#	- the fraction of nulls, min, max and the number of out of range values of each column - negative radii, zero stellar
+#	  temperatures, discovery years before the first exoplanet and so on
+#	- planet names which are written differently but reduce to the same key (see deps/name_index.py), as the merge would
+#	  take them to be one planet
+#
+# Problems are reported, not fatal: each export of the archive differs a little (more rows, a column changing type), and a
+# row count that doesn't match the one export this was written against shouldn't stop the run. Only the columns the cleaning
+# can't do without missing is an error.
+
+# smallest value above zero, for the columns which have to be positive
+POSITIVE = (np.nextafter(0, 1), np.inf)
+
+# column of the selected table -> kind of values and the (inclusive) range of valid values, None for no range check
+COLUMN_SCHEMA = {
+	'name_of_planet': ('text', None),
+	'name_of_host_star': ('text', None),
+	'discoverymethod': ('text', None),
+	'disc_year': ('numeric', (1989, 2100)),
+	'solution_type': ('text', None),
+	'orbital_period': ('numeric', POSITIVE),
+	'orbital_period_error_max': ('numeric', None),
+	'orbital_period_error_min': ('numeric', None),
+	'orbital_period_widest_radius_in_AU': ('numeric', POSITIVE),
+	'orbital_period_widest_radius_in_AU_error_max': ('numeric', None),
+	'orbital_period_widest_radius_in_AU_error_min': ('numeric', None),
+	'planet_radius_compared_to_earth': ('numeric', POSITIVE),
+	'planet_radius_compared_to_jupiter': ('numeric', POSITIVE),
+	'planet_mass_compared_to_earth': ('numeric', POSITIVE),
+	'planet_mass_compared_to_jupiter': ('numeric', POSITIVE),
+	'equilibrium_temperature_K': ('numeric', POSITIVE),
+	'equilibrium_temperature_K_error_max': ('numeric', None),
+	'equilibrium_temperature_K_error_min': ('numeric', None),
+	'stellar_effective_temperature_black_body_radiation': ('numeric', POSITIVE),
+	'stellar_effective_temperature_black_body_radiation_error_max': ('numeric', None),
+	'stellar_effective_temperature_black_body_radiation_error_min': ('numeric', None),
+	'stellar_radius': ('numeric', POSITIVE),
+	'stellar_radius_error_max': ('numeric', None),
+	'stellar_radius_error_min': ('numeric', None),
+	'mass_of_star_compared_to_sol': ('numeric', POSITIVE),
+	'mass_of_star_compared_to_sol_error_max': ('numeric', None),
+	'mass_of_star_compared_to_sol_error_min': ('numeric', None),
+	'distance_to_system_in_light_years': ('numeric', POSITIVE),
+	'distance_to_system_in_light_years_error_max': ('numeric', None),
+	'distance_to_system_in_light_years_error_min': ('numeric', None),
+	# optional, not in every export
+	'publication_date': ('text', None),
+	'right_ascension_degrees': ('numeric', (0, 360)),
+	'declination_degrees': ('numeric', (-90, 90))
+}
+
+OPTIONAL_COLUMNS = ['publication_date', 'right_ascension_degrees', 'declination_degrees']
+
+# columns of the archive select_columns_exoplanets can't do without (the rest of COLUMN_SCHEMA are renames of these)
+REQUIRED_ARCHIVE_COLUMNS = ['pl_name', 'hostname', 'discoverymethod', 'disc_year', 'soltype', 'pl_orbper', 'pl_orbpererr1',
+	'pl_orbpererr2', 'pl_orbsmax', 'pl_orbsmaxerr1', 'pl_orbsmaxerr2', 'pl_rade', 'pl_radj', 'pl_bmasse', 'pl_bmassj',
+	'pl_eqt', 'pl_eqterr1', 'pl_eqterr2', 'st_teff', 'st_tefferr1', 'st_tefferr2', 'st_rad', 'st_raderr1', 'st_raderr2',
+	'st_mass', 'st_masserr1', 'st_masserr2', 'sy_dist', 'sy_disterr1', 'sy_disterr2']
+
+
+def check_archive_columns(df):
+	'''
+	Exit with the names of any columns the cleaning needs which aren't in the archive export - there's no carrying on
+	without them. Column names only, so this doesn't read the data.
+	'''
+	missing = [col for col in REQUIRED_ARCHIVE_COLUMNS if col not in df.columns]
+	if missing:
+		sys.exit("Error - The archive export is missing the columns {}.. exiting.".format(', '.join(missing)))
+
+
+def to_numeric_block(df, columns):
+	'''
+	The numeric columns as one float array (a column per column). Values which aren't numbers become NaN and are counted,
+	returns (values, the nulls as read (not counting the values which aren't numbers), number of non-numeric values in each
+	column).
+	'''
+	values = np.empty((len(df), len(columns)), dtype=float)
+	nulls = np.empty((len(df), len(columns)), dtype=bool)
+	n_not_numeric = np.zeros(len(columns), dtype=np.int64)
+
+	for i, col in enumerate(columns):
+		column = df[col]
+		if pd.api.types.is_numeric_dtype(column.dtype) and not pd.api.types.is_bool_dtype(column.dtype):
+			values[:, i] = column.to_numpy(dtype=float, na_value=np.nan)
+			nulls[:, i] = np.isnan(values[:, i])
+		else:
+			# e.g. a column of numbers with a stray bit of text, read in as objects
+			converted = pd.to_numeric(column, errors='coerce')
+			values[:, i] = converted.to_numpy(dtype=float, na_value=np.nan)
+			nulls[:, i] = column.isnull().to_numpy()
+			n_not_numeric[i] = int((converted.isnull() & column.notnull()).sum())
+
+	return values, nulls, n_not_numeric
+
+
+def profile_table(exoplanets, expected_rows=None):
+	'''
+	Profile the selected table (see above). expected_rows is the number of rows the export should have, None if it isn't
+	known (a downloaded export, a filtered run).
+
+	Returns a dict of:
+		n_rows			number of rows
+		null_counts		number of nulls in each row (over every column of the table), as a list
+		columns			DataFrame with a row per column of COLUMN_SCHEMA: kind, dtype, null_fraction, min, max,
+						not_numeric and out_of_range counts
+		issues			list of the problems found, as text
+	'''
+	n_rows = len(exoplanets)
+	issues = []
+
+	if expected_rows is not None and n_rows != expected_rows:
+		issues.append("expected {} rows, read {}".format(expected_rows, n_rows))
+
+	missing = [col for col in COLUMN_SCHEMA if col not in exoplanets.columns and col not in OPTIONAL_COLUMNS]
+	if missing:
+		issues.append("missing columns {}".format(', '.join(missing)))
+
+	numeric_columns = [col for col, (kind, _) in COLUMN_SCHEMA.items() if kind == 'numeric' and col in exoplanets.columns]
+	text_columns = [col for col, (kind, _) in COLUMN_SCHEMA.items() if kind == 'text' and col in exoplanets.columns]
+	# anything else (e.g. the empty columns added for the derived values) only counts towards the nulls
+	other_columns = [col for col in exoplanets.columns if col not in COLUMN_SCHEMA]
+
+	values, numeric_nulls, n_not_numeric = to_numeric_block(exoplanets, numeric_columns)
+	text_nulls = pd.isnull(exoplanets[text_columns].to_numpy(dtype=object))
+	other_nulls = pd.isnull(exoplanets[other_columns].to_numpy(dtype=object))
+
+	# the null_counter - the same as exoplanets.isnull().sum(axis=1), so a value which isn't a number counts as a value
+	# here (it is reported below) as it always has
+	null_counts = numeric_nulls.sum(axis=1) + text_nulls.sum(axis=1) + other_nulls.sum(axis=1)
+
+	# min / max / out of range of every numeric column at once; NaNs compare False so are never out of range
+	low = np.array([(COLUMN_SCHEMA[col][1] or (-np.inf, np.inf))[0] for col in numeric_columns], dtype=float)
+	high = np.array([(COLUMN_SCHEMA[col][1] or (-np.inf, np.inf))[1] for col in numeric_columns], dtype=float)
+	out_of_range = ((values < low) | (values > high)).sum(axis=0)
+
+	# fmin / fmax skip the NaNs, columns with no numbers at all get NaN
+	has_values = ~np.isnan(values).all(axis=0)
+	col_min = np.where(has_values, np.fmin.reduce(values, axis=0, initial=np.inf), np.nan)
+	col_max = np.where(has_values, np.fmax.reduce(values, axis=0, initial=-np.inf), np.nan)
+
+	numeric = pd.DataFrame({
+		'kind': 'numeric',
+		'dtype': [str(exoplanets[col].dtype) for col in numeric_columns],
+		'null_fraction': numeric_nulls.sum(axis=0) / max(n_rows, 1),
+		'min': col_min,
+		'max': col_max,
+		'not_numeric': n_not_numeric,
+		'out_of_range': out_of_range
+	}, index=pd.Index(numeric_columns, name='column'))
+	text = pd.DataFrame({
+		'kind': 'text',
+		'dtype': [str(exoplanets[col].dtype) for col in text_columns],
+		'null_fraction': text_nulls.sum(axis=0) / max(n_rows, 1),
+		'min': np.nan,
+		'max': np.nan,
+		'not_numeric': 0,
+		'out_of_range': 0
+	}, index=pd.Index(text_columns, name='column'))
+	columns = pd.concat([numeric, text]).reindex([col for col in COLUMN_SCHEMA if col in exoplanets.columns])
+
+	for col, row in columns.iterrows():
+		if row['not_numeric']:
+			issues.append("{}: {} values aren't numbers".format(col, row['not_numeric']))
+		if row['out_of_range']:
+			valid = COLUMN_SCHEMA[col][1]
+			issues.append("{}: {} values out of range ({})".format(col, row['out_of_range'],
+				'> 0' if valid == POSITIVE else '{} to {}'.format(*valid)))
+
+	# the merge groups a planet's rows on the key of its name, so two planets whose names share a key would be merged together
+	if 'name_of_planet' in exoplanets.columns:
+		collisions = ni.find_key_collisions(exoplanets['name_of_planet'])
+		if collisions:
+			issues.append("name_of_planet: {} key(s) shared by differently written names, which are merged as one planet, "
+				"e.g. {}".format(len(collisions), ' / '.join(next(iter(collisions.values())))))
+
+	return {'n_rows': n_rows, 'null_counts': null_counts.tolist(), 'columns': columns, 'issues': issues}
+
+
+def format_profile(profile):
+	'''
+	The profile as text, for printing / writing to a file.
+	'''
+	lines = ["Ingest profile - {} rows, {} issue(s)".format(profile['n_rows'], len(profile['issues']))]
+	lines += ["Warning - {}".format(issue) for issue in profile['issues']]
+	lines.append('')
+	with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+		lines.append(profile['columns'].to_string(float_format=lambda value: '{:.6g}'.format(value)))
+	return '\n'.join(lines) + '\n'
+
+
+def write_profile_report(profile, savepath):
+	'''
+	Print the issues found and write the whole profile to savepath.
+	'''
+	for issue in profile['issues']:
+		print("Warning - {}".format(issue))
+
+	with open(savepath, 'w') as f:
+		f.write(format_profile(profile))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Profile an export of the archive (xl or csv, gzipped or not).')
+	parser.add_argument('path', help='the archive export')
+	parser.add_argument('--expected-rows', type=int, default=None)
+	args = parser.parse_args(argv)
+
+	from . import data_cleansing as dc
+
+	raw = dc.read_archive_table(args.path)
+	check_archive_columns(raw)
+	profile = profile_table(dc.select_columns_exoplanets(raw), args.expected_rows)
+	print(format_profile(profile), end='')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
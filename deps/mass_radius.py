@@ -0,0 +1,142 @@
+import numpy as np
+
+# Fill in a planet's missing mass or radius from the one that was measured, using the piecewise power-law mass-radius relation
+# of Chen & Kipping (2017), 'Probabilistic Forecasting of the Masses and Radii of Other Worlds' (https://arxiv.org/abs/1603.08614).
+# Gravity, density and the gas / rocky / iron flag all need both, so without this a large part of the archive is never
+# considered for habitability.
+#
+# Everything is done on whole columns at once, and each imputed value is flagged in a provenance column:
+#	0 = measured, 1 = imputed from the mass-radius relation, -1 = neither mass nor radius known
+
+MEASURED = 0
+IMPUTED = 1
+UNKNOWN = -1
+
+EARTH_MASSES_PER_JUPITER_MASS = 317.83
+EARTH_RADII_PER_JUPITER_RADIUS = 11.209
+
+# Regimes of the relation, R = C x M^S (earth units). Each is (upper mass limit, power S, log10 scatter of R).
+# Terran < 2.04 earth masses, Neptunian < 0.414 jupiter masses, Jovian < 0.08 solar masses, then stars.
+REGIMES = [
+	(2.04, 0.279, 0.0403),
+	(0.414 * EARTH_MASSES_PER_JUPITER_MASS, 0.589, 0.146),
+	(0.0800 * 332946, -0.044, 0.0739),
+	(np.inf, 0.881, 0.0440)
+]
+TERRAN_CONSTANT = 1.008
+
+# Above this radius (earth radii) the relation is degenerate - Jovian planets are all about the same size whatever
+# their mass - so a radius only tells us it is a gas giant. They are given a typical mass of 1 jupiter mass.
+DEGENERATE_RADIUS = 10.0
+TYPICAL_JOVIAN_MASS = EARTH_MASSES_PER_JUPITER_MASS
+
+
+def get_regime_constants():
+	'''
+	The lower mass limit, constant C and power S of each regime. C is chained from the terran constant so the relation is
+	continuous at each boundary.
+	'''
+	lower = 0.0
+	constant = TERRAN_CONSTANT
+	constants = []
+
+	for upper, power, scatter in REGIMES:
+		constants.append((lower, upper, constant, power, scatter))
+		if np.isfinite(upper):
+			# radius at the boundary, so the next regime starts from the same radius
+			boundary_radius = constant * upper**power
+			next_power = REGIMES[len(constants)][1]
+			constant = boundary_radius / upper**next_power
+		lower = upper
+
+	return constants
+
+
+def radius_from_mass(mass_earth, scatter=False, rng=None):
+	'''
+	Radius (earth radii) of each planet from its mass (earth masses). With scatter, each radius is drawn from the
+	log-normal intrinsic scatter of its regime instead of the mean relation.
+	'''
+	mass_earth = np.asarray(mass_earth, dtype=float)
+	radius = np.full(mass_earth.shape, np.nan)
+
+	for lower, upper, constant, power, sigma in get_regime_constants():
+		in_regime = (mass_earth >= lower) & (mass_earth < upper)
+		radius[in_regime] = constant * mass_earth[in_regime]**power
+
+		if scatter:
+			rng = rng or np.random.default_rng()
+			radius[in_regime] *= 10**rng.normal(0, sigma, in_regime.sum())
+
+	return radius
+
+
+def mass_from_radius(radius_earth, scatter=False, rng=None):
+	'''
+	Mass (earth masses) of each planet from its radius (earth radii), inverting the terran and neptunian regimes. Anything
+	bigger than DEGENERATE_RADIUS is given TYPICAL_JOVIAN_MASS. With scatter, the radius is perturbed by the regime's scatter
+	before inverting.
+	'''
+	radius_earth = np.asarray(radius_earth, dtype=float)
+	mass = np.full(radius_earth.shape, np.nan)
+
+	terran, neptunian = get_regime_constants()[:2]
+	boundary_radius = terran[2] * terran[1]**terran[3]
+
+	for (lower, upper, constant, power, sigma), in_regime in (
+			(terran, radius_earth < boundary_radius),
+			(neptunian, (radius_earth >= boundary_radius) & (radius_earth < DEGENERATE_RADIUS))):
+		radius = radius_earth[in_regime]
+		if scatter:
+			rng = rng or np.random.default_rng()
+			radius = radius * 10**rng.normal(0, sigma, in_regime.sum())
+		mass[in_regime] = (radius / constant)**(1 / power)
+
+	mass[radius_earth >= DEGENERATE_RADIUS] = TYPICAL_JOVIAN_MASS
+	return mass
+
+
+def impute_mass_and_radius(exoplanets, scatter=False, seed=None):
+	'''
+	Fill missing planet_mass_compared_to_earth / planet_radius_compared_to_earth in one pass over the whole table:
+		* first from the jupiter-unit columns where those were given (that's still a measurement),
+		* then from the mass-radius relation where only one of the two is known.
+
+	Adds 'planet_mass_provenance' and 'planet_radius_provenance' (0 measured, 1 imputed, -1 unknown). Run on the merged table,
+	before the derived columns are computed. Returns the dataframe.
+	'''
+	rng = np.random.default_rng(seed) if scatter else None
+
+	mass = exoplanets['planet_mass_compared_to_earth'].to_numpy(dtype=float, copy=True)
+	radius = exoplanets['planet_radius_compared_to_earth'].to_numpy(dtype=float, copy=True)
+
+	if 'planet_mass_compared_to_jupiter' in exoplanets.columns:
+		from_jupiter = np.isnan(mass)
+		mass[from_jupiter] = exoplanets['planet_mass_compared_to_jupiter'].to_numpy(dtype=float)[from_jupiter] * EARTH_MASSES_PER_JUPITER_MASS
+	if 'planet_radius_compared_to_jupiter' in exoplanets.columns:
+		from_jupiter = np.isnan(radius)
+		radius[from_jupiter] = exoplanets['planet_radius_compared_to_jupiter'].to_numpy(dtype=float)[from_jupiter] * EARTH_RADII_PER_JUPITER_RADIUS
+
+	has_mass = ~np.isnan(mass)
+	has_radius = ~np.isnan(radius)
+
+	mass_provenance = np.where(has_mass, MEASURED, UNKNOWN)
+	radius_provenance = np.where(has_radius, MEASURED, UNKNOWN)
+
+	needs_radius = has_mass & ~has_radius
+	radius[needs_radius] = radius_from_mass(mass[needs_radius], scatter, rng)
+	radius_provenance[needs_radius] = IMPUTED
+
+	needs_mass = has_radius & ~has_mass
+	mass[needs_mass] = mass_from_radius(radius[needs_mass], scatter, rng)
+	mass_provenance[needs_mass] = IMPUTED
+
+	exoplanets['planet_mass_compared_to_earth'] = mass
+	exoplanets['planet_radius_compared_to_earth'] = radius
+	exoplanets['planet_mass_provenance'] = mass_provenance
+	exoplanets['planet_radius_provenance'] = radius_provenance
+
+	print("Info - Imputed {} planet radii and {} planet masses from the mass-radius relation.".format(
+		int(needs_radius.sum()), int(needs_mass.sum())))
+
+	return exoplanets
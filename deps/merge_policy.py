@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+# A small 'policy engine' to decide which measurement to keep when a planet has several rows in the archive (one per publication).
+# Every strategy works on whole columns at once using the integer group code of each row, so there are no row loops here - the
+# old version of merge_data_rows iterated every row of the archive which was the slowest part of the whole program.
+
+FIRST_NON_NULL = 'first_non_null'
+SMALLEST_RELATIVE_UNCERTAINTY = 'smallest_relative_uncertainty'
+MOST_RECENT = 'most_recent'
+INVERSE_VARIANCE_MEAN = 'inverse_variance_mean'
+
+STRATEGIES = (FIRST_NON_NULL, SMALLEST_RELATIVE_UNCERTAINTY, MOST_RECENT, INVERSE_VARIANCE_MEAN)
+
+# columns used (in order of preference) to decide which row is the 'most recent' measurement
+RECENCY_COLUMNS = ('publication_date', 'disc_year')
+
+
+def find_error_columns(columns):
+	'''
+	Pair up each measured column with its error columns, e.g. 'orbital_period' -> ('orbital_period_error_max', 'orbital_period_error_min').
+
+	Only columns where both the max and min error columns exist are returned.
+
+	Returns a dict of column name -> (error max column, error min column)
+	'''
+	columns = list(columns)
+	error_cols = {}
+
+	for col in columns:
+		err_max = col + '_error_max'
+		err_min = col + '_error_min'
+		if err_max in columns and err_min in columns:
+			error_cols[col] = (err_max, err_min)
+
+	return error_cols
+
+
+def get_default_merge_policy(columns):
+	'''
+	The default policy - any measured column that comes with error bars keeps the measurement with the smallest relative uncertainty,
+	everything else (names, discovery method etc.) keeps the first non-null value which is how the original merge worked.
+	'''
+	return {col: SMALLEST_RELATIVE_UNCERTAINTY for col in find_error_columns(columns)}
+
+
+def compute_relative_uncertainty(values, err_max, err_min):
+	'''
+	Relative uncertainty of each measurement: mean of the absolute upper / lower errors divided by the absolute value.
+
+	Rows with no error bars get +inf so they are only used where nothing better exists.
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		sigma = compute_symmetric_sigma(err_max, err_min)
+		rel = sigma / np.abs(values)
+
+	rel[~np.isfinite(rel)] = np.inf
+	return rel
+
+
+def compute_symmetric_sigma(err_max, err_min):
+	'''
+	Average the upper and lower error bars into one symmetric sigma. If only one side is given, that side is used.
+	'''
+	err_max = np.abs(err_max)
+	err_min = np.abs(err_min)
+
+	sigma = np.where(np.isnan(err_max), err_min, np.where(np.isnan(err_min), err_max, (err_max + err_min) / 2))
+	return sigma
+
+
+def select_row_per_group(codes, n_groups, valid, sort_key):
+	'''
+	For each group, pick the position of the valid row with the smallest sort_key. Ties keep the earliest row
+	(lexsort is stable), so this falls back to the 'first non-null' behaviour.
+
+	Returns an array of row positions with length n_groups, -1 where a group has no valid rows.
+	'''
+	chosen = np.full(n_groups, -1, dtype=np.int64)
+
+	positions = np.flatnonzero(valid)
+	if len(positions) == 0:
+		return chosen
+
+	# sort the valid rows by group then key, the first row of each group in this order is the winner
+	order = positions[np.lexsort((sort_key[positions], codes[positions]))]
+	sorted_codes = codes[order]
+	first_of_group = np.ones(len(order), dtype=bool)
+	first_of_group[1:] = sorted_codes[1:] != sorted_codes[:-1]
+
+	chosen[sorted_codes[first_of_group]] = order[first_of_group]
+	return chosen
+
+
+def take_rows(values, chosen):
+	'''
+	Gather values at the chosen positions, with NaN where no row was chosen.
+	'''
+	out = np.full(len(chosen), np.nan)
+	has_row = chosen >= 0
+	out[has_row] = values[chosen[has_row]]
+	return out
+
+
+def merge_by_selection(exoplanets, codes, n_groups, col, err_cols, sort_key):
+	'''
+	Keep the value (and its own error bars) of the best row per group according to sort_key.
+	'''
+	values = exoplanets[col].to_numpy(dtype=float)
+	chosen = select_row_per_group(codes, n_groups, ~np.isnan(values), sort_key)
+
+	merged = {col: take_rows(values, chosen)}
+	for err_col in err_cols:
+		merged[err_col] = take_rows(exoplanets[err_col].to_numpy(dtype=float), chosen)
+
+	return merged
+
+
+def merge_by_inverse_variance(exoplanets, codes, n_groups, col, err_cols, fallback):
+	'''
+	Inverse-variance weighted mean of every measurement which has error bars, the combined error is 1 / sqrt(sum of weights)
+	and is written back as a symmetric +/- error.
+
+	Groups where no row has usable error bars keep the first non-null values from fallback.
+	'''
+	values = exoplanets[col].to_numpy(dtype=float)
+	sigma = compute_symmetric_sigma(exoplanets[err_cols[0]].to_numpy(dtype=float), exoplanets[err_cols[1]].to_numpy(dtype=float))
+
+	usable = ~np.isnan(values) & np.isfinite(sigma) & (sigma > 0)
+	weights = np.zeros(len(values))
+	weights[usable] = 1 / sigma[usable]**2
+
+	weight_sum = np.bincount(codes, weights=weights, minlength=n_groups)
+	weighted_values = np.bincount(codes, weights=np.where(usable, values, 0) * weights, minlength=n_groups)
+
+	has_weight = weight_sum > 0
+	mean = fallback[col].to_numpy(dtype=float, copy=True)
+	err_max = fallback[err_cols[0]].to_numpy(dtype=float, copy=True)
+	err_min = fallback[err_cols[1]].to_numpy(dtype=float, copy=True)
+
+	mean[has_weight] = weighted_values[has_weight] / weight_sum[has_weight]
+	combined_sigma = 1 / np.sqrt(weight_sum[has_weight])
+	err_max[has_weight] = combined_sigma
+	err_min[has_weight] = -combined_sigma
+
+	return {col: mean, err_cols[0]: err_max, err_cols[1]: err_min}
+
+
+def get_recency_key(exoplanets):
+	'''
+	Sort key where the most recent row comes first (smallest key). Uses the publication date if the column was loaded,
+	otherwise the discovery year. Rows without a date go last.
+	'''
+	for col in RECENCY_COLUMNS:
+		if col in exoplanets.columns:
+			if col == 'publication_date':
+				# publication dates are strings such as '2019-07', NaT becomes NaN days
+				dates = pd.to_datetime(exoplanets[col], errors='coerce')
+				dates = (dates - pd.Timestamp(0)).dt.days.to_numpy(dtype=float)
+			else:
+				dates = pd.to_numeric(exoplanets[col], errors='coerce').to_numpy(dtype=float)
+
+			key = -dates
+			key[np.isnan(key)] = np.inf
+			return key
+
+	# no date information, every row ties so the first non-null value is kept
+	return np.zeros(len(exoplanets))
+
+
+def get_group_codes(keys):
+	'''
+	Integer code per row for its group, numbered in order of first appearance, and the number of groups. A row with a missing
+	key is a group of its own (pd.factorize gives them all -1, which would otherwise be merged together as one more group).
+	'''
+	codes, uniques = pd.factorize(keys, sort=False)
+	missing = codes == -1
+	if not missing.any():
+		return codes, len(uniques)
+
+	codes[missing] = len(uniques) + np.arange(int(missing.sum()))
+	# renumber so the groups are still in order of first appearance
+	_, first_rows = np.unique(codes, return_index=True)
+	order = np.empty(len(first_rows), dtype=codes.dtype)
+	order[np.argsort(first_rows)] = np.arange(len(first_rows))
+	return order[codes], len(first_rows)
+
+
+def apply_merge_policy(exoplanets, key_column, merge_policy=None):
+	'''
+	Collapse every group of rows sharing key_column into one row, choosing each column's value according to merge_policy.
+
+	merge_policy is a dict of column name -> strategy (one of STRATEGIES). Columns that aren't listed keep their first non-null value.
+	The error columns of a measured column always follow it, so the error bars stay with the value they belong to.
+
+	Groups are returned in the order they first appear in the input, with a fresh 0..n index. Rows with a missing key aren't
+	merged with anything.
+	'''
+	if merge_policy is None:
+		merge_policy = get_default_merge_policy(exoplanets.columns)
+
+	for col, strategy in merge_policy.items():
+		if strategy not in STRATEGIES:
+			raise ValueError("Unknown merge strategy '{}' for column '{}'".format(strategy, col))
+
+	exoplanets = exoplanets.reset_index(drop=True)
+
+	# integer code per row for its group, in order of first appearance
+	codes, n_groups = get_group_codes(exoplanets[key_column])
+
+	# groupby.first() skips NaN, so this is the 'first non-null' strategy for every column in one go.
+	# It is also the fallback for the other strategies.
+	merged = exoplanets.groupby(codes, sort=True).first()
+	merged.index = range(n_groups)
+
+	error_cols = find_error_columns(exoplanets.columns)
+	recency_key = None
+
+	for col, strategy in merge_policy.items():
+		if strategy == FIRST_NON_NULL or col not in exoplanets.columns:
+			continue
+
+		if strategy == MOST_RECENT:
+			if recency_key is None:
+				recency_key = get_recency_key(exoplanets)
+			new_cols = merge_by_selection(exoplanets, codes, n_groups, col, error_cols.get(col, ()), recency_key)
+
+		elif col not in error_cols:
+			# uncertainty based strategies need error bars, without them first non-null is all we can do
+			continue
+
+		elif strategy == SMALLEST_RELATIVE_UNCERTAINTY:
+			err_max, err_min = error_cols[col]
+			rel = compute_relative_uncertainty(exoplanets[col].to_numpy(dtype=float),
+				exoplanets[err_max].to_numpy(dtype=float), exoplanets[err_min].to_numpy(dtype=float))
+			new_cols = merge_by_selection(exoplanets, codes, n_groups, col, error_cols[col], rel)
+
+		else:
+			new_cols = merge_by_inverse_variance(exoplanets, codes, n_groups, col, error_cols[col], merged)
+
+		for new_col, values in new_cols.items():
+			merged[new_col] = values
+
+	return merged
@@ -0,0 +1,325 @@
+import numpy as np
+import pandas as pd
+import re
+import unicodedata
+from pathlib import Path
+
+from . import consts as consts
+
+# Resolving planet and host names. The same object is written many ways - 'Kepler-22 b', 'KEPLER 22b', 'Gliese 876 d' /
+# 'GJ 876 d', 'HD 020782 b' - and other catalogs often use another designation altogether ('Proxima Cen' is GJ 551).
+#
+# Every name is reduced to a key: case folded, split into runs of letters and of digits (so spaces, hyphens and the gap before
+# the planet letter don't matter), leading zeros dropped and catalog prefixes written one way, e.g.
+#	'Kepler-22 b', 'kepler 22B', 'KEPLER22 b'	-> 'kepler 22 b'
+#	'Gliese 876 d', 'GJ-876d'					-> 'gj 876 d'
+#	'K2-18 b'									-> 'k 2 18 b'
+# A + or - between two digits is the sign of a declination, not a separator, so it is kept as a token of its own:
+#	'PSR B1257+12 b'							-> 'psr b 1257 + 12 b' (and not the same key as 'PSR B1257-12 b')
+#
+# A NameIndex maps keys (and the keys of any aliases) to the position of each name, so joining a whole column of names is one
+# hash lookup per distinct name rather than comparing every pair. For names with no exact match it also has a character
+# trigram index for fuzzy lookups, which only ever compares against the names sharing a trigram with the query.
+
+# prefixes of catalog designations written several ways (on the key, i.e. lower case and tokenised) -> the one form used
+PREFIX_ALIASES = [
+	(re.compile(r'^(gliese|gl)\b'), 'gj'),
+	(re.compile(r'^henry draper\b'), 'hd'),
+	(re.compile(r'^hipparcos\b'), 'hip'),
+	(re.compile(r'^kep\b'), 'kepler'),
+	(re.compile(r'^kplr\b'), 'kepler'),
+	# the K2 mission's names are 'K2-<number>', where the hyphen is a separator rather than a sign (see TOKEN_PATTERN)
+	(re.compile(r'^k 2 - '), 'k 2 ')
+]
+
+TOKEN_PATTERN = re.compile(r'[^\W\d_]+|\d+|(?<=\d)[+-](?=\d)')
+
+NOT_FOUND = -1
+
+# fuzzy matches need at least this Dice similarity of their trigrams
+DEFAULT_MIN_SCORE = 0.6
+
+
+def normalise_name(name):
+	'''
+	The key of one name (see above), None for a missing name.
+	'''
+	if name is None or (not isinstance(name, str) and pd.isnull(name)):
+		return None
+
+	name = unicodedata.normalize('NFKD', str(name)).casefold()
+	tokens = [str(int(token)) if token.isdigit() else token for token in TOKEN_PATTERN.findall(name)]
+	key = ' '.join(tokens)
+
+	for pattern, prefix in PREFIX_ALIASES:
+		key = pattern.sub(prefix, key)
+
+	return key
+
+
+def normalise_names(names):
+	'''
+	Keys of an array of names, as an object array. Each distinct name is only normalised once.
+	'''
+	codes, uniques = pd.factorize(pd.Series(np.asarray(names, dtype=object)), sort=False)
+	unique_keys = np.array([normalise_name(name) for name in uniques] + [None], dtype=object)
+	# factorize gives missing names the code -1, which picks the None on the end
+	return unique_keys[codes]
+
+
+def find_key_collisions(names):
+	'''
+	The keys shared by differently written names, as a dict of key -> the names (sorted). Names sharing a key are taken to be
+	the same object, so in a table of one name per object (e.g. pl_name of the archive) there should be none.
+	'''
+	uniques = pd.unique(pd.Series(np.asarray(names, dtype=object)).dropna())
+	keys = pd.Series(normalise_names(uniques), index=uniques)
+	shared = keys[keys.duplicated(keep=False)]
+	return {key: sorted(group.index) for key, group in shared.groupby(shared, sort=True)}
+
+
+def get_trigrams(key):
+	padded = ' {} '.format(key)
+	return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def get_designation(key):
+	'''
+	The numbers and single letters (component / planet letters) in a key - two names which differ in these are different
+	objects however similar they look.
+	'''
+	return ' '.join(token for token in key.split() if token.isdigit() or len(token) == 1)
+
+
+class NameIndex:
+	'''
+	Exact (on the normalised key) and fuzzy lookup of names. names are the canonical names, a lookup returns positions in them.
+	'''
+
+	def __init__(self, names, aliases=None):
+		self.names = np.asarray(names, dtype=object)
+		self.key_ids = {}
+		self.key_index = None
+		self.trigram_index = None
+
+		for position, key in enumerate(normalise_names(self.names)):
+			if key is not None:
+				# the first of any names with the same key wins, as in the merge
+				self.key_ids.setdefault(key, position)
+
+		if aliases is not None:
+			self.add_aliases(aliases)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __contains__(self, name):
+		return self.get_id(name) != NOT_FOUND
+
+	def get_id(self, name):
+		key = normalise_name(name)
+		return self.key_ids.get(key, NOT_FOUND) if key is not None else NOT_FOUND
+
+	def add_aliases(self, aliases):
+		'''
+		Add pairs of names for the same object, e.g. [('GJ 551', 'Proxima Cen')]. Whichever of the pair is already in the index
+		is the canonical one and the other becomes an alias of it; pairs where neither is in the index are skipped.
+		Returns the number of aliases added.
+		'''
+		added = 0
+		for first, second in aliases:
+			first_key, second_key = normalise_name(first), normalise_name(second)
+			if first_key is None or second_key is None:
+				continue
+
+			if second_key in self.key_ids and first_key not in self.key_ids:
+				self.key_ids[first_key] = self.key_ids[second_key]
+				added += 1
+			elif first_key in self.key_ids and second_key not in self.key_ids:
+				self.key_ids[second_key] = self.key_ids[first_key]
+				added += 1
+
+		# rebuilt on the next lookup
+		self.key_index = None
+		self.trigram_index = None
+		return added
+
+	def lookup(self, names, fuzzy=False, min_score=DEFAULT_MIN_SCORE):
+		'''
+		Position in the index of each of names, NOT_FOUND (-1) for those that aren't in it. With fuzzy, names with no exact
+		match get the best fuzzy match instead (see lookup_fuzzy).
+		'''
+		if self.key_index is None:
+			self.key_index = (pd.Index(list(self.key_ids), dtype=object), np.fromiter(self.key_ids.values(), dtype=np.int64,
+				count=len(self.key_ids)))
+		keys, ids = self.key_index
+
+		query_keys = normalise_names(names)
+		positions = keys.get_indexer(query_keys)
+		found = positions >= 0
+
+		matches = np.full(len(query_keys), NOT_FOUND, dtype=np.int64)
+		matches[found] = ids[positions[found]]
+
+		if fuzzy:
+			for i in np.flatnonzero(~found):
+				if query_keys[i] is not None:
+					matches[i] = self.lookup_fuzzy(query_keys[i], min_score)
+
+		return matches
+
+	def build_trigram_index(self):
+		'''
+		trigram -> array of the keys containing it, over every key (names and aliases). The keys are also bucketed by their
+		designation, as most fuzzy lookups only need to look at the few keys with the same one.
+		'''
+		keys = list(self.key_ids)
+		trigrams = [get_trigrams(key) for key in keys]
+		postings = {}
+		designations = {}
+		for position, key in enumerate(keys):
+			for trigram in trigrams[position]:
+				postings.setdefault(trigram, []).append(position)
+			designations.setdefault(get_designation(key), []).append(position)
+
+		self.trigram_index = {
+			'postings': {trigram: np.array(positions, dtype=np.int64) for trigram, positions in postings.items()},
+			'designations': {designation: np.array(positions, dtype=np.int64) for designation, positions in designations.items()},
+			'trigrams': trigrams,
+			'ids': np.array([self.key_ids[key] for key in keys], dtype=np.int64),
+			'n_trigrams': np.array([len(key_trigrams) for key_trigrams in trigrams], dtype=np.int64)
+		}
+
+	def get_fuzzy_candidates(self, key, min_score=DEFAULT_MIN_SCORE, same_designation=True):
+		'''
+		The keys which are fuzzy matches for key, as (positions in the index, scores) best first. With same_designation, only
+		keys with the same numbers and letters are considered: 'Keplr-22 b' can match 'Kepler-22 b' but never 'Kepler-23 b' or
+		'Kepler-22 c'.
+		'''
+		if self.trigram_index is None:
+			self.build_trigram_index()
+		index = self.trigram_index
+
+		trigrams = get_trigrams(key)
+
+		# number of trigrams shared with each candidate key
+		if same_designation:
+			candidates = index['designations'].get(get_designation(key), np.empty(0, dtype=np.int64))
+			shared = np.array([len(trigrams & index['trigrams'][position]) for position in candidates], dtype=np.int64)
+		else:
+			postings = [index['postings'][trigram] for trigram in trigrams if trigram in index['postings']]
+			if not postings:
+				return np.empty(0, dtype=np.int64), np.empty(0)
+			candidates, shared = np.unique(np.concatenate(postings), return_counts=True)
+
+		scores = 2 * shared / (len(trigrams) + index['n_trigrams'][candidates])
+		keep = scores >= min_score
+		candidates, scores = candidates[keep], scores[keep]
+
+		order = np.argsort(-scores, kind='stable')
+		return index['ids'][candidates[order]], scores[order]
+
+	def lookup_fuzzy(self, name, min_score=DEFAULT_MIN_SCORE):
+		'''
+		Position of the best fuzzy match for one name, NOT_FOUND if there is none good enough.
+		'''
+		key = normalise_name(name)
+		if key is None:
+			return NOT_FOUND
+		if key in self.key_ids:
+			return self.key_ids[key]
+
+		ids, _ = self.get_fuzzy_candidates(key, min_score)
+		return int(ids[0]) if len(ids) else NOT_FOUND
+
+	def suggest(self, name, limit=5, min_score=0.4):
+		'''
+		The names most like name, for 'did you mean' messages.
+		'''
+		key = normalise_name(name)
+		if key is None:
+			return []
+
+		ids, _ = self.get_fuzzy_candidates(key, min_score, same_designation=False)
+		return list(self.names[pd.unique(ids)[:limit]])
+
+
+def load_alias_table(path=None):
+	'''
+	Pairs of names for the same object from a CSV with 'alias' and 'name' columns (consts.get_alias_table_path() by default).
+	Returns an empty list if there is no such file.
+	'''
+	path = Path(path or consts.get_alias_table_path())
+	if not path.is_file():
+		return []
+
+	table = pd.read_csv(path, comment='#', skipinitialspace=True)
+	return list(zip(table['alias'], table['name']))
+
+
+def expand_planet_aliases(planet_names, host_names, host_aliases):
+	'''
+	Planet aliases from host aliases: where a planet's name is its host's name plus a suffix ('Proxima Cen' + ' b'), the same
+	suffix on each alias of the host is an alias of the planet ('GJ 551 b').
+	'''
+	aliases_of_host = {}
+	for first, second in host_aliases:
+		for host, alias in ((first, second), (second, first)):
+			aliases_of_host.setdefault(normalise_name(host), []).append(alias)
+
+	planet_aliases = []
+	for planet, host_key in zip(planet_names, normalise_names(host_names)):
+		if host_key not in aliases_of_host or not isinstance(planet, str):
+			continue
+
+		planet_key = normalise_name(planet)
+		if not planet_key.startswith(host_key + ' '):
+			continue
+
+		suffix = planet_key[len(host_key):]
+		planet_aliases.extend((alias + suffix, planet) for alias in aliases_of_host[host_key])
+
+	return planet_aliases
+
+
+def build_planet_index(exoplanets, aliases=None):
+	'''
+	A NameIndex of the planets of the cleaned catalog (DataFrame or ExoplanetCatalog), positions are rows. aliases are pairs
+	of host or planet names, by default from the alias table - host aliases also give the matching planet aliases.
+	'''
+	if aliases is None:
+		aliases = load_alias_table()
+
+	planet_names = np.asarray(exoplanets['name_of_planet'], dtype=object)
+	index = NameIndex(planet_names)
+	index.add_aliases(aliases)
+	index.add_aliases(expand_planet_aliases(planet_names, exoplanets['name_of_host_star'], aliases))
+	return index
+
+
+def build_host_index(exoplanets, aliases=None):
+	'''
+	A NameIndex of the distinct host stars of the cleaned catalog, plus the aliases (from the alias table by default).
+	'''
+	if aliases is None:
+		aliases = load_alias_table()
+
+	hosts = pd.unique(pd.Series(np.asarray(exoplanets['name_of_host_star'], dtype=object)).dropna())
+	return NameIndex(hosts, aliases)
+
+
+def join(left, left_column, right, right_column, fuzzy=False, min_score=DEFAULT_MIN_SCORE, aliases=None, suffix='_matched'):
+	'''
+	Left join two DataFrames on names, e.g. the cleaned catalog against a local copy of another catalog. right is indexed once
+	and every name in left looked up in it, so this scales with the number of names rather than the number of pairs.
+	Columns of right which clash with left get suffix. Rows of left without a match get NaN.
+	'''
+	index = NameIndex(right[right_column].to_numpy(dtype=object), aliases)
+	matches = index.lookup(left[left_column].to_numpy(dtype=object), fuzzy, min_score)
+
+	found = matches != NOT_FOUND
+	matched = right.iloc[matches[found]]
+	matched = matched.rename(columns={col: col + suffix for col in matched.columns if col in left.columns})
+	matched.index = left.index[found]
+
+	return left.join(matched, how='left')
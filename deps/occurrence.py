@@ -0,0 +1,343 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import exoplanet_catalog as ec
+
+# Occurrence rates - how common planets of each period and size really are, rather than how many of them have been found. The
+# raw counts in plot_logic are mostly a picture of what each discovery method can see: transits favour big planets on short
+# orbits around small stars, radial velocities heavy planets close in, imaging giants far out.
+#
+# Each planet gets the probability its method would have found it, as columns of the catalog:
+#	transit_probability		geometric chance of its orbit being lined up to transit, (R_star + R_planet) / a
+#	detection_completeness	chance its method would have detected it, from an approximate model of a typical survey of that
+#							method (SURVEYS): the transit signal to noise over the observing baseline, the radial velocity
+#							semi-amplitude against the noise for a random inclination, the projected separation against the
+#							inner working angle of a coronagraph for a random orientation, the separation against the
+#							Einstein radius of the lens
+#	detection_probability	the two together (only transits are limited by the geometry), never below
+#							MIN_DETECTION_PROBABILITY so no one planet dominates a grid
+#	occurrence_weight		1 / detection_probability - the number of planets like it there are for each one found
+# Planets found by other methods (timing variations, astrometry..) or missing what the model needs get NaN, and aren't counted.
+# Nor are planets with a completeness of exactly 0 - found although the model's survey couldn't have found them (fewer than
+# the minimum transits, inside the inner working angle..), i.e. found by a survey other than the typical one - as the model
+# says nothing about how many more there are like them.
+#
+# The weights are summed into a grid of log period x log radius (or mass) bins with one np.bincount over the flattened cell
+# indices, and divided by the number of stars - planets per star in each cell. The confidence intervals are bootstrapped by
+# resampling the host stars (a system's planets were found together). A resample only changes how many times each star is
+# counted, so it is the same np.bincount with each planet's weight multiplied by its star's count; a chunk of resamples is one
+# bincount over (resample, cell), never a re-grouping of the table. The chunks are run in a pool of processes, each chunk with its
+# own seed, so the intervals are the same however many processes there are.
+#
+# The catalog has no list of the stars each survey searched, so the rates are per host star in the catalog - comparisons
+# between cells are what they are for, not the absolute numbers.
+
+AU_IN_KM = 149597870.7
+EARTH_RADIUS_IN_KM = 6371.0
+LIGHT_YEARS_PER_PARSEC = 3.26156
+JUPITER_MASS_IN_EARTH_MASSES = 317.83
+DAYS_PER_YEAR = 365.25
+
+# a typical survey for each method the model covers
+SURVEYS = {
+	# Kepler-like: 4 years of photometry, 60 ppm noise over 6.5 hours, 7.1 sigma and 3 transits to be detected
+	'Transit': {'baseline_days': 4 * DAYS_PER_YEAR, 'cdpp_ppm': 60.0, 'cdpp_hours': 6.5, 'snr_threshold': 7.1, 'min_transits': 3},
+	# 3 m/s semi-amplitude over a 20 year baseline
+	'Radial Velocity': {'k_threshold_m_s': 3.0, 'baseline_days': 20 * DAYS_PER_YEAR},
+	# 0.2 arcsec inner working angle
+	'Imaging': {'inner_working_angle_arcsec': 0.2},
+	# Einstein radius of a solar mass lens half way to the bulge, sensitivity falling off (log normally) either side of it
+	'Microlensing': {'einstein_radius_AU': 5.7, 'width_dex': 0.35}
+}
+
+# a weight of at most 100
+MIN_DETECTION_PROBABILITY = 1e-2
+
+DETECTION_COLUMNS = ['transit_probability', 'detection_completeness', 'detection_probability', 'occurrence_weight']
+
+INPUT_COLUMNS = ['name_of_host_star', 'discoverymethod', 'orbital_period', 'orbital_period_widest_radius_in_AU',
+	'planet_radius_compared_to_earth', 'planet_mass_compared_to_earth', 'stellar_radius', 'mass_of_star_compared_to_sol',
+	'distance_to_system_in_light_years']
+
+# the grids - log spaced bins, days / Earth radii / Earth masses
+PERIOD_RANGE = (0.5, 1e4)
+RADIUS_RANGE = (0.5, 32)
+MASS_RANGE = (0.1, 1e4)
+BINS_PER_DECADE = 4
+
+# one sigma
+CONFIDENCE = 0.68
+
+# below this many (draw, planet) pairs the bootstrap is quicker run here than in new processes
+MIN_POOL_WORK = 2e7
+
+
+def get_transit_probability(stellar_radius_km, planet_radius_compared_to_earth, orbit_radius_in_AU):
+	'''
+	Geometric probability of a (circular) orbit transiting for a random orientation, (R_star + R_planet) / a. A missing planet
+	radius counts as 0.
+	'''
+	planet_radius_km = np.nan_to_num(planet_radius_compared_to_earth) * EARTH_RADIUS_IN_KM
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.minimum((stellar_radius_km + planet_radius_km) / (orbit_radius_in_AU * AU_IN_KM), 1.0)
+
+
+def get_transit_completeness(stellar_radius_km, planet_radius_compared_to_earth, period_days, orbit_radius_in_AU,
+		survey=SURVEYS['Transit']):
+	'''
+	Chance a transiting planet is detected: the depth against the noise over the transit duration, summed over the transits in
+	the baseline, through a logistic step at the signal to noise threshold. 0 for fewer than the minimum number of transits.
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		depth_ppm = 1e6 * (planet_radius_compared_to_earth * EARTH_RADIUS_IN_KM / stellar_radius_km)**2
+		# central transit of a circular orbit
+		duration_hours = 24 * period_days / np.pi * np.arcsin(np.minimum(stellar_radius_km / (orbit_radius_in_AU * AU_IN_KM), 1.0))
+		noise_ppm = survey['cdpp_ppm'] * np.sqrt(survey['cdpp_hours'] / duration_hours)
+		n_transits = survey['baseline_days'] / period_days
+		snr = depth_ppm / noise_ppm * np.sqrt(n_transits)
+		completeness = 1 / (1 + np.exp(-(snr - survey['snr_threshold'])))
+	return np.where(n_transits >= survey['min_transits'], completeness, np.where(np.isnan(n_transits), np.nan, 0.0))
+
+
+def get_radial_velocity_completeness(planet_mass_compared_to_earth, mass_of_star_compared_to_sol, period_days,
+		survey=SURVEYS['Radial Velocity']):
+	'''
+	Chance of the semi-amplitude being above the threshold for a random inclination - P(sin i > K_threshold / K) =
+	sqrt(1 - (K_threshold / K)^2) - times the fraction of the orbit covered by the baseline. The mass is taken as the true mass.
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		k_m_s = 28.4329 * (planet_mass_compared_to_earth / JUPITER_MASS_IN_EARTH_MASSES) * mass_of_star_compared_to_sol**(-2 / 3) * \
+			(period_days / DAYS_PER_YEAR)**(-1 / 3)
+		ratio = np.minimum(survey['k_threshold_m_s'] / k_m_s, 1.0)
+		return np.sqrt(1 - ratio**2) * np.minimum(survey['baseline_days'] / period_days, 1.0)
+
+
+def get_imaging_completeness(orbit_radius_in_AU, distance_in_light_years, survey=SURVEYS['Imaging']):
+	'''
+	Chance the projected separation is outside the inner working angle, for a random orientation and phase of a circular orbit
+	- the projected separation s of a random orientation has P(s / a > x) = sqrt(1 - x^2).
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		separation_arcsec = orbit_radius_in_AU / (distance_in_light_years / LIGHT_YEARS_PER_PARSEC)
+		ratio = np.minimum(survey['inner_working_angle_arcsec'] / separation_arcsec, 1.0)
+		return np.sqrt(1 - ratio**2)
+
+
+def get_microlensing_completeness(orbit_radius_in_AU, mass_of_star_compared_to_sol, survey=SURVEYS['Microlensing']):
+	'''
+	Chance of a planet perturbing the lensing event, highest at the Einstein radius of the host (which scales as the square root
+	of its mass) and falling off log normally either side.
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		einstein_radius = survey['einstein_radius_AU'] * np.sqrt(mass_of_star_compared_to_sol)
+		return np.exp(-0.5 * (np.log10(orbit_radius_in_AU / einstein_radius) / survey['width_dex'])**2)
+
+
+def compute_detection_columns(exoplanets, surveys=SURVEYS):
+	'''
+	DETECTION_COLUMNS (see above) of a catalog (DataFrame or ExoplanetCatalog), as a dict of arrays in its row order.
+	'''
+	exo = ec.as_catalog(exoplanets, INPUT_COLUMNS)
+	method = np.asarray(exo['discoverymethod'], dtype=object)
+	period = np.asarray(exo['orbital_period'], dtype=float)
+	a = np.asarray(exo['orbital_period_widest_radius_in_AU'], dtype=float)
+	planet_radius = np.asarray(exo['planet_radius_compared_to_earth'], dtype=float)
+	planet_mass = np.asarray(exo['planet_mass_compared_to_earth'], dtype=float)
+	stellar_radius = np.asarray(exo['stellar_radius'], dtype=float) # km, see phys_and_math.compute_radius_of_star
+	star_mass = np.asarray(exo['mass_of_star_compared_to_sol'], dtype=float)
+	distance = np.asarray(exo['distance_to_system_in_light_years'], dtype=float)
+
+	transit_probability = get_transit_probability(stellar_radius, planet_radius, a)
+
+	completeness = np.full(len(exo), np.nan)
+	is_transit = method == 'Transit'
+	is_radial_velocity = method == 'Radial Velocity'
+	is_imaging = method == 'Imaging'
+	is_microlensing = method == 'Microlensing'
+	completeness[is_transit] = get_transit_completeness(stellar_radius[is_transit], planet_radius[is_transit], period[is_transit],
+		a[is_transit], surveys['Transit'])
+	completeness[is_radial_velocity] = get_radial_velocity_completeness(planet_mass[is_radial_velocity],
+		star_mass[is_radial_velocity], period[is_radial_velocity], surveys['Radial Velocity'])
+	completeness[is_imaging] = get_imaging_completeness(a[is_imaging], distance[is_imaging], surveys['Imaging'])
+	completeness[is_microlensing] = get_microlensing_completeness(a[is_microlensing], star_mass[is_microlensing],
+		surveys['Microlensing'])
+
+	# only a transit has to be lined up to be seen. A completeness of 0 is outside the model (see above), not a tiny chance
+	probability = completeness * np.where(is_transit, transit_probability, 1.0)
+	probability = np.where(np.isnan(probability) | (completeness == 0), np.nan, np.maximum(probability, MIN_DETECTION_PROBABILITY))
+
+	return {
+		'transit_probability': transit_probability,
+		'detection_completeness': completeness,
+		'detection_probability': probability,
+		'occurrence_weight': 1 / probability
+	}
+
+
+def add_detection_columns(exoplanets, surveys=SURVEYS):
+	'''
+	Detection bias stage: a new version of the catalog (ExoplanetCatalog or DataFrame) with DETECTION_COLUMNS added, sharing
+	all of its other columns.
+	'''
+	columns = compute_detection_columns(exoplanets, surveys)
+
+	modelled = ~np.isnan(columns['detection_probability'])
+	outside_model = columns['detection_completeness'] == 0
+	print("Info - Detection probabilities for {} of {} planets, median {:.3g} ({} left out as the survey model couldn't have "
+		"found them).".format(int(modelled.sum()), len(modelled),
+		float(np.median(columns['detection_probability'][modelled])) if modelled.any() else np.nan, int(outside_model.sum())))
+
+	if isinstance(exoplanets, ec.ExoplanetCatalog):
+		return exoplanets.assign(columns)
+	return exoplanets.assign(**columns)
+
+
+def get_bin_edges(value_range, bins_per_decade=BINS_PER_DECADE):
+	'''
+	Log spaced bin edges covering value_range, bins_per_decade to a factor of 10.
+	'''
+	low, high = np.log10(value_range)
+	n_bins = max(int(np.ceil((high - low) * bins_per_decade)), 1)
+	return np.logspace(low, high, n_bins + 1)
+
+
+def get_cells(x, y, x_edges, y_edges):
+	'''
+	Flat index of the (x, y) bin of each value, row major (x bin * number of y bins + y bin). -1 for values outside the grid or
+	NaN.
+	'''
+	ix = np.searchsorted(x_edges, x, side='right') - 1
+	iy = np.searchsorted(y_edges, y, side='right') - 1
+	n_x, n_y = len(x_edges) - 1, len(y_edges) - 1
+	# the top edge belongs to the last bin
+	ix[x == x_edges[-1]] = n_x - 1
+	iy[y == y_edges[-1]] = n_y - 1
+	inside = (ix >= 0) & (ix < n_x) & (iy >= 0) & (iy < n_y)
+	return np.where(inside, ix * n_y + iy, -1)
+
+
+def bootstrap_histograms(cells, star_codes, weights, n_stars, n_cells, n_draws, seed):
+	'''
+	Weighted histograms (n_draws x n_cells) of n_draws resamples of the stars with replacement. Runs in the process pool, so it
+	has to be a plain function. seed is a np.random.SeedSequence (or int).
+	'''
+	rng = np.random.default_rng(seed)
+	# the number of times each star is picked, in each resample (a multinomial draw, counted with a bincount as that is
+	# quicker than rng.multinomial)
+	picks = rng.integers(0, n_stars, (n_draws, n_stars)) + n_stars * np.arange(n_draws)[:, None]
+	multiplicity = np.bincount(picks.ravel(), minlength=n_draws * n_stars).reshape(n_draws, n_stars)
+
+	flat_cells = cells + n_cells * np.arange(n_draws)[:, None]
+	flat_weights = multiplicity[:, star_codes] * weights
+	return np.bincount(flat_cells.ravel(), weights=flat_weights.ravel(), minlength=n_draws * n_cells).reshape(n_draws, n_cells)
+
+
+def bootstrap_rates(cells, star_codes, weights, n_stars, n_cells, n_draws=1000, seed=0, workers=None, draws_per_chunk=100,
+		confidence=CONFIDENCE):
+	'''
+	The (low, high) bounds of the confidence interval of the rate in each cell, from n_draws resamples of the stars. The chunks
+	of draws are spread over workers processes (by default the number of CPUs, or 1 - run them here - for a small grid).
+	'''
+	chunk_sizes = [min(draws_per_chunk, n_draws - start) for start in range(0, n_draws, draws_per_chunk)]
+	if not chunk_sizes or n_stars == 0:
+		return np.full(n_cells, np.nan), np.full(n_cells, np.nan)
+
+	seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+	tasks = [(cells, star_codes, weights, n_stars, n_cells, size, chunk_seed) for size, chunk_seed in zip(chunk_sizes, seeds)]
+
+	if workers is None:
+		workers = (os.cpu_count() or 1) if n_draws * len(cells) >= MIN_POOL_WORK else 1
+	workers = min(workers, len(tasks))
+	if workers <= 1:
+		histograms = [bootstrap_histograms(*task) for task in tasks]
+	else:
+		# spawned rather than forked, as the pipeline runs its stages on threads
+		with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+			histograms = list(executor.map(bootstrap_histograms, *zip(*tasks)))
+
+	rates = np.concatenate(histograms) / n_stars
+	tail = (1 - confidence) / 2 * 100
+	return np.percentile(rates, tail, axis=0), np.percentile(rates, 100 - tail, axis=0)
+
+
+class OccurrenceGrid:
+	'''
+	Planets per star in each bin of a period x radius (or mass) grid: the raw count, the bias corrected rate and its
+	bootstrapped confidence interval. The arrays are (period bins x y bins).
+	'''
+	__slots__ = ('x_column', 'y_column', 'x_edges', 'y_edges', 'counts', 'rate', 'rate_low', 'rate_high', 'n_stars', 'n_planets')
+
+	def __init__(self, x_column, y_column, x_edges, y_edges, counts, rate, rate_low, rate_high, n_stars, n_planets):
+		self.x_column = x_column
+		self.y_column = y_column
+		self.x_edges = x_edges
+		self.y_edges = y_edges
+		self.counts = counts
+		self.rate = rate
+		self.rate_low = rate_low
+		self.rate_high = rate_high
+		self.n_stars = n_stars
+		self.n_planets = n_planets
+
+	def __repr__(self):
+		return "OccurrenceGrid({} x {}, {} x {} bins, {} planets around {} stars)".format(self.x_column, self.y_column,
+			len(self.x_edges) - 1, len(self.y_edges) - 1, self.n_planets, self.n_stars)
+
+	@property
+	def shape(self):
+		return (len(self.x_edges) - 1, len(self.y_edges) - 1)
+
+	def total_rate(self):
+		'''
+		Planets per star over the whole grid.
+		'''
+		return float(self.rate.sum())
+
+	def to_dataframe(self):
+		'''
+		A row per occupied bin, for exporting / printing.
+		'''
+		ix, iy = np.nonzero(self.counts)
+		return pd.DataFrame({
+			self.x_column + '_low': self.x_edges[ix], self.x_column + '_high': self.x_edges[ix + 1],
+			self.y_column + '_low': self.y_edges[iy], self.y_column + '_high': self.y_edges[iy + 1],
+			'planets_found': self.counts[ix, iy], 'planets_per_star': self.rate[ix, iy],
+			'planets_per_star_low': self.rate_low[ix, iy], 'planets_per_star_high': self.rate_high[ix, iy]
+		})
+
+
+def compute_occurrence_grid(exoplanets, y_column='planet_radius_compared_to_earth', y_edges=None, x_edges=None, n_bootstrap=1000,
+		seed=0, workers=None, x_column='orbital_period'):
+	'''
+	The OccurrenceGrid of a catalog with the detection columns (see add_detection_columns) over orbital period (days) x y_column.
+	The edges default to BINS_PER_DECADE log bins over PERIOD_RANGE, and RADIUS_RANGE or MASS_RANGE for the radius or mass. The
+	rates are per host star of the catalog.
+	'''
+	exo = ec.as_catalog(exoplanets, ['name_of_host_star', x_column, y_column, 'occurrence_weight'])
+	if x_edges is None:
+		x_edges = get_bin_edges(PERIOD_RANGE)
+	if y_edges is None:
+		y_edges = get_bin_edges(MASS_RANGE if 'mass' in y_column else RADIUS_RANGE)
+	x_edges, y_edges = np.asarray(x_edges, dtype=float), np.asarray(y_edges, dtype=float)
+	n_cells = (len(x_edges) - 1) * (len(y_edges) - 1)
+
+	star_codes, _ = pd.factorize(pd.Series(np.asarray(exo['name_of_host_star'], dtype=object)), sort=False)
+	n_stars = int(star_codes.max(initial=-1)) + 1
+
+	cells = get_cells(np.asarray(exo[x_column], dtype=float), np.asarray(exo[y_column], dtype=float), x_edges, y_edges)
+	weights = np.asarray(exo['occurrence_weight'], dtype=float)
+	use = (cells >= 0) & np.isfinite(weights) & (star_codes >= 0)
+	cells, weights, star_codes = cells[use], weights[use], star_codes[use]
+
+	counts = np.bincount(cells, minlength=n_cells)
+	with np.errstate(invalid='ignore'):
+		rate = np.bincount(cells, weights=weights, minlength=n_cells) / n_stars
+	rate_low, rate_high = bootstrap_rates(cells, star_codes, weights, n_stars, n_cells, n_bootstrap, seed, workers)
+
+	shape = (len(x_edges) - 1, len(y_edges) - 1)
+	return OccurrenceGrid(x_column, y_column, x_edges, y_edges, counts.reshape(shape), rate.reshape(shape),
+		rate_low.reshape(shape), rate_high.reshape(shape), n_stars, int(use.sum()))
@@ -0,0 +1,235 @@
+import numpy as np
+import pandas as pd
+
+from . import exoplanet_catalog as ec
+
+# Screening the multi-planet systems for dynamical stability. Within each system the planets are ordered by semi-major axis
+# and each pair of neighbours is compared:
+#	- their separation in mutual Hill radii, delta = (a_outer - a_inner) / R_H with
+#		R_H = ((m_inner + m_outer) / (3 M_star))^(1/3) x (a_inner + a_outer) / 2
+#	  two planets closer than 2 sqrt(3) mutual Hill radii can't be on stable orbits (Gladman 1993)
+#	- their period ratio, and whether it is within NEAR_RESONANCE_TOLERANCE of a mean motion resonance (2:1, 3:2 ..)
+#
+# Everything is done on the whole catalog at once: one sort by (host, semi-major axis) puts every system's planets next to
+# each other in order, so the pairs of neighbours are just the adjacent rows with the same host. The separations of the
+# Monte Carlo draws (sample_stability) are the same sums over arrays with an extra axis for the draws.
+#
+# Planets without a host or semi-major axis can't be placed in their system, so aren't in any pair. A planet without a mass (or
+# around a star without one) is still placed, between its neighbours, but the separations of its pairs are unknown (NaN) and
+# an unknown separation never counts as unstable - so it, and its neighbours as far as that pair goes, count as stable.
+# system_is_fully_screened is 0 for the planets of a system where either happened, i.e. system_is_stable only says there is no
+# unstable pair among the ones that could be checked. A filtered run reads
+# every planet of the systems it matches and only drops the other planets after the screening (see deps/predicates.py), so a
+# planet always has the same neighbours - and the same stability - as in a full run.
+
+SOLAR_MASS_IN_EARTH_MASSES = 332946.0
+
+# pairs closer than this (in mutual Hill radii) aren't stable
+HILL_STABLE_SEPARATION = 2 * np.sqrt(3)
+
+# mean motion resonances (outer period : inner period), first and second order
+RESONANCES = [(2, 1), (3, 2), (4, 3), (5, 4), (3, 1), (5, 3), (7, 5)]
+NEAR_RESONANCE_TOLERANCE = 0.02 # fractional distance from the exact ratio
+
+STABILITY_COLUMNS = ['position_in_system', 'hill_separation_inner', 'hill_separation_outer', 'period_ratio_outer',
+	'resonance_outer', 'is_near_resonance', 'is_dynamically_stable', 'probability_hill_stable', 'system_min_hill_separation',
+	'system_is_stable', 'system_near_resonant_pairs', 'system_is_fully_screened']
+
+INPUT_COLUMNS = ['name_of_host_star', 'orbital_period', 'orbital_period_widest_radius_in_AU',
+	'orbital_period_widest_radius_in_AU_error_max', 'orbital_period_widest_radius_in_AU_error_min',
+	'planet_mass_compared_to_earth', 'mass_of_star_compared_to_sol', 'mass_of_star_compared_to_sol_error_max',
+	'mass_of_star_compared_to_sol_error_min']
+
+
+def get_neighbour_pairs(host_names, semi_major_axis):
+	'''
+	Order the planets of each system by semi-major axis. Returns the (inner, outer) row positions of every pair of
+	neighbours, the system (code) of each pair, and each planet's position in its system (1 = innermost, 0 for planets
+	without a host or semi-major axis).
+	'''
+	host_codes, _ = pd.factorize(pd.Series(np.asarray(host_names, dtype=object)), sort=False)
+	semi_major_axis = np.asarray(semi_major_axis, dtype=float)
+	known = (host_codes >= 0) & np.isfinite(semi_major_axis)
+
+	# unknown planets are sorted to the end, each system's planets come together innermost first
+	order = np.lexsort((semi_major_axis, host_codes, ~known))
+	order = order[:int(known.sum())]
+	sorted_hosts = host_codes[order]
+
+	same_system = sorted_hosts[1:] == sorted_hosts[:-1]
+	inner, outer = order[:-1][same_system], order[1:][same_system]
+
+	# position in the system - the distance from the first row of the system in the sorted order
+	is_start = np.r_[True, ~same_system] if len(order) else np.empty(0, dtype=bool)
+	starts = np.flatnonzero(is_start)
+	position = np.zeros(len(host_codes), dtype=np.int64)
+	position[order] = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)])) + 1
+
+	return inner, outer, host_codes[inner], position
+
+
+def compute_mutual_hill_separation(a_inner, a_outer, m_inner, m_outer, m_star):
+	'''
+	Separation of two neighbouring planets in mutual Hill radii. Semi-major axes in AU, planet masses in Earth masses, the star
+	in solar masses. Works on single values or arrays (of any shape which broadcast together).
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		mass_ratio = (m_inner + m_outer) / (3 * m_star * SOLAR_MASS_IN_EARTH_MASSES)
+		mutual_hill_radius = np.cbrt(mass_ratio) * (a_inner + a_outer) / 2
+		return (a_outer - a_inner) / mutual_hill_radius
+
+
+def get_nearest_resonance(period_ratio, tolerance=NEAR_RESONANCE_TOLERANCE):
+	'''
+	The resonance nearest each period ratio (an index into RESONANCES) and whether it is within tolerance of it.
+	'''
+	period_ratio = np.asarray(period_ratio, dtype=float)
+	exact = np.array([p / q for p, q in RESONANCES])
+
+	with np.errstate(invalid='ignore'):
+		offsets = np.abs(period_ratio[..., None] / exact - 1)
+	nearest = np.argmin(np.where(np.isnan(offsets), np.inf, offsets), axis=-1)
+	is_near = np.take_along_axis(offsets, nearest[..., None], axis=-1)[..., 0] <= tolerance
+	return nearest, is_near
+
+
+def get_planets_stable(n_planets, inner, outer, pair_is_stable):
+	'''
+	Whether each planet is in no unstable pair, from whether each pair is (with a leading axis for draws, if there is one).
+	'''
+	stable = np.ones(pair_is_stable.shape[:-1] + (n_planets,), dtype=bool)
+	# each planet is the inner of at most one pair and the outer of at most one, so there are no repeated positions
+	stable[..., inner] &= pair_is_stable
+	stable[..., outer] &= pair_is_stable
+	return stable
+
+
+def get_sigma(catalog, column):
+	'''
+	The symmetric 1 sigma uncertainty of a column from its archive error bars, 0 where there aren't any.
+	'''
+	missing = np.full(len(catalog), np.nan)
+	error_max = np.abs(np.asarray(catalog.get(column + '_error_max', missing), dtype=float))
+	error_min = np.abs(np.asarray(catalog.get(column + '_error_min', missing), dtype=float))
+	# the mean of the two, or whichever there is
+	sigma = np.where(np.isnan(error_max), error_min, np.where(np.isnan(error_min), error_max, (error_max + error_min) / 2))
+	return np.nan_to_num(sigma)
+
+
+def sample_stability(exoplanets, n_draws=200, min_separation=HILL_STABLE_SEPARATION, seed=0, draws_per_chunk=100):
+	'''
+	Fraction of n_draws Monte Carlo draws of the semi-major axes and stellar masses (normal, from their archive error bars) in
+	which each planet is in no unstable pair. The neighbours are those of the catalog values; a draw which swaps two orbits
+	gives a negative separation, which counts as unstable. NaN for planets not in any system ordering.
+	'''
+	exo = ec.as_catalog(exoplanets, INPUT_COLUMNS)
+	n_planets = len(exo)
+	a = np.asarray(exo['orbital_period_widest_radius_in_AU'], dtype=float)
+	inner, outer, pair_system, position = get_neighbour_pairs(exo['name_of_host_star'], a)
+	n_systems = int(pair_system.max(initial=-1)) + 1
+
+	m_planet = np.asarray(exo['planet_mass_compared_to_earth'], dtype=float)
+	m_star = np.asarray(exo['mass_of_star_compared_to_sol'], dtype=float)
+	sigma_a = get_sigma(exo, 'orbital_period_widest_radius_in_AU')
+	sigma_star = get_sigma(exo, 'mass_of_star_compared_to_sol')
+
+	rng = np.random.default_rng(seed)
+	n_stable = np.zeros(n_planets)
+	for start in range(0, n_draws, draws_per_chunk):
+		n = min(draws_per_chunk, n_draws - start)
+		# one draw of each planet's orbit (shared by the pairs either side of it) and of each system's star
+		a_drawn = a + sigma_a * rng.standard_normal((n, n_planets))
+		star_noise = rng.standard_normal((n, n_systems))[:, pair_system]
+		star = np.abs(m_star[inner] + sigma_star[inner] * star_noise)
+
+		separation = compute_mutual_hill_separation(a_drawn[:, inner], a_drawn[:, outer], m_planet[inner], m_planet[outer], star)
+		n_stable += get_planets_stable(n_planets, inner, outer, ~(separation < min_separation)).sum(axis=0)
+
+	probability = n_stable / max(n_draws, 1)
+	probability[position == 0] = np.nan
+	return probability
+
+
+def compute_stability(exoplanets, min_separation=HILL_STABLE_SEPARATION, tolerance=NEAR_RESONANCE_TOLERANCE):
+	'''
+	The per planet and per system stability columns (STABILITY_COLUMNS, less probability_hill_stable) of a catalog
+	(DataFrame or ExoplanetCatalog), as a dict of arrays in the catalog's row order.
+	'''
+	exo = ec.as_catalog(exoplanets, INPUT_COLUMNS)
+	n_planets = len(exo)
+	a = np.asarray(exo['orbital_period_widest_radius_in_AU'], dtype=float)
+	period = np.asarray(exo['orbital_period'], dtype=float)
+	m_planet = np.asarray(exo['planet_mass_compared_to_earth'], dtype=float)
+	m_star = np.asarray(exo['mass_of_star_compared_to_sol'], dtype=float)
+
+	inner, outer, pair_system, position = get_neighbour_pairs(exo['name_of_host_star'], a)
+
+	separation = compute_mutual_hill_separation(a[inner], a[outer], m_planet[inner], m_planet[outer], m_star[inner])
+	# the observed periods if there are both, otherwise from Kepler's third law (same star, so P scales as a^1.5)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		period_ratio = np.where(np.isfinite(period[inner]) & np.isfinite(period[outer]), period[outer] / period[inner],
+			(a[outer] / a[inner])**1.5)
+	nearest, is_near = get_nearest_resonance(period_ratio, tolerance)
+	pair_is_unstable = separation < min_separation # NaN (unknown) never is
+
+	columns = {
+		'position_in_system': position,
+		'hill_separation_inner': np.full(n_planets, np.nan),
+		'hill_separation_outer': np.full(n_planets, np.nan),
+		'period_ratio_outer': np.full(n_planets, np.nan),
+		'resonance_outer': np.full(n_planets, None, dtype=object),
+		'is_near_resonance': np.zeros(n_planets, dtype=np.int64)
+	}
+	columns['hill_separation_inner'][outer] = separation
+	columns['hill_separation_outer'][inner] = separation
+	columns['period_ratio_outer'][inner] = period_ratio
+	labels = np.array(['{}:{}'.format(p, q) for p, q in RESONANCES], dtype=object)
+	columns['resonance_outer'][inner[is_near]] = labels[nearest[is_near]]
+	columns['is_near_resonance'][inner[is_near]] = 1
+	columns['is_near_resonance'][outer[is_near]] = 1
+	columns['is_dynamically_stable'] = get_planets_stable(n_planets, inner, outer, ~pair_is_unstable).astype(np.int64)
+
+	# per system, spread back over its planets (at least one system, so the indexing works on an empty catalog)
+	host_codes, _ = pd.factorize(pd.Series(np.asarray(exo['name_of_host_star'], dtype=object)), sort=False)
+	n_systems = max(int(host_codes.max(initial=-1)) + 1, 1)
+	known = ~np.isnan(separation)
+	system_min = np.full(n_systems, np.inf)
+	np.minimum.at(system_min, pair_system[known], separation[known])
+	system_unstable = np.bincount(pair_system, weights=pair_is_unstable, minlength=n_systems) > 0
+	system_resonant = np.bincount(pair_system, weights=is_near, minlength=n_systems).astype(np.int64)
+
+	# a system is only fully screened if every planet has a place in it and every pair a separation
+	has_host = host_codes >= 0
+	not_placed = has_host & (position == 0)
+	system_partial = (np.bincount(host_codes[not_placed], minlength=n_systems) > 0) | \
+		(np.bincount(pair_system, weights=~known, minlength=n_systems) > 0)
+
+	system_of_planet = np.where(has_host, host_codes, 0)
+	min_of_planet = system_min[system_of_planet]
+	columns['system_min_hill_separation'] = np.where(has_host & np.isfinite(min_of_planet), min_of_planet, np.nan)
+	columns['system_is_stable'] = (~(has_host & system_unstable[system_of_planet])).astype(np.int64)
+	columns['system_near_resonant_pairs'] = np.where(has_host, system_resonant[system_of_planet], 0)
+	columns['system_is_fully_screened'] = (has_host & ~system_partial[system_of_planet]).astype(np.int64)
+
+	return columns
+
+
+def add_stability_columns(exoplanets, n_draws=200, min_separation=HILL_STABLE_SEPARATION, tolerance=NEAR_RESONANCE_TOLERANCE,
+		seed=0):
+	'''
+	Stability stage: a new version of the catalog (ExoplanetCatalog or DataFrame) with STABILITY_COLUMNS added, sharing all of
+	its other columns. probability_hill_stable is from n_draws Monte Carlo draws of the orbits (none if 0).
+	'''
+	columns = compute_stability(exoplanets, min_separation, tolerance)
+	columns['probability_hill_stable'] = sample_stability(exoplanets, n_draws, min_separation, seed) if n_draws else np.nan
+
+	in_pairs = columns['position_in_system'] > 1
+	print(("Info - Screened {} pairs of neighbouring planets: {} closer than {:.2f} mutual Hill radii, {} near a resonance, " +
+		"{} planets in systems only partly screened.").format(
+		int(in_pairs.sum()), int((columns['hill_separation_inner'][in_pairs] < min_separation).sum()), min_separation,
+		int(pd.notnull(columns['resonance_outer']).sum()), int((columns['system_is_fully_screened'] == 0).sum())))
+
+	columns = {col: columns[col] for col in STABILITY_COLUMNS}
+	if isinstance(exoplanets, ec.ExoplanetCatalog):
+		return exoplanets.assign(columns)
+	return exoplanets.assign(**columns)
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 from . import data_cleansing as dc
+from . import mass_radius as mr
+from . import exoplanet_catalog as ec
 
 def calc_habitable_AU_values(radius, temp_of_star):
 	sb_const = 5.67e-8 # Stefan-Boltzmann constant
@@ -142,20 +144,30 @@ def calculate_gravity_and_planet_radius(df, index, planet_mass, planet_radius):
 	if not 'planet_actual_radius' in df.columns:
 		df['planet_actual_radius'] = np.nan
 
+	force, gravity_compared_to_earth, radius = compute_gravity(planet_mass, planet_radius)
+
+	df.loc[index,'accelaration_to_gravity'] = force # dip sample of results have been manually verified
+	df.loc[index,'gravity_compared_to_earth'] = gravity_compared_to_earth # dip sample of results have been manually verified
+	df.loc[index,'planet_actual_radius'] = radius # dip sample: HD 219134 b -> google shows radius 10206 km, my results are 10206.342 km
+
+
+def compute_gravity(planet_mass_in_kg, planet_radius_compared_to_earth):
+	'''
+	g = G x M / (R^2) - see calculate_gravity_and_planet_radius for the checks of the math. Works on single values or whole
+	columns. Returns the acceleration due to gravity (m s^-2), that compared to earth's, and the planet's radius in km.
+	'''
 	# source of earth radius https://nssdc.gsfc.nasa.gov/planetary/factsheet/earthfact.html
-	radius = planet_radius * 6371
+	radius = planet_radius_compared_to_earth * 6371
 
 
 	GRAVITY_CONSTANT = 6.67e-11 # no conversion needed as base units m^3 kg^-1 s^-2
 	planet_radius = radius * 1000 # unit conversion from km to m, no conversion needed for mass as kg cancels out in the equation
 
-	force = (GRAVITY_CONSTANT * planet_mass) / (planet_radius**2) # calculate the equation
+	force = (GRAVITY_CONSTANT * planet_mass_in_kg) / (planet_radius**2) # calculate the equation
 
 	gravity_compared_to_earth = force / 9.807 # divide G by earth G.
 
-	df.loc[index,'accelaration_to_gravity'] = force # dip sample of results have been manually verified
-	df.loc[index,'gravity_compared_to_earth'] = gravity_compared_to_earth # dip sample of results have been manually verified
-	df.loc[index,'planet_actual_radius'] = radius # dip sample: HD 219134 b -> google shows radius 10206 km, my results are 10206.342 km
+	return force, gravity_compared_to_earth, radius
 
 
 def compute_density_of_planet(planet_mass_in_kg, planet_radius_compared_to_earth):
@@ -205,6 +217,119 @@ def compute_radius_of_star(data_radius):
 	return actual_radius
 
 
+def classify_planet_by_density(density):
+	'''
+	Whether each planet is likely rocky (0), gas (1) or iron (2) from its density, NaN where that can't be told.
+	source: https://www.open.edu/openlearn/mod/oucontent/view.php?id=66947&extra=thumbnailfigure_idm491
+	'''
+	density = np.asarray(density, dtype=float)
+	planet_type = np.full(density.shape, np.nan)
+
+	planet_type[density < 3000] = 1 # if below 3000 kg m^-3, it is likely gas
+	planet_type[density > 3000] = 0 # if above 3000 kg m^-3, it is likely rocky
+	planet_type[density > 7900] = 2 # if above 7900 kg m^-3, it is likely iron
+
+	return planet_type
+
+
+# what compute_physics_columns reads from, and adds to, the catalog
+PHYSICS_INPUT_COLUMNS = ['planet_mass_compared_to_earth', 'planet_radius_compared_to_earth', 'stellar_radius',
+	'stellar_effective_temperature_black_body_radiation', 'orbital_period_widest_radius_in_AU']
+PHYSICS_OUTPUT_COLUMNS = ['planet_mass_in_kg', 'stellar_radius', 'habitability_zone_inner', 'habitability_zone_outer',
+	'stars_luminosity_relative_to_sun', 'is_planet_habitable', 'accelaration_to_gravity', 'gravity_compared_to_earth',
+	'planet_actual_radius', 'planet_density', 'is_planet_gas_giant']
+
+
+def compute_physics_columns(catalog):
+	'''
+	All of the derived physics, for every planet of an ExoplanetCatalog at once: mass in kg, radius of the star in km, luminosity
+	and habitability zone, whether the planet is in it, gravity, density and the planet type. The same math as the functions
+	above, on whole columns instead of one row at a time. Adds PHYSICS_OUTPUT_COLUMNS to the catalog and returns it.
+	'''
+	# earth is 5.972e24 kg
+	catalog['planet_mass_in_kg'] = catalog['planet_mass_compared_to_earth'] * 5.972e24
+
+	catalog['stellar_radius'] = compute_radius_of_star(catalog['stellar_radius'])
+
+	inner_hab_zone, outer_hab_zone, lumin = calc_habitable_AU_values(catalog['stellar_radius'],
+		catalog['stellar_effective_temperature_black_body_radiation'])
+	catalog['habitability_zone_inner'] = inner_hab_zone
+	catalog['habitability_zone_outer'] = outer_hab_zone
+	catalog['stars_luminosity_relative_to_sun'] = lumin
+
+	# 1 = true, 0 = false (including no data)
+	widest_orbit_radius = catalog['orbital_period_widest_radius_in_AU']
+	catalog['is_planet_habitable'] = ((inner_hab_zone <= widest_orbit_radius) & (widest_orbit_radius <= outer_hab_zone)).astype(np.int64)
+
+	force, gravity_compared_to_earth, radius = compute_gravity(catalog['planet_mass_in_kg'], catalog['planet_radius_compared_to_earth'])
+	catalog['accelaration_to_gravity'] = force
+	catalog['gravity_compared_to_earth'] = gravity_compared_to_earth
+	catalog['planet_actual_radius'] = radius
+
+	catalog['planet_density'] = compute_density_of_planet(catalog['planet_mass_in_kg'], catalog['planet_radius_compared_to_earth'])
+	catalog['is_planet_gas_giant'] = classify_planet_by_density(catalog['planet_density'])
+
+	return catalog
+
+
+def compute_insolation(luminosity_relative_to_sun, orbit_radius_in_AU):
+	'''
+	The stellar flux reaching the planet compared to what the Earth gets from the Sun (inverse square law, L / a^2 in solar
+	units). Works on single values or whole columns.
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return luminosity_relative_to_sun / orbit_radius_in_AU**2
+
+
+def compute_equilibrium_temperature(insolation_compared_to_earth, albedo=0.3):
+	'''
+	Equilibrium temperature (K) of a planet from the flux it gets, assuming it reradiates evenly over its whole surface:
+
+	T = (S x (1 - A) / (4 x sigma))^(1/4), S = insolation x 1361 W m^-2 (the solar constant)
+
+	Check with the Earth: insolation 1, Bond albedo 0.3 -> (1361 x 0.7 / (4 x 5.670374419e-8))^(1/4) = 254.6 K, the
+	commonly quoted ~255 K. (278.3 K with no albedo.)
+	'''
+	sb_const = 5.670374419e-8 # Stefan-Boltzmann constant
+	solar_constant = 1361 # W m^-2 at 1 AU
+
+	with np.errstate(invalid='ignore'):
+		return (insolation_compared_to_earth * solar_constant * (1 - albedo) / (4 * sb_const))**0.25
+
+
+def add_equilibrium_temperature_columns(exoplanets, albedo=0.3):
+	'''
+	For every planet at once: add 'insolation_compared_to_earth' and 'model_equilibrium_temperature_K' (with the given Bond
+	albedo), then fill in any missing archive equilibrium_temperature_K with the model temperature.
+	'equilibrium_temperature_provenance' says which: 0 from the archive, 1 modelled, -1 unknown.
+
+	Needs the derived luminosity, so runs after the derived columns. Returns the dataframe.
+	'''
+	exo = ec.ExoplanetCatalog.from_dataframe(exoplanets, ['stars_luminosity_relative_to_sun', 'orbital_period_widest_radius_in_AU',
+		'equilibrium_temperature_K'])
+
+	insolation = compute_insolation(exo['stars_luminosity_relative_to_sun'].astype(float), exo['orbital_period_widest_radius_in_AU'].astype(float))
+	model_temperature = compute_equilibrium_temperature(insolation, albedo)
+
+	temperature = exo['equilibrium_temperature_K'].astype(float) # a copy
+	measured = ~np.isnan(temperature)
+	modelled = ~measured & np.isfinite(model_temperature)
+	temperature[modelled] = model_temperature[modelled]
+
+	provenance = np.full(len(exo), mr.UNKNOWN)
+	provenance[measured] = mr.MEASURED
+	provenance[modelled] = mr.IMPUTED
+
+	exoplanets['insolation_compared_to_earth'] = insolation
+	exoplanets['model_equilibrium_temperature_K'] = model_temperature
+	exoplanets['equilibrium_temperature_K'] = temperature
+	exoplanets['equilibrium_temperature_provenance'] = provenance
+
+	print("Info - Modelled the equilibrium temperature of {} planets missing it in the archive (albedo {}).".format(int(modelled.sum()), albedo))
+
+	return exoplanets
+
+
 def compute_planet_state_from_temperature(df):
 
 	'''
@@ -0,0 +1,270 @@
+import pandas as pd
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# A small stage runner for explore.main. Each stage declares the stages it takes as input, any parameters that change its
+# result (titles, paths..) and the code it depends on. A stage's cache key is a hash of all of those plus the content hash of
+# each input artifact, so a stage only re-runs when something it actually uses has changed. Artifacts are pickled under
+# ./cache/<stage name>/<key>.pkl. The code of a stage is hashed a whole module at a time - the module each of its functions is
+# defined in - so a change to a helper it calls (in the same module, or in a module listed in its code) re-runs it. Only the
+# newest few keys of each stage are kept, older artifacts are deleted as new ones are stored.
+#
+# Stages that don't depend on each other run at the same time in a thread pool. Anything using pyplot shares the 'pyplot'
+# lock as it keeps global state.
+
+
+class Stage:
+	'''
+	One step of the pipeline.
+
+	name	- unique name, also the name other stages use to refer to its output
+	func	- called with the input artifacts (in the order of inputs) followed by the params as keyword arguments
+	inputs	- names of the stages whose outputs this stage needs
+	params	- dict of keyword arguments, hashed into the cache key
+	code	- modules / functions the result depends on, the source of the module each is defined in is hashed into the cache
+			  key (func's module is always included)
+	files	- input files read by the stage, their content is hashed into the cache key
+	outputs	- files written by the stage, a cached result is only used if they all still exist
+	lock	- name of a lock to hold while running, for stages that can't run at the same time as each other
+	cache	- set to False for stages which are cheap or have no useful return value to store
+	'''
+
+	def __init__(self, name, func, inputs=(), params=None, code=(), files=(), outputs=(), lock=None, cache=True):
+		self.name = name
+		self.func = func
+		self.inputs = tuple(inputs)
+		self.params = params or {}
+		self.code = tuple(code)
+		self.files = tuple(files)
+		self.outputs = tuple(outputs)
+		self.lock = lock
+		self.cache = cache
+
+
+def hash_source(objects):
+	'''
+	Hash the source code of the modules objects (modules / functions / classes) are defined in, which is the 'code version'
+	of a stage. Each module is hashed once, in the order they first appear.
+	'''
+	h = hashlib.sha256()
+	seen = set()
+	for obj in objects:
+		module = obj if inspect.ismodule(obj) else inspect.getmodule(obj)
+		if module is None:
+			h.update(repr(obj).encode())
+			continue
+		if module.__name__ in seen:
+			continue
+		seen.add(module.__name__)
+
+		try:
+			h.update(inspect.getsource(module).encode())
+		except (OSError, TypeError):
+			h.update(repr(obj).encode())
+	return h.hexdigest()
+
+
+def hash_file(path):
+	h = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+def hash_artifact(value):
+	'''
+	Content hash of a stage output. DataFrames are hashed row by row with pandas (much faster than pickling them),
+	anything else is hashed from its pickle.
+	'''
+	h = hashlib.sha256()
+
+	if isinstance(value, pd.DataFrame):
+		h.update(json.dumps([str(c) for c in value.columns]).encode())
+		h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+	else:
+		h.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+	return h.hexdigest()
+
+
+class Pipeline:
+	'''
+	Runs a set of stages, re-using cached artifacts where the cache key matches.
+	'''
+
+	def __init__(self, stages, cache_dir='./cache', max_workers=4, keys_kept=5):
+		self.stages = {stage.name: stage for stage in stages}
+		self.cache_dir = Path(cache_dir)
+		self.max_workers = max_workers
+		self.keys_kept = keys_kept	# artifacts kept per stage, the newest first (more than one, for runs with other params)
+
+		for stage in stages:
+			for name in stage.inputs:
+				if name not in self.stages:
+					raise ValueError("Stage '{}' depends on unknown stage '{}'".format(stage.name, name))
+
+		self.locks = {}
+		for stage in stages:
+			if stage.lock is not None:
+				self.locks.setdefault(stage.lock, threading.Lock())
+
+		self.values = {}			# stage name -> output, only for stages whose output has been loaded / computed
+		self.content_hashes = {}	# stage name -> content hash of its output
+		self.cache_keys = {}		# stage name -> cache key used this run
+		self.values_lock = threading.Lock()
+
+	def get_cache_key(self, stage):
+		h = hashlib.sha256()
+		h.update(stage.name.encode())
+		h.update(hash_source((stage.func,) + stage.code).encode())
+		h.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+
+		for path in stage.files:
+			h.update(hash_file(path).encode())
+
+		for name in stage.inputs:
+			h.update(self.content_hashes[name].encode())
+
+		return h.hexdigest()
+
+	def get_artifact_path(self, stage, key):
+		return self.cache_dir / stage.name / (key + '.pkl')
+
+	def get_meta_path(self, stage, key):
+		return self.cache_dir / stage.name / (key + '.json')
+
+	def get_value(self, name):
+		'''
+		Output of a stage, loaded from the cache the first time it is needed.
+		'''
+		with self.values_lock:
+			if name not in self.values:
+				stage = self.stages[name]
+				with open(self.get_artifact_path(stage, self.cache_keys[name]), 'rb') as f:
+					self.values[name] = pickle.load(f)
+			return self.values[name]
+
+	def run_stage(self, stage):
+		'''
+		Use the cached artifact if the key matches (and any output files still exist), otherwise run the stage and store it.
+		'''
+		key = self.get_cache_key(stage)
+		self.cache_keys[stage.name] = key
+		meta_path = self.get_meta_path(stage, key)
+
+		if stage.cache and meta_path.is_file() and all(Path(p).is_file() for p in stage.outputs):
+			with open(meta_path) as f:
+				self.content_hashes[stage.name] = json.load(f)['content_hash']
+			# used now, so it isn't the next to be pruned
+			os.utime(meta_path)
+			print("Info - Stage '{}' is up to date, using the cached result.".format(stage.name))
+			return
+
+		print("Info - Running stage '{}'..".format(stage.name))
+		args = [self.get_value(name) for name in stage.inputs]
+
+		if stage.lock is not None:
+			with self.locks[stage.lock]:
+				value = stage.func(*args, **stage.params)
+		else:
+			value = stage.func(*args, **stage.params)
+
+		content_hash = hash_artifact(value)
+
+		with self.values_lock:
+			self.values[stage.name] = value
+		self.content_hashes[stage.name] = content_hash
+
+		if stage.cache:
+			self.store(stage, key, value, content_hash)
+			self.prune(stage, key)
+
+	def store(self, stage, key, value, content_hash):
+		'''
+		Write the artifact and then its metadata, each via a temp file, so a half written artifact is never used.
+		'''
+		artifact_path = self.get_artifact_path(stage, key)
+		artifact_path.parent.mkdir(parents=True, exist_ok=True)
+
+		tmp_path = str(artifact_path) + '.tmp'
+		with open(tmp_path, 'wb') as f:
+			pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, artifact_path)
+
+		meta_path = self.get_meta_path(stage, key)
+		tmp_path = str(meta_path) + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump({'stage': stage.name, 'content_hash': content_hash}, f)
+		os.replace(tmp_path, meta_path)
+
+	def prune(self, stage, key):
+		'''
+		Delete all but the keys_kept most recently used artifacts of stage (never key, the one this run uses).
+		'''
+		stage_dir = self.cache_dir / stage.name
+		metas = []
+		for meta_path in stage_dir.glob('*.json'):
+			try:
+				metas.append((meta_path.stat().st_mtime, meta_path))
+			except FileNotFoundError:
+				continue # pruned by another run
+		metas.sort(reverse=True)
+
+		old = [meta_path for _, meta_path in metas if meta_path.stem != key][max(self.keys_kept - 1, 0):]
+		for meta_path in old:
+			# the metadata first, so the artifact is never used without it
+			for path in (meta_path, meta_path.with_suffix('.pkl')):
+				try:
+					path.unlink()
+				except FileNotFoundError:
+					pass
+		if old:
+			print("Info - Removed {} old cached result(s) of stage '{}'.".format(len(old), stage.name))
+
+	def run(self, targets=None):
+		'''
+		Run the stages needed for targets (all stages by default), as many at once as their dependencies allow.
+		Returns a dict of stage name -> content hash.
+		'''
+		needed = self.get_needed_stages(targets)
+		done = set()
+		running = {}
+
+		with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			while len(done) < len(needed):
+				# start everything whose inputs are ready
+				for name in needed:
+					if name in done or name in running.values():
+						continue
+					if all(dep in done for dep in self.stages[name].inputs):
+						running[executor.submit(self.run_stage, self.stages[name])] = name
+
+				finished, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					name = running.pop(future)
+					future.result() # re-raise any error from the stage
+					done.add(name)
+
+		return {name: self.content_hashes[name] for name in needed}
+
+	def get_needed_stages(self, targets):
+		if targets is None:
+			return list(self.stages)
+
+		needed = []
+		to_visit = list(targets)
+		while to_visit:
+			name = to_visit.pop()
+			if name in needed:
+				continue
+			needed.append(name)
+			to_visit.extend(self.stages[name].inputs)
+
+		return needed
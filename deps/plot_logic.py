@@ -2,9 +2,55 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 from math import log10 , floor
 
 from . import phys_and_math as pam
+from . import figure_cache as fc
+from . import figure_manager as fm
+from . import spectrum as spec
+from . import mass_radius as mr
+from . import exoplanet_catalog as ec
+from . import name_index as ni
+from . import aggregate_cube as agg
+
+# the columns used by the report of the optimal planets for life
+REPORT_COLUMNS = ['name_of_planet', 'orbital_period', 'equilibrium_temperature_K', 'stellar_effective_temperature_black_body_radiation',
+	'stellar_radius', 'distance_to_system_in_light_years', 'planet_actual_radius', 'planet_density', 'is_planet_gas_giant',
+	'is_planet_habitable', 'accelaration_to_gravity', 'gravity_compared_to_earth']
+PROVENANCE_COLUMNS = ['planet_mass_provenance', 'planet_radius_provenance', 'equilibrium_temperature_provenance']
+# from deps/orbital_stability.py, when the catalog has been screened
+STABILITY_COLUMNS = ['is_dynamically_stable', 'resonance_outer', 'is_near_resonance', 'probability_hill_stable']
+
+# Manual data fixes: planet name -> distance in light years
+DISTANCE_FIXES = {
+	'TRAPPIST-1 e': 39 # Source: https://www.space.com/35796-trappist-1-alien-planets-travel-time.html
+}
+
+
+def filter_optimal_planets_for_life(exoplanets):
+	'''
+	Select the optimal planets for supporting life, based on: 
+		* Being in the habitable zone
+		* Not being a gas or iron planet
+		* Having life supporting gravity (4 G's or under)
+		* Not being too close to a neighbouring planet to have a stable orbit (if the catalog has been screened)
+
+	Returns an ExoplanetCatalog of just the columns used in the report. Shared by the printed report and the catalog service.
+	'''
+	exo = ec.as_catalog(exoplanets, REPORT_COLUMNS + PROVENANCE_COLUMNS + STABILITY_COLUMNS)
+
+	# whether the mass / radius were measured or estimated from the mass-radius relation, and the stability screening (of
+	# whole systems, also for a filtered run), when the catalog has them
+	columns = REPORT_COLUMNS + [col for col in PROVENANCE_COLUMNS + STABILITY_COLUMNS if col in exo]
+
+	# Now we have to pass some tests for selection..
+	is_optimal = (exo['is_planet_habitable'] == 1) & (exo['is_planet_gas_giant'] == 0) & (exo['gravity_compared_to_earth'] <= 4)
+	if 'is_dynamically_stable' in exo:
+		is_optimal &= exo['is_dynamically_stable'] != 0
+
+	return exo.subset(is_optimal, columns)
+
 
 def print_optimal_planets_for_life(exoplanets):
 	'''
@@ -14,93 +60,99 @@ def print_optimal_planets_for_life(exoplanets):
 
 	Also compile interesting information about those planets, that is the result of all the analysis done in my code.
 	'''
-	combined = {'name_of_planet': np.array(exoplanets['name_of_planet']), 
-		'orbital_period' : np.array(exoplanets['orbital_period']), 
-		'equilibrium_temperature_K' : np.array(exoplanets['equilibrium_temperature_K']), 
-		'stellar_effective_temperature_black_body_radiation' : np.array(exoplanets['stellar_effective_temperature_black_body_radiation']), 
-		'stellar_radius' : np.array(exoplanets['stellar_radius']), 
-		'distance_to_system_in_light_years' : np.array(exoplanets['distance_to_system_in_light_years']), 
-		'planet_actual_radius' : np.array(exoplanets['planet_actual_radius']), 
-		'planet_density' : np.array(exoplanets['planet_density']), 
-		'is_planet_gas_giant' : np.array(exoplanets['is_planet_gas_giant']), 
-		'is_planet_habitable' : np.array(exoplanets['is_planet_habitable']), 
-		'accelaration_to_gravity' : np.array(exoplanets['accelaration_to_gravity']), 
-		'gravity_compared_to_earth' : np.array(exoplanets['gravity_compared_to_earth'])}
-
-	# Now we have to pass some tests for selection..
+	for report in format_optimal_planets_for_life(exoplanets):
+		print(report)
 
-	# temp dataframe to remove nans - if there are nan values in the dataframe, remove the row as we need both x and y values to plot.
-	t_df = pd.DataFrame(combined)
-	#t_df.dropna(inplace = True) # 705 rows
 
-	t_df = t_df.loc[(t_df['is_planet_habitable'] == 1) & ((t_df['is_planet_gas_giant'] == 0)) & ((t_df['gravity_compared_to_earth'] <= 4))]
+def format_optimal_planets_for_life(exoplanets):
+	'''
+	Build the report text for each of the optimal planets for life, returns a list of strings (one per planet).
+	'''
+	optimal = filter_optimal_planets_for_life(exoplanets)
+	reports = []
+
+	names = optimal['name_of_planet']
+	distances = optimal['distance_to_system_in_light_years'].copy()
+
+	# Manual data fixes, matched however the name is written
+	fixes = ni.NameIndex(list(DISTANCE_FIXES)).lookup(names)
+	fixed = fixes != ni.NOT_FOUND
+	distances[fixed] = np.array(list(DISTANCE_FIXES.values()), dtype=float)[fixes[fixed]]
+
+	for i in range(len(optimal)):
+		orbital_period = optimal['orbital_period'][i]
+
+		estimated = [quantity for quantity, col in [('mass', 'planet_mass_provenance'), ('radius', 'planet_radius_provenance')]
+			if col in optimal and optimal[col][i] == mr.IMPUTED]
+		estimated_note = f"""
+			Note: the planet's {' and '.join(estimated)} was not measured, it is estimated from the mass-radius relation.""" if estimated else ''
+		if 'equilibrium_temperature_provenance' in optimal and optimal['equilibrium_temperature_provenance'][i] == mr.IMPUTED:
+			estimated_note += """
+			Note: the archive has no equilibrium temperature for this planet, it is modelled from the star's luminosity and the orbit."""
+		if 'resonance_outer' in optimal and isinstance(optimal['resonance_outer'][i], str):
+			estimated_note += f"""
+			Note: it is near a {optimal['resonance_outer'][i]} orbital resonance with the next planet out."""
+
+		reports.append(f"""Potentially habitable planet found! Planet name: {names[i]}, it has an orbital period of:
+			{round_it(orbital_period, 2)} days (2.s.f) (meaning it takes {round_it(orbital_period, 2)} (2.s.f) days to orbit its star), 
+			it has a possible temperature of: {round_it(optimal['equilibrium_temperature_K'][i] - 273.15, 3)} degrees celsius (3.s.f), 
+			the temperature of its star is {optimal['stellar_effective_temperature_black_body_radiation'][i]} Kelvin, 
+			the radius of the star is: {optimal['stellar_radius'][i]} km, 
+			the distance to the planet is {distances[i]} light years, 
+			the radius of the planet is {optimal['planet_actual_radius'][i]} km,
+			the planet lives in the habitable zone of the star and is not a gas planet or an iron planet. Gravity has an acceleration of 
+			 {round_it(optimal['accelaration_to_gravity'][i], 3)} meters per second per second (3.s.f), which is {round_it(optimal['gravity_compared_to_earth'][i], 3)} (3.s.f) times that of Earth.""" + estimated_note)
 
-	for index, row in t_df.iterrows():
-		# Manual data fix:
-		if t_df.loc[index,'name_of_planet'] == "TRAPPIST-1 e":
-			t_df.loc[index,'distance_to_system_in_light_years'] = 39 # Source: https://www.space.com/35796-trappist-1-alien-planets-travel-time.html
+	return reports
 
-		print(f"""Potentially habitable planet found! Planet name: {t_df.loc[index,'name_of_planet']}, it has an orbital period of:
-			{round_it(t_df.loc[index,'orbital_period'], 2)} days (2.s.f) (meaning it takes {round_it(t_df.loc[index,'orbital_period'], 2)} (2.s.f) days to orbit its star), 
-			it has a possible temperature of: {round_it(t_df.loc[index,'equilibrium_temperature_K'] - 273.15, 3)} degrees celsius (3.s.f), 
-			the temperature of its star is {t_df.loc[index,'stellar_effective_temperature_black_body_radiation']} Kelvin, 
-			the radius of the star is: {t_df.loc[index,'stellar_radius']} km, 
-			the distance to the planet is {t_df.loc[index,'distance_to_system_in_light_years']} light years, 
-			the radius of the planet is {t_df.loc[index,'planet_actual_radius']} km,
-			the planet lives in the habitable zone of the star and is not a gas planet or an iron planet. Gravity has an acceleration of 
-			 {round_it(t_df.loc[index,'accelaration_to_gravity'], 3)} meters per second per second (3.s.f), which is {round_it(t_df.loc[index,'gravity_compared_to_earth'], 3)} (3.s.f) times that of Earth.""")
-			
 
 
 def scatter_plot_for_planet_mass_vs_solar_temp(df, savepath, graph_title):
 	'''
 	A function to plot planet mass vs the solar temperature, is there any correlation?
 
-	Takes in a dataframe, for example:
-
-	combined = {'stellar_effective_temperature_black_body_radiation': np.array(df['stellar_effective_temperature_black_body_radiation']), 
-		'planet_mass_in_kg' : np.array(df['planet_mass_in_kg'])}
-
-	t_df = pd.DataFrame(combined) <------ create a df from combined data before calling function
-	new_df = remove_nans_from_df(t_df)
+	Takes in an ExoplanetCatalog (or a dataframe, which is converted), rows missing either value are left out.
 
 	'''
 
-	# combine two arrays from the dataframe into a dictionary
-	combined = {'stellar_effective_temperature_black_body_radiation': np.array(df['stellar_effective_temperature_black_body_radiation']), 
-		'planet_mass_in_kg' : np.array(df['planet_mass_in_kg'])}
-
-	# temp dataframe to remove nans - if there are nan values in the dataframe, remove the row as we need both x and y values to plot.
-	t_df = pd.DataFrame(combined)
-	t_df.dropna(inplace = True)
+	# remove nans - if there are nan values, remove the row as we need both x and y values to plot.
+	columns = ['stellar_effective_temperature_black_body_radiation', 'planet_mass_in_kg']
+	plotted = ec.as_catalog(df, columns).dropna(columns)
 
 	# Create our final dataset
-	x_solar_temp_array = np.array(t_df['stellar_effective_temperature_black_body_radiation'])
-	y_planet_mass_array = np.array(t_df['planet_mass_in_kg'])
+	x_solar_temp_array = plotted['stellar_effective_temperature_black_body_radiation']
+	y_planet_mass_array = plotted['planet_mass_in_kg']
 
 	# add some data for earth (orange dot on plot)
 	earth_mass = 5.972e24
 	sol_temp = 5778
 
-	# plot
-	plt.clf()
+	# skip the render if this exact chart has already been saved
+	fingerprint = fc.compute_fingerprint([x_solar_temp_array, y_planet_mass_array], graph_title,
+		{'chart': 'scatter_mass_vs_solar_temp', 'earth': [sol_temp, earth_mass], 'sizes': [5, 15]})
+	if fc.is_figure_up_to_date(savepath, fingerprint):
+		return
 
-	plt.suptitle(graph_title, fontsize=10)
-	plt.xlabel("Temperature of the host star / K")
-	plt.ylabel("Mass of the exo-planet / kg")
+	# plot
+	with fm.figure():
+		plt.suptitle(graph_title, fontsize=10)
+		plt.xlabel("Temperature of the host star / K")
+		plt.ylabel("Mass of the exo-planet / kg")
 
-	plt.scatter(x_solar_temp_array, y_planet_mass_array, s=5)
-	plt.scatter(sol_temp, earth_mass, s=15)
+		plt.scatter(x_solar_temp_array, y_planet_mass_array, s=5)
+		plt.scatter(sol_temp, earth_mass, s=15)
 
-	plt.savefig(savepath)
+		plt.savefig(savepath)
+	fc.record_figure(savepath, fingerprint)
 
 
 def graph_habitable_exoplanets(df):
 	'''
 	A function to graph the habitable planets
 	'''
-	# create a dataframe for habitable planets
-	habitable = df.loc[df['is_planet_habitable'] == 1]
+	# select the habitable planets
+	exo = ec.as_catalog(df)
+	habitable = exo[exo['is_planet_habitable'] == 1]
 
 	scatter_plot_for_planet_mass_vs_solar_temp(habitable, 
 		'./output/habitable_scatter_plot_mass_vs_temp.png', 
@@ -114,27 +166,34 @@ def graph_habitable_exoplanets(df):
 	histogram_exoplanets_per_star(habitable, './output/habitable_histogram_exoplanets_per_star.png', 
 		'A histogram to show the frequency of exoplanets with at least one \nin the habitable range orbiting a host star.')
 
-	return habitable # return the habitable df
+	return habitable # return the habitable planets
 
 
-def histogram_exoplanets_per_star(df, savepath, graph_title):
+def histogram_exoplanets_per_star(data, savepath, graph_title, selection=None):
 
-	# provide a dataframe to count the planets around host stars
-	solar_system_data = df.groupby(['name_of_host_star']).size().reset_index(name='count')
+	# the number of host stars with each number of planets, sliced from the aggregate cube (built here if given a catalog).
+	# With a selection, e.g. {'is_planet_habitable': 1}, only those planets of each system are counted.
+	planets_per_star, n_stars = agg.as_cube(data).get_systems_per_size(**(selection or {}))
 
-	# clear previous plot and make new plot
-	plt.clf()
-	plt.suptitle(graph_title,fontsize=10)
-	plt.ylabel("Frequency")
-	plt.xlabel("Number of detected exoplanets around star")
-	
-	num_bins, edges, bars = plt.hist(solar_system_data['count'], bins=range(1,10), rwidth=0.7)
+	fingerprint = fc.compute_fingerprint([planets_per_star, n_stars], graph_title,
+		{'chart': 'histogram_exoplanets_per_star', 'bins': [1, 10], 'rwidth': 0.7})
+	if fc.is_figure_up_to_date(savepath, fingerprint):
+		return
 
-	# add numbers onto plot as low values are unreadable
-	plt.bar_label(bars)
+	# make new plot on a clean figure
+	with fm.figure():
+		plt.suptitle(graph_title,fontsize=10)
+		plt.ylabel("Frequency")
+		plt.xlabel("Number of detected exoplanets around star")
+		
+		num_bins, edges, bars = plt.hist(planets_per_star, bins=range(1,10), weights=n_stars, rwidth=0.7)
 
-	# export
-	plt.savefig(savepath)
+		# add numbers onto plot as low values are unreadable
+		plt.bar_label(bars)
+
+		# export
+		plt.savefig(savepath)
+	fc.record_figure(savepath, fingerprint)
 
 
 def graph_density(exo, savepath, savepath_histogram, hab=1):
@@ -143,19 +202,13 @@ def graph_density(exo, savepath, savepath_histogram, hab=1):
 	A function to plot the density against mass
 	'''
 
-	# clear previous plot and make new plot
-	plt.clf()
-	combined = {'planet_density': np.array(exo['planet_density']), 
-	'planet_mass_in_kg' : np.array(exo['planet_mass_in_kg']),
-	'is_planet_gas_giant' : np.array(exo['is_planet_gas_giant'])}
-
-	# temp dataframe to remove nans - if there are nan values in the dataframe, remove the row as we need both x and y values to plot.
-	t_df = pd.DataFrame(combined)
-	t_df.dropna(inplace = True)
+	# remove nans - if there are nan values, remove the row as we need both x and y values to plot.
+	columns = ['planet_density', 'planet_mass_in_kg', 'is_planet_gas_giant']
+	plotted = ec.as_catalog(exo, columns).dropna(columns)
 
 	# Create our final dataset, independant variable on the x
-	x_planet_mass = np.array(t_df['planet_mass_in_kg']) 
-	y_dens = np.array(t_df['planet_density'])
+	x_planet_mass = plotted['planet_mass_in_kg']
+	y_dens = plotted['planet_density']
 
 	# add some data for earth (orange dot on plot)
 	earth_mass = 5.972e24
@@ -163,224 +216,246 @@ def graph_density(exo, savepath, savepath_histogram, hab=1):
 
 	if hab == 1:
 		title = "A graph to show the density vs its mass of habitable-zone exoplanets, \nwith Earth plotted as an organge point."
-		plt.figure(figsize=(8,8)).suptitle(title,fontsize=10)
+		histogram_title = "A histogram to show the frequency of different planet types of \nhabitable-zone planets."
+		figsize = (8, 8)
 	else: 
-		plt.suptitle("A graph to show the density vs its mass of all detected exoplanets, \nwith Earth plotted as an organge point.", fontsize=10)
+		title = "A graph to show the density vs its mass of all detected exoplanets, \nwith Earth plotted as an organge point."
+		histogram_title = "A histogram to show the frequency of different planet types."
+		figsize = None
 
-	plt.xlabel("Planet's mass / kg")
-	plt.ylabel("Planet's density / kg m^-3")
+	fingerprint = fc.compute_fingerprint([x_planet_mass, y_dens], title,
+		{'chart': 'scatter_density_vs_mass', 'earth': [earth_mass, earth_dens], 'sizes': [10, 10], 'figsize': figsize})
 
-	plt.scatter(x_planet_mass, y_dens, s=10)
-	plt.scatter(earth_mass, earth_dens, s=10)
+	if not fc.is_figure_up_to_date(savepath, fingerprint):
+		# the habitable charts are drawn on a larger figure
+		with fm.figure(figsize):
+			plt.suptitle(title, fontsize=10)
 
-	plt.savefig(savepath)
+			plt.xlabel("Planet's mass / kg")
+			plt.ylabel("Planet's density / kg m^-3")
 
-	# scatter graph is too busy to provide any decent interpretations, so I'll use a histogram instead:
+			plt.scatter(x_planet_mass, y_dens, s=10)
+			plt.scatter(earth_mass, earth_dens, s=10)
 
-	plt.clf()
+			plt.savefig(savepath)
+		fc.record_figure(savepath, fingerprint)
 
-	if hab == 1:
-		plt.suptitle("A histogram to show the frequency of different planet types of \nhabitable-zone planets.",fontsize=10)
-	else: 
-		plt.suptitle("A histogram to show the frequency of different planet types.",fontsize=10)
+	# scatter graph is too busy to provide any decent interpretations, so I'll use a histogram instead:
 
-	plt.ylabel("Frequency")
-	plt.xlabel("Planet type")
-	plt.xticks([]) # remove numbers off of x axis
-	
-	num_bins, edges, bars = plt.hist(t_df['is_planet_gas_giant'], bins=range(0,4), rwidth=0.7)
+	planet_types = plotted['is_planet_gas_giant']
+	fingerprint = fc.compute_fingerprint([planet_types], histogram_title,
+		{'chart': 'histogram_planet_types', 'bins': [0, 4], 'rwidth': 0.7, 'hab': hab, 'figsize': figsize})
+	if fc.is_figure_up_to_date(savepath_histogram, fingerprint):
+		return
 
-	# some logic for text placement
-	if hab == 1:
-		plt.text(0.25, 0.1, 'Rocky planet')
-		plt.text(1.25, 0.1, 'Gas planet')
-		plt.text(2.25, 0.1, 'Iron planet')
-	else:
-		plt.text(0.25, 7, 'Rocky planet')
-		plt.text(1.25, 7, 'Gas planet')
-		plt.text(2.25, 7, 'Iron planet')
+	with fm.figure(figsize):
+		plt.suptitle(histogram_title, fontsize=10)
 
+		plt.ylabel("Frequency")
+		plt.xlabel("Planet type")
+		plt.xticks([]) # remove numbers off of x axis
+		
+		num_bins, edges, bars = plt.hist(planet_types, bins=range(0,4), rwidth=0.7)
 
-	# add numbers onto plot as low values are unreadable
-	plt.bar_label(bars)
+		# some logic for text placement
+		if hab == 1:
+			plt.text(0.25, 0.1, 'Rocky planet')
+			plt.text(1.25, 0.1, 'Gas planet')
+			plt.text(2.25, 0.1, 'Iron planet')
+		else:
+			plt.text(0.25, 7, 'Rocky planet')
+			plt.text(1.25, 7, 'Gas planet')
+			plt.text(2.25, 7, 'Iron planet')
 
-	plt.savefig(savepath_histogram)
 
+		# add numbers onto plot as low values are unreadable
+		plt.bar_label(bars)
 
+		plt.savefig(savepath_histogram)
+	fc.record_figure(savepath_histogram, fingerprint)
 
 
-def graph_gravity(exo, hab, savepathall, savepathhab):
-	''' 
 
-	A function to graph the gravity of exoplanets.
-
-	Produce as a scatter against their mass, it should be a straight line graph.. will be interesting to see
-	if the results are different. Doen as g force (compared to earths g-force of 1 g) as apposed to m s^-2
 
+def plot_g_force_scatter(x_values, y_g_force, earth_x, graph_title, xlabel, savepath):
+	'''
+	Scatter of the G-force of planets against another property (mass or radius) with Earth plotted as an orange point and a
+	line at 4 G's. Used for all four of the G-force scatter graphs in graph_gravity.
 	'''
-
-	# clear previous plot and make new plot
-	plt.clf()
-	combined = {'gravity_compared_to_earth': np.array(exo['gravity_compared_to_earth']), 
-	'planet_mass_in_kg' : np.array(exo['planet_mass_in_kg'])}
-
-	# temp dataframe to remove nans - if there are nan values in the dataframe, remove the row as we need both x and y values to plot.
-	t_df = pd.DataFrame(combined)
-	t_df.dropna(inplace = True)
-
-	# Create our final dataset, independant variable on the x
-	x_planet_mass = np.array(t_df['planet_mass_in_kg']) 
-	y_g_force = np.array(t_df['gravity_compared_to_earth'])
-
-	# add some data for earth (orange dot on plot)
-	earth_mass = 5.972e24
 	earth_g = 1
 
+	fingerprint = fc.compute_fingerprint([x_values, y_g_force], graph_title,
+		{'chart': 'scatter_g_force', 'xlabel': xlabel, 'earth': [earth_x, earth_g], 'sizes': [5, 15], 'axhline': 4})
+	if fc.is_figure_up_to_date(savepath, fingerprint):
+		return
+
 	# plot
-	plt.clf()
+	with fm.figure():
+		plt.suptitle(graph_title, fontsize=10)
+		plt.xlabel(xlabel)
+		plt.ylabel("G-Force compared to Earth / G's")
 
-	plt.suptitle("A graph to show the G-force as a measure compared to earth (1 G) (vs. its mass) \n of all detected exoplanets with Earth plotted as an organge point.", fontsize=10)
-	plt.xlabel("Planet's mass / kg")
-	plt.ylabel("G-Force compared to Earth / G's")
+		plt.scatter(x_values, y_g_force, s=5)
+		plt.scatter(earth_x, earth_g, s=15)
 
-	plt.scatter(x_planet_mass, y_g_force, s=5)
-	plt.scatter(earth_mass, earth_g, s=15)
+		# Humans could build the strength to survive up to 4 G's potentially (though i have seen studies suggeting we can only survive
+		# 3 G's for up to 2 minuets, so not sure on the reliability of this.) Add a line to indicate this cut off point. 
+		# Source: https://www.discovermagazine.com/the-sciences/whats-the-maximum-gravity-we-could-survive
+		plt.axhline(y=4, color='r', linestyle='-') # plot line
 
-	# Humans could build the strength to survive up to 4 G's potentially (though i have seen studies suggeting we can only survive
-	# 3 G's for up to 2 minuets, so not sure on the reliability of this.) Add a line to indicate this cut off point. 
-	# Source: https://www.discovermagazine.com/the-sciences/whats-the-maximum-gravity-we-could-survive
-	plt.axhline(y=4, color='r', linestyle='-') # plot line
+		plt.savefig(savepath)
+	fc.record_figure(savepath, fingerprint)
 
-	plt.savefig(savepathall)
 
+def get_g_force_data(df, x_col):
+	'''
+	Get the x values and G-force of the planets which have both, as we need both x and y values to plot.
+	'''
+	columns = ['gravity_compared_to_earth', x_col]
+	plotted = ec.as_catalog(df, columns).dropna(columns)
 
-	# plot habitable planets
+	# independant variable on the x
+	return plotted[x_col], plotted['gravity_compared_to_earth']
 
-	# clear previous plot and make new plot
-	plt.clf()
-	combined = {'gravity_compared_to_earth': np.array(hab['gravity_compared_to_earth']), 
-	'planet_mass_in_kg' : np.array(hab['planet_mass_in_kg'])}
 
-	# temp dataframe to remove nans - if there are nan values in the dataframe, remove the row as we need both x and y values to plot.
-	t_df = pd.DataFrame(combined)
-	t_df.dropna(inplace = True)
+def graph_gravity(exo, hab, savepathall, savepathhab, savepathallradius='./output/g_force_all_exoplanets_radius.png',
+		savepathhabradius='./output/g_force_all_exoplanets_habitable_radius.png', savepathpie='./output/g_force_all_exoplanets_habitable_pie_chart.png'):
+	''' 
 
-	# Create our final dataset, independant variable on the x
-	x_planet_mass = np.array(t_df['planet_mass_in_kg']) 
-	y_g_force = np.array(t_df['gravity_compared_to_earth'])
+	A function to graph the gravity of exoplanets.
 
-	# clear last plot
-	plt.clf()
+	Produce as a scatter against their mass, it should be a straight line graph.. will be interesting to see
+	if the results are different. Doen as g force (compared to earths g-force of 1 g) as apposed to m s^-2
 
-	plt.suptitle("A graph to show the G-force as a measure compared to earth (1 G) (vs. its mass) of all \ndetected habitable exoplanets with Earth plotted as an organge point.", fontsize=10)
-	plt.xlabel("Planet's mass / kg")
-	plt.ylabel("G-Force compared to Earth / G's")
+	'''
 
-	plt.scatter(x_planet_mass, y_g_force, s=5)
-	plt.scatter(earth_mass, earth_g, s=15)
+	# add some data for earth (orange dot on plot)
+	earth_mass = 5.972e24
+	earth_radius = 6371
 
-	# Humans could build the strength to survive up to 4 G's potentially (though i have seen studies suggeting we can only survive
-	# 3 G's for up to 2 minuets, so not sure on the reliability of this.) Add a line to indicate this cut off point. 
-	# Source: https://www.discovermagazine.com/the-sciences/whats-the-maximum-gravity-we-could-survive
-	plt.axhline(y=4, color='r', linestyle='-') # plot line
+	x_planet_mass, y_g_force = get_g_force_data(exo, 'planet_mass_in_kg')
+	plot_g_force_scatter(x_planet_mass, y_g_force, earth_mass, 
+		"A graph to show the G-force as a measure compared to earth (1 G) (vs. its mass) \n of all detected exoplanets with Earth plotted as an organge point.",
+		"Planet's mass / kg", savepathall)
 
-	plt.savefig(savepathhab)
+	# plot habitable planets
+	x_planet_mass, y_g_force = get_g_force_data(hab, 'planet_mass_in_kg')
+	plot_g_force_scatter(x_planet_mass, y_g_force, earth_mass, 
+		"A graph to show the G-force as a measure compared to earth (1 G) (vs. its mass) of all \ndetected habitable exoplanets with Earth plotted as an organge point.",
+		"Planet's mass / kg", savepathhab)
 
+	### plot g's vs radius ###
+	x_planet_radius, y_g_force = get_g_force_data(exo, 'planet_actual_radius')
+	plot_g_force_scatter(x_planet_radius, y_g_force, earth_radius, 
+		"A graph to show the G-force as a measure compared to earth (1 G) (vs. its radius) \n of all detected exoplanets with Earth plotted as an organge point.",
+		"Planet's radius / km", savepathallradius)
 
 	### plot g's vs radius ###
+	x_planet_radius, y_g_force = get_g_force_data(hab, 'planet_actual_radius')
+	plot_g_force_scatter(x_planet_radius, y_g_force, earth_radius, 
+		"A graph to show the G-force as a measure compared to earth (1 G) (vs. its radius) \n of all detected habitable exoplanets with Earth plotted as an organge point.",
+		"Planet's radius / km", savepathhabradius)
 
-	# clear previous plot and make new plot
-	plt.clf()
-	combined = {'gravity_compared_to_earth': np.array(exo['gravity_compared_to_earth']), 
-	'planet_actual_radius' : np.array(exo['planet_actual_radius'])}
+	# Create a pie chart of planets greater than, and less than, 4 G's of habitable exos
+	#less_than = len(combined[combined.iloc[:,0] <= 4])
+	less_than = len([g for g in y_g_force if int(g) <= 4])
+	more_than = len([g for g in y_g_force if int(g) >= 4.01])
+	#more_than = len(combined[combined.iloc[:,0] >= 4.01])
 
-	# temp dataframe to remove nans - if there are nan values in the dataframe, remove the row as we need both x and y values to plot.
-	t_df = pd.DataFrame(combined)
-	t_df.dropna(inplace = True)
+	arr = np.array([less_than, more_than])
 
-	# Create our final dataset, independant variable on the x
-	x_planet_radius = np.array(t_df['planet_actual_radius']) 
-	y_g_force = np.array(t_df['gravity_compared_to_earth'])
+	key = [f"Planets under 4G's: {less_than}", f"Planets greater than 4 G's: {more_than}"]
+	pie_title = "A pie chart to show the number of habitable exoplanets that are over and under 4 G's."
+	pie_savepath = savepathpie
 
-	# add some data for earth (orange dot on plot)
-	earth_mass = 5.972e24
-	earth_g = 1
+	fingerprint = fc.compute_fingerprint([arr], pie_title, {'chart': 'pie_g_force', 'labels': key})
+	if fc.is_figure_up_to_date(pie_savepath, fingerprint):
+		return
 
 	# plot
-	plt.clf()
-
-	plt.suptitle("A graph to show the G-force as a measure compared to earth (1 G) (vs. its radius) \n of all detected exoplanets with Earth plotted as an organge point.", fontsize=10)
-	plt.xlabel("Planet's radius / km")
-	plt.ylabel("G-Force compared to Earth / G's")
-
-	plt.scatter(x_planet_radius, y_g_force, s=5)
-	plt.scatter(6371, earth_g, s=15)
+	with fm.figure():
+		plt.suptitle(pie_title, fontsize=10)
 
-	# Humans could build the strength to survive up to 4 G's potentially (though i have seen studies suggeting we can only survive
-	# 3 G's for up to 2 minuets, so not sure on the reliability of this.) Add a line to indicate this cut off point. 
-	# Source: https://www.discovermagazine.com/the-sciences/whats-the-maximum-gravity-we-could-survive
-	plt.axhline(y=4, color='r', linestyle='-') # plot line
+		# a run for a few planets may have no habitable ones with a G-force, which pyplot can't make a pie of
+		if arr.sum() == 0:
+			plt.axis('off')
+			plt.text(0.5, 0.5, "No habitable exoplanets with a G-force to chart.", ha='center', va='center')
+		else:
+			plt.pie(arr, labels = key)
 
-	plt.savefig("./output/g_force_all_exoplanets_radius.png")
+		plt.savefig(pie_savepath)
+	fc.record_figure(pie_savepath, fingerprint)
 
 
-	### plot g's vs radius ###
-
-	# clear previous plot and make new plot
-	plt.clf()
-	combined = {'gravity_compared_to_earth': np.array(hab['gravity_compared_to_earth']), 
-	'planet_actual_radius' : np.array(hab['planet_actual_radius'])}
-
-	# temp dataframe to remove nans - if there are nan values in the dataframe, remove the row as we need both x and y values to plot.
-	t_df = pd.DataFrame(combined)
-	t_df.dropna(inplace = True)
-
-	# Create our final dataset, independant variable on the x
-	x_planet_radius = np.array(t_df['planet_actual_radius']) 
-	y_g_force = np.array(t_df['gravity_compared_to_earth'])
-
-	# add some data for earth (orange dot on plot)
-	earth_mass = 5.972e24
-	earth_g = 1
-
-	# plot
-	plt.clf()
+def graph_black_body_spectrum(exoplanets, savepath, graph_title, host_star_names=None):
+	'''
+	Plot the black body spectrum of host stars, with the Sun for comparison. By default the host stars of the optimal planets
+	for life are plotted. The visible / photosynthetic band (400 - 700 nm) is shaded.
+	'''
+	exo = ec.as_catalog(exoplanets, REPORT_COLUMNS + PROVENANCE_COLUMNS + ['name_of_host_star'])
+	host_stars = exo['name_of_host_star']
+	teff = exo['stellar_effective_temperature_black_body_radiation']
 
-	plt.suptitle("A graph to show the G-force as a measure compared to earth (1 G) (vs. its radius) \n of all detected habitable exoplanets with Earth plotted as an organge point.", fontsize=10)
-	plt.xlabel("Planet's radius / km")
-	plt.ylabel("G-Force compared to Earth / G's")
+	if host_star_names is None:
+		optimal = filter_optimal_planets_for_life(exo)
+		host_star_names = host_stars[ec.is_in(exo['name_of_planet'], optimal['name_of_planet'])]
 
-	plt.scatter(x_planet_radius, y_g_force, s=5)
-	plt.scatter(6371, earth_g, s=15)
+	# the first row of each of the stars, if it has a temperature
+	is_star = ec.is_in(host_stars, host_star_names) & ec.is_first_occurrence(host_stars) & ~np.isnan(teff)
 
-	# Humans could build the strength to survive up to 4 G's potentially (though i have seen studies suggeting we can only survive
-	# 3 G's for up to 2 minuets, so not sure on the reliability of this.) Add a line to indicate this cut off point. 
-	# Source: https://www.discovermagazine.com/the-sciences/whats-the-maximum-gravity-we-could-survive
-	plt.axhline(y=4, color='r', linestyle='-') # plot line
+	names = ['Sun'] + host_stars[is_star].tolist()
+	temperatures = np.concatenate(([5778], teff[is_star].astype(float)))
 
-	plt.savefig("./output/g_force_all_exoplanets_habitable_radius.png")
+	grid_nm = spec.wavelength_grid(100, 3000, 600)
 
-	# plot
-	plt.clf()
+	fingerprint = fc.compute_fingerprint([temperatures, grid_nm, np.array(names, dtype=object)], graph_title,
+		{'chart': 'black_body_spectrum', 'band': [400, 700]})
+	if fc.is_figure_up_to_date(savepath, fingerprint):
+		return
 
-	g_f = t_df['gravity_compared_to_earth'].to_dict()
+	spectra = spec.compute_spectra(temperatures, grid_nm)
 
-	# Create a pie chart of planets greater than, and less than, 4 G's of habitable exos
-	#less_than = len(combined[combined.iloc[:,0] <= 4])
-	less_than = len([g for g in g_f.values() if int(g) <= 4])
-	more_than = len([g for g in g_f.values() if int(g) >= 4.01])
-	#more_than = len(combined[combined.iloc[:,0] >= 4.01])
+	with fm.figure():
+		plt.suptitle(graph_title, fontsize=10)
+		plt.xlabel("Wavelength / nm")
+		plt.ylabel("Spectral radiance / W m^-2 sr^-1 um^-1")
 
-	arr = np.array([less_than, more_than])
+		for name, temperature, spectrum in zip(names, temperatures, spectra):
+			plt.plot(grid_nm, spectrum, label="{} ({} K)".format(name, int(temperature)))
 
-	key = [f"Planets under 4G's: {less_than}", f"Planets greater than 4 G's: {more_than}"]
-	
-	plt.suptitle("A pie chart to show the number of habitable exoplanets that are over and under 4 G's.", fontsize=10)
+		plt.axvspan(400, 700, color='g', alpha=0.1)
+		plt.yscale('log')
+		plt.legend(fontsize=7)
 
+		plt.savefig(savepath)
+	fc.record_figure(savepath, fingerprint)
 
-	plt.pie(arr, labels = key)
 
-	plt.savefig("./output/g_force_all_exoplanets_habitable_pie_chart.png")
+def plot_occurrence_grid(grid, savepath, graph_title, ylabel):
+	'''
+	Heat map of the bias corrected planets per star in each bin of an occurrence grid (see deps/occurrence.py), on log axes.
+	Bins with no planets found are left blank.
+	'''
+	fingerprint = fc.compute_fingerprint([grid.x_edges, grid.y_edges, grid.rate, grid.counts], graph_title,
+		{'chart': 'occurrence_grid', 'ylabel': ylabel, 'cmap': 'viridis'})
+	if fc.is_figure_up_to_date(savepath, fingerprint):
+		return
+
+	rate = np.ma.masked_where(grid.counts.T == 0, grid.rate.T)
+
+	with fm.figure((8, 6)):
+		plt.suptitle(graph_title, fontsize=10)
+		plt.xlabel("Orbital period / days")
+		plt.ylabel(ylabel)
+
+		norm = LogNorm() if rate.count() else None
+		mesh = plt.pcolormesh(grid.x_edges, grid.y_edges, rate, cmap='viridis', norm=norm)
+		plt.colorbar(mesh, label="Planets per star (bias corrected)")
+		plt.xscale('log')
+		plt.yscale('log')
+
+		plt.savefig(savepath)
+	fc.record_figure(savepath, fingerprint)
 
 
 def round_it(x, sig):
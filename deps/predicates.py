@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+import re
+import sqlite3
+from pathlib import Path
+
+from . import name_index as ni
+
+# Run level filters (--host, --planet, --discovery-method, --max-distance, --disc-year), so a question about a handful of systems
+# doesn't need the whole archive to be read, merged, derived and plotted.
+#
+# The filters are pushed down into the read of the SQLite copy of the archive. A planet's duplicate rows have to be merged
+# together to give the same values as a full run, and the stability screening compares each planet with its neighbours, so
+# the read is a semi-join on whole systems: every row of every planet of any host star with at least one matching row (and of
+# any matching planet without a host). The subset is merged, derived, screened and given its detection probabilities like a
+# full run, and only then are the same filters applied again to the final values, which leaves exactly the planets (and
+# values) a full run would have for them.
+#
+# Names are compared on their normalised keys (see deps/name_index.py) - in SQLite through a registered function - so
+# '--host-star trappist 1' works, and the semi-join groups rows the same way the merge does.
+#
+# The copy records the content hash of the file it was made from (in SOURCE_TABLE). A copy of an older file isn't read - the
+# archive is read and filtered instead, and the copy is remade from it.
+#
+# filters is a dict of:
+#	'host' / 'planet' / 'discovery_method'	- lists of names, compared on their normalised keys
+#	'max_distance'							- light years
+#	'disc_year'								- list of years
+
+PARSEC_TO_LY = 3.261563776976
+
+# table name -> content hash of the file the table was made from
+SOURCE_TABLE = 'table_sources'
+
+# filter -> (column in the archive, column in the cleaned catalog)
+NAME_FILTERS = {
+	'host': ('hostname', 'name_of_host_star'),
+	'planet': ('pl_name', 'name_of_planet'),
+	'discovery_method': ('discoverymethod', 'discoverymethod')
+}
+
+
+def is_active(filters):
+	return bool(filters) and any(value not in (None, [], ()) for value in filters.values())
+
+
+def clean_filters(filters):
+	'''
+	Drop the filters which weren't given, so they don't change the cache keys of the stages.
+	'''
+	return {key: value for key, value in (filters or {}).items() if value not in (None, [], ())}
+
+
+def describe(filters):
+	'''
+	A short, file name safe description of the filters, e.g. 'host-trappist-1_max_distance-50'.
+	'''
+	parts = []
+	for key, value in sorted(clean_filters(filters).items()):
+		values = value if isinstance(value, (list, tuple)) else [value]
+		parts.append('{}-{}'.format(key, '+'.join(str(v) for v in values)))
+	return re.sub(r'[^a-z0-9_+.-]+', '-', '_'.join(parts).lower())
+
+
+def build_where_clause(filters):
+	'''
+	The SQL predicate for one row of the archive, and its parameters.
+	'''
+	clauses = []
+	params = []
+
+	for key, (raw_column, _) in NAME_FILTERS.items():
+		values = filters.get(key)
+		if values:
+			clauses.append('normalise_name({}) IN ({})'.format(raw_column, ', '.join('?' * len(values))))
+			params.extend(ni.normalise_names(values))
+
+	if filters.get('max_distance') is not None:
+		# the archive is in parsecs - a hair of slack so rounding can't drop a planet on the boundary, the exact test is done
+		# on the derived distance afterwards
+		clauses.append('sy_dist <= ?')
+		params.append(float(filters['max_distance']) / PARSEC_TO_LY * (1 + 1e-9))
+
+	if filters.get('disc_year'):
+		clauses.append('disc_year IN ({})'.format(', '.join('?' * len(filters['disc_year']))))
+		params.extend(int(year) for year in filters['disc_year'])
+
+	return ' AND '.join(clauses) or '1', params
+
+
+def get_column_types(sql_con, table_name):
+	return {row[1]: (row[2] or '').upper() for row in sql_con.execute('PRAGMA table_info({})'.format(table_name))}
+
+
+def get_source_hash(sql_con, table_name):
+	'''
+	The content hash of the file the table was made from, None if it wasn't recorded.
+	'''
+	if not get_column_types(sql_con, SOURCE_TABLE):
+		return None
+	row = sql_con.execute('SELECT source_hash FROM {} WHERE table_name = ?'.format(SOURCE_TABLE), (table_name,)).fetchone()
+	return row[0] if row else None
+
+
+def restore_column_types(df, column_types):
+	'''
+	SQLite doesn't keep the dtypes - a column which is all NULL for the rows read comes back as objects - so put back the types
+	the columns had when the table was written, to match reading the xl.
+	'''
+	for col, sql_type in column_types.items():
+		if col not in df.columns:
+			continue
+		if sql_type in ('REAL', 'FLOAT', 'DOUBLE'):
+			df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+		elif sql_type in ('INTEGER', 'BIGINT'):
+			values = pd.to_numeric(df[col], errors='coerce')
+			df[col] = values.astype(np.int64) if not values.isnull().any() else values.astype(float)
+		elif sql_type in ('TIMESTAMP', 'DATETIME', 'DATE'):
+			df[col] = pd.to_datetime(df[col], errors='coerce')
+	return df
+
+
+def read_filtered_from_sqlite(filters, db_name, table_name='exoplanets', source_hash=None):
+	'''
+	Read every row of the systems of the planets matching the filters from the SQLite copy of the archive (see above).
+	Returns None if there is no copy
+	to read from yet, or (given source_hash, the content hash of the archive file) if the copy was made from a different file.
+	'''
+	if not Path(db_name).is_file():
+		return None
+
+	sql_con = sqlite3.connect(db_name)
+	sql_con.create_function('normalise_name', 1, ni.normalise_name, deterministic=True)
+	try:
+		column_types = get_column_types(sql_con, table_name)
+		if not column_types:
+			return None
+		if source_hash is not None and get_source_hash(sql_con, table_name) != source_hash:
+			return None
+
+		where, params = build_where_clause(filters)
+		query = ('SELECT * FROM {0} WHERE normalise_name(pl_name) IN (SELECT normalise_name(pl_name) FROM {0} WHERE ({1}) '
+			'OR normalise_name(hostname) IN (SELECT normalise_name(hostname) FROM {0} WHERE {1})) '
+			'ORDER BY rowid').format(table_name, where)
+		df = pd.read_sql_query(query, sql_con, params=params + params)
+	finally:
+		sql_con.close()
+
+	return restore_column_types(df, column_types)
+
+
+def get_row_mask(df, filters, columns, distance_scale=1.0, distance_slack=0.0):
+	'''
+	Boolean mask of the rows matching the filters. columns picks the archive (0) or cleaned catalog (1) names of the columns,
+	distance_scale converts max_distance (light years) into the units of the table.
+	'''
+	mask = np.ones(len(df), dtype=bool)
+
+	for key, column_names in NAME_FILTERS.items():
+		values = filters.get(key)
+		if values:
+			mask &= pd.Index(ni.normalise_names(df[column_names[columns]])).isin(ni.normalise_names(values))
+
+	if filters.get('max_distance') is not None:
+		distance_col = ('sy_dist', 'distance_to_system_in_light_years')[columns]
+		limit = float(filters['max_distance']) * distance_scale * (1 + distance_slack)
+		mask &= (np.asarray(df[distance_col], dtype=float) <= limit)
+
+	if filters.get('disc_year'):
+		mask &= pd.Index(np.asarray(df['disc_year'])).isin([int(year) for year in filters['disc_year']])
+
+	return mask
+
+
+def filter_raw_table(df, filters):
+	'''
+	The same semi-join on whole systems as read_filtered_from_sqlite, on an archive table already in memory (when there's no
+	SQLite copy yet).
+	'''
+	matching = get_row_mask(df, filters, 0, 1 / PARSEC_TO_LY, 1e-9)
+	host_keys = ni.normalise_names(df['hostname'])
+	in_systems = matching | pd.Index(host_keys).isin(pd.unique(host_keys[matching & pd.notnull(host_keys)]))
+
+	keys = ni.normalise_names(df['pl_name'])
+	keep = pd.Index(keys).isin(keys[in_systems])
+	return df.loc[keep].reset_index(drop=True)
+
+
+def filter_catalog(exoplanets, filters):
+	'''
+	Apply the filters to the cleaned catalog (DataFrame or ExoplanetCatalog), on the merged / derived values. Done last, once
+	the whole systems read have been screened.
+	'''
+	return exoplanets[get_row_mask(exoplanets, filters, 1)]
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+from . import exoplanet_catalog as ec
+from . import name_index as ni
+
+# Ranking planets by how Earth-like they are, rather than only passing / failing the cutoffs of
+# plot_logic.filter_optimal_planets_for_life. The score is the Earth Similarity Index (Schulze-Makuch et al. 2011) over
+# whichever of the features below a planet has:
+#
+#	ESI = prod over features of (1 - |x - x_ref| / (x + x_ref)) ^ (w / n)
+#
+# with n the number of features used. The catalog is kept as one matrix of feature / Earth's (and its log), so the Earth is
+# all ones. Each term is 2 min(x, x_ref) / (x + x_ref), and its log is min(log x, log x_ref) + log 2 - log(x + x_ref) - one
+# log per value. Scoring every planet against the Earth, or against any other planet ('the planets most like TRAPPIST-1 e'),
+# is then one pass over the matrix, and the best k are picked out with np.argpartition rather than sorting everything.
+
+# column -> Earth's value and the weight of the feature. The radius, density and temperature weights are those of the ESI
+# paper (escape velocity's weight is used for the gravity, temperature's for the equilibrium rather than surface temperature
+# so Earth's is its equilibrium temperature); the flux is weighted as the radius and flux 'surface ESI' weights them, equally.
+FEATURES = {
+	'planet_radius_compared_to_earth': (1.0, 0.57),
+	'planet_density': (5514.0, 1.07), # kg m^-3
+	'gravity_compared_to_earth': (1.0, 0.70),
+	'equilibrium_temperature_K': (254.6, 5.58), # with a Bond albedo of 0.3, see phys_and_math.compute_equilibrium_temperature
+	'insolation_compared_to_earth': (1.0, 1.0)
+}
+
+# planets with fewer of the features than this aren't scored
+MIN_FEATURES = 2
+
+
+def get_log_features(exoplanets):
+	'''
+	The normalised feature matrix of a catalog (DataFrame or ExoplanetCatalog): log(feature / Earth's), a column per feature,
+	NaN where a planet doesn't have it (or it isn't positive).
+	'''
+	exo = ec.as_catalog(exoplanets, list(FEATURES))
+	features = np.full((len(exo), len(FEATURES)), np.nan)
+	for i, (col, (earth_value, _)) in enumerate(FEATURES.items()):
+		if col in exo:
+			values = np.asarray(exo[col], dtype=float)
+			with np.errstate(divide='ignore', invalid='ignore'):
+				features[:, i] = np.where(values > 0, np.log(values / earth_value), np.nan)
+	return features
+
+
+def compute_similarity(features, reference, weights, values=None):
+	'''
+	ESI of each row of features (log features, see above) against the reference row, using the features both have. values is
+	np.exp(features), if it is already to hand. NaN for rows sharing fewer than MIN_FEATURES features with the reference.
+	'''
+	# features the reference doesn't have can't be compared
+	use = ~np.isnan(reference)
+	features, reference, weights = features[:, use], reference[use], weights[use]
+	values = np.exp(features) if values is None else values[:, use]
+
+	known = ~np.isnan(features)
+	n_known = known.sum(axis=1)
+
+	# log(1 - |x - x_ref| / (x + x_ref)) = min(log x, log x_ref) + log 2 - log(x + x_ref), the product over the features is
+	# then a weighted sum
+	log_terms = np.log(values + np.exp(reference))
+	np.subtract(np.minimum(features, reference) + np.log(2), log_terms, out=log_terms)
+	log_terms[~known] = 0
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		scores = np.exp(log_terms @ weights / n_known)
+	scores[n_known < MIN_FEATURES] = np.nan
+	return scores
+
+
+def get_top_k(scores, k, candidates=None):
+	'''
+	Positions of the k highest scores (NaNs never count), best first. np.argpartition finds them without sorting all of the
+	scores, only the k are sorted. candidates is an optional boolean mask of the rows which can be picked.
+	'''
+	scores = np.where(np.isnan(scores), -np.inf, scores)
+	if candidates is not None:
+		scores = np.where(candidates, scores, -np.inf)
+
+	k = min(k, int(np.isfinite(scores).sum()))
+	if k <= 0:
+		return np.empty(0, dtype=np.int64)
+
+	top = np.argpartition(-scores, k - 1)[:k]
+	return top[np.argsort(-scores[top], kind='stable')]
+
+
+class SimilarityIndex:
+	'''
+	The normalised feature matrix of a catalog and every planet's ESI, for top k rankings and nearest analog queries.
+	'''
+	__slots__ = ('names', 'features', 'values', 'weights', 'earth_similarity', 'name_index')
+
+	def __init__(self, names, features):
+		self.names = np.asarray(names, dtype=object)
+		self.features = np.ascontiguousarray(features, dtype=float)
+		self.values = np.exp(self.features)
+		self.weights = np.array([weight for _, weight in FEATURES.values()])
+		self.earth_similarity = compute_similarity(self.features, np.zeros(len(FEATURES)), self.weights, self.values)
+		self.name_index = None
+
+	@classmethod
+	def from_catalog(cls, exoplanets):
+		exo = ec.as_catalog(exoplanets, ['name_of_planet'] + list(FEATURES))
+		return cls(exo['name_of_planet'], get_log_features(exo))
+
+	def __len__(self):
+		return len(self.names)
+
+	def __repr__(self):
+		return "SimilarityIndex({} planets, {} scored)".format(len(self), int((~np.isnan(self.earth_similarity)).sum()))
+
+	def get_position(self, name):
+		'''
+		Row of a planet by name (any spelling), NOT_FOUND if it isn't in the catalog.
+		'''
+		if self.name_index is None:
+			self.name_index = ni.NameIndex(self.names)
+		return self.name_index.get_id(name)
+
+	def most_earth_like(self, k=10, candidates=None):
+		'''
+		The k planets with the highest ESI as (positions, scores), best first.
+		'''
+		top = get_top_k(self.earth_similarity, k, candidates)
+		return top, self.earth_similarity[top]
+
+	def most_similar(self, name, k=10, candidates=None):
+		'''
+		The k planets most similar to the named one (the ESI with it in place of the Earth) as (positions, scores), best
+		first, not including itself. Raises KeyError if there is no such planet.
+		'''
+		position = self.get_position(name)
+		if position == ni.NOT_FOUND:
+			raise KeyError("No planet named '{}'".format(name))
+
+		scores = compute_similarity(self.features, self.features[position], self.weights, self.values)
+		scores[position] = np.nan
+		top = get_top_k(scores, k, candidates)
+		return top, scores[top]
+
+	def to_dataframe(self, positions, scores, score_name='similarity'):
+		'''
+		A ranking as a DataFrame of the planet names and scores, e.g. for JSON.
+		'''
+		return pd.DataFrame({'rank': np.arange(1, len(positions) + 1), 'name_of_planet': self.names[positions],
+			score_name: np.round(scores, 4)})
+
+
+def format_earth_like_ranking(index, k=10):
+	'''
+	The k most Earth-like planets of a SimilarityIndex as report lines.
+	'''
+	positions, scores = index.most_earth_like(k)
+	lines = ["The {} most Earth-like planets by the Earth Similarity Index (1 = identical to the Earth):".format(len(positions))]
+	lines += ["\t{:>2}. {} - {:.3f}".format(rank, name, score) for rank, (name, score) in enumerate(zip(index.names[positions], scores), 1)]
+	return lines
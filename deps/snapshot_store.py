@@ -0,0 +1,332 @@
+import numpy as np
+import pandas as pd
+import argparse
+import glob
+import pickle
+import re
+from pathlib import Path
+
+from . import plot_logic as pl
+from . import exoplanet_catalog as ec
+from . import consts as consts
+from . import catalog_build as cb
+
+# Many dated exports of the archive in one store, to see how the catalog has changed over time.
+#
+# Every string (planet and host names, discovery method..) is interned once in a dictionary shared by all the snapshots, and
+# text columns are kept as int32 codes into it. A planet is identified by the code of its name. For each column, a snapshot only
+# stores the planets whose value changed since the previous snapshot (a delta), plus the list of planets it contains - so a
+# dozen snapshots cost little more than one. A snapshot is rebuilt by replaying the deltas of a column up to its date.
+#
+# Run with: python3 -m deps.snapshot_store [exports..] (defaults to every PS_*.xlsx in ./deps/).
+
+MISSING_CODE = -1
+
+# the date is in the name of the archive's exports, e.g. PS_2022.06.01_08.42.24.xlsx
+EXPORT_DATE_PATTERN = re.compile(r'PS_(\d{4})\.(\d{2})\.(\d{2})_(\d{2})\.(\d{2})\.(\d{2})')
+
+
+class StringTable:
+	'''
+	Interns strings: each distinct string is stored once and referred to by an int32 code.
+	'''
+	__slots__ = ('strings', 'codes')
+
+	def __init__(self):
+		self.strings = []
+		self.codes = {}
+
+	def __len__(self):
+		return len(self.strings)
+
+	def encode(self, values):
+		'''
+		Codes of an array of strings, adding any new ones. Missing values get MISSING_CODE.
+		'''
+		values = np.asarray(values, dtype=object)
+		missing = pd.isnull(values)
+
+		# only the distinct values need looking up
+		uniques, inverse = np.unique(values[~missing].astype(str), return_inverse=True)
+		unique_codes = np.empty(len(uniques), dtype=np.int32)
+		for i, value in enumerate(uniques.tolist()):
+			code = self.codes.get(value)
+			if code is None:
+				code = self.codes[value] = len(self.strings)
+				self.strings.append(value)
+			unique_codes[i] = code
+
+		codes = np.full(len(values), MISSING_CODE, dtype=np.int32)
+		codes[~missing] = unique_codes[inverse]
+		return codes
+
+	def lookup(self, values):
+		'''
+		Codes of strings without adding them, MISSING_CODE for any not in the table.
+		'''
+		return np.array([self.codes.get(value, MISSING_CODE) for value in values], dtype=np.int32)
+
+	def decode(self, codes):
+		codes = np.asarray(codes)
+		decoded = np.empty(len(codes), dtype=object)
+		present = codes != MISSING_CODE
+		decoded[present] = np.array(self.strings, dtype=object)[codes[present]]
+		decoded[~present] = None
+		return decoded
+
+
+class ColumnHistory:
+	'''
+	The deltas of one column: for each snapshot, the planet codes whose value changed and their new values.
+	Numeric columns are held as float64 (NaN = missing), text columns as codes into the StringTable.
+	'''
+	__slots__ = ('is_text', 'dtype', 'changed_ids', 'changed_values')
+
+	def __init__(self, is_text, dtype):
+		self.is_text = is_text
+		self.dtype = dtype
+		self.changed_ids = []
+		self.changed_values = []
+
+	@property
+	def missing_value(self):
+		return MISSING_CODE if self.is_text else np.nan
+
+	def new_state(self, size):
+		return np.full(size, self.missing_value, dtype=np.int32 if self.is_text else np.float64)
+
+
+class SnapshotStore:
+	'''
+	A time-indexed store of catalog snapshots. Add the snapshots oldest first with add_snapshot, then query.
+	'''
+
+	def __init__(self):
+		self.strings = StringTable()
+		self.dates = []
+		self.planet_ids = []		# per snapshot, sorted codes of the planets it contains
+		self.candidate_ids = []		# per snapshot, sorted codes of its optimal planets for life
+		self.columns = {}			# column name -> ColumnHistory
+		self.states = {}			# column name -> values at the latest snapshot, indexed by planet code (for computing deltas)
+
+	def __len__(self):
+		return len(self.dates)
+
+	def add_snapshot(self, date, exoplanets):
+		'''
+		Add a cleaned catalog (DataFrame or ExoplanetCatalog) as of date. Snapshots have to be added in date order.
+		'''
+		date = np.datetime64(date, 's')
+		if self.dates and date <= self.dates[-1]:
+			raise ValueError("Snapshots must be added oldest first, {} is not after {}".format(date, self.dates[-1]))
+
+		exo = ec.as_catalog(exoplanets)
+		ids = self.strings.encode(exo['name_of_planet'])
+		if (ids == MISSING_CODE).any() or len(np.unique(ids)) != len(ids):
+			raise ValueError("Every planet of a snapshot needs a unique name - merge the duplicate rows first")
+
+		order = np.argsort(ids)
+		ids = ids[order]
+
+		for name in exo:
+			if name == 'name_of_planet':
+				continue
+			values = exo[name][order]
+
+			history = self.columns.get(name)
+			if history is None:
+				is_text = values.dtype == object
+				history = self.columns[name] = ColumnHistory(is_text, np.dtype(np.int32) if is_text else values.dtype)
+				# a column first seen in a later snapshot has no changes in the earlier ones
+				history.changed_ids = [np.empty(0, dtype=np.int32)] * len(self.dates)
+				history.changed_values = [history.new_state(0)] * len(self.dates)
+
+			values = self.strings.encode(values) if history.is_text else values.astype(np.float64)
+			self.record_delta(name, history, ids, values)
+
+		# columns this snapshot doesn't have are missing for all of its planets
+		for name, history in self.columns.items():
+			if len(history.changed_ids) == len(self.dates):
+				self.record_delta(name, history, ids, history.new_state(len(ids)))
+
+		self.dates.append(date)
+		self.planet_ids.append(ids)
+		self.candidate_ids.append(np.sort(self.strings.lookup(pl.filter_optimal_planets_for_life(exo)['name_of_planet'])))
+
+	def record_delta(self, name, history, ids, values):
+		state = self.states.get(name)
+		if state is None or len(state) < len(self.strings):
+			grown = history.new_state(len(self.strings))
+			if state is not None:
+				grown[:len(state)] = state
+			state = self.states[name] = grown
+
+		previous = state[ids]
+		if history.is_text:
+			changed = previous != values
+		else:
+			changed = ~((previous == values) | (np.isnan(previous) & np.isnan(values)))
+
+		history.changed_ids.append(ids[changed])
+		history.changed_values.append(values[changed])
+		state[ids[changed]] = values[changed]
+
+	def get_snapshot_index(self, date=None):
+		'''
+		The snapshot in force at date (the latest one on or before it), the latest snapshot by default.
+		'''
+		if not self.dates:
+			raise ValueError("The store is empty")
+		if date is None:
+			return len(self.dates) - 1
+
+		index = int(np.searchsorted(np.array(self.dates), np.datetime64(date, 's'), side='right')) - 1
+		if index < 0:
+			raise ValueError("No snapshot on or before {}".format(date))
+		return index
+
+	def get_column(self, name, date=None, decode=True):
+		'''
+		One column of a snapshot, in the order of its planet codes. Text is decoded to strings unless decode=False.
+		'''
+		index = self.get_snapshot_index(date)
+		history = self.columns[name]
+
+		state = history.new_state(len(self.strings))
+		for changed_ids, changed_values in zip(history.changed_ids[:index + 1], history.changed_values[:index + 1]):
+			state[changed_ids] = changed_values
+
+		values = state[self.planet_ids[index]]
+		if history.is_text:
+			return self.strings.decode(values) if decode else values
+		if history.dtype.kind in 'iub' and not np.isnan(values).any():
+			return values.astype(history.dtype)
+		return values
+
+	def get_catalog(self, date=None, columns=None):
+		'''
+		A snapshot as an ExoplanetCatalog (all columns, or just those asked for).
+		'''
+		index = self.get_snapshot_index(date)
+		catalog = ec.ExoplanetCatalog({'name_of_planet': self.strings.decode(self.planet_ids[index])})
+		for name in (columns or self.columns):
+			if name != 'name_of_planet':
+				catalog[name] = self.get_column(name, self.dates[index])
+		return catalog
+
+	def get_candidate_changes(self):
+		'''
+		How the list of optimal planets for life changed from each snapshot to the next. Returns a list of dicts of the date,
+		the number of candidates and the names added / removed since the previous snapshot.
+		'''
+		changes = []
+		previous = np.empty(0, dtype=np.int32)
+
+		for date, candidates in zip(self.dates, self.candidate_ids):
+			changes.append({
+				'date': str(date),
+				'candidates': int(len(candidates)),
+				'added': self.strings.decode(np.setdiff1d(candidates, previous)).tolist(),
+				'removed': self.strings.decode(np.setdiff1d(previous, candidates)).tolist()
+			})
+			previous = candidates
+
+		return changes
+
+	def get_discoveries_per_year_by_method(self, date=None):
+		'''
+		Number of planets discovered each year by each discovery method, as known at date (the latest snapshot by default).
+		Returns a DataFrame of years x methods.
+		'''
+		years = self.get_column('disc_year', date)
+		methods = self.get_column('discoverymethod', date, decode=False)
+
+		known = ~np.isnan(years.astype(float)) & (methods != MISSING_CODE)
+		years = years[known].astype(np.int64)
+		method_codes, method_index = np.unique(methods[known], return_inverse=True)
+
+		if len(years) == 0:
+			return pd.DataFrame()
+
+		first_year = years.min()
+		n_years = years.max() - first_year + 1
+		counts = np.bincount((years - first_year) * len(method_codes) + method_index, minlength=n_years * len(method_codes))
+
+		return pd.DataFrame(counts.reshape(n_years, len(method_codes)), index=pd.RangeIndex(first_year, first_year + n_years, name='disc_year'),
+			columns=self.strings.decode(method_codes))
+
+	@property
+	def nbytes(self):
+		'''
+		Rough memory use of the deltas and planet lists (not counting the string table).
+		'''
+		total = sum(ids.nbytes for ids in self.planet_ids + self.candidate_ids)
+		for history in self.columns.values():
+			total += sum(ids.nbytes + values.nbytes for ids, values in zip(history.changed_ids, history.changed_values))
+		return total
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+	@staticmethod
+	def load(path):
+		with open(path, 'rb') as f:
+			return pickle.load(f)
+
+
+def get_export_date(path):
+	'''
+	The date and time of an archive export, from its file name.
+	'''
+	match = EXPORT_DATE_PATTERN.search(Path(path).name)
+	if match is None:
+		raise ValueError("Can't tell the date of the export '{}', expected a name like PS_2022.06.01_08.42.24.xlsx".format(path))
+	year, month, day, hour, minute, second = match.groups()
+	return np.datetime64('{}-{}-{}T{}:{}:{}'.format(year, month, day, hour, minute, second), 's')
+
+
+def build_store(export_paths, store=None):
+	'''
+	Clean each dated export and add it to a store, oldest first. Each export goes through the same stages as a normal run
+	(imputation, derived columns, stability and detection), so the candidates of a snapshot are the ones its report would list.
+	'''
+	store = store or SnapshotStore()
+
+	for path in sorted(export_paths, key=get_export_date):
+		print("Info - Adding the snapshot {}..".format(path))
+		raw = pd.read_excel(path)
+		store.add_snapshot(get_export_date(path), cb.build_catalog(raw))
+
+	return store
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Load dated archive exports into one store and show how the catalog changed.')
+	parser.add_argument('exports', nargs='*', help='archive exports (default: every PS_*.xlsx in ./deps/)')
+	parser.add_argument('--store', default=None, help='load the store from this file if it exists, and save it there')
+	args = parser.parse_args(argv)
+
+	store = None
+	if args.store and Path(args.store).is_file():
+		store = SnapshotStore.load(args.store)
+
+	export_paths = args.exports or sorted(glob.glob(str(Path(consts.get_input_data_path()).parent / 'PS_*.xlsx')))
+	if store is not None:
+		export_paths = [path for path in export_paths if len(store) == 0 or get_export_date(path) > store.dates[-1]]
+
+	store = build_store(export_paths, store)
+	if args.store:
+		store.save(args.store)
+
+	print("Info - {} snapshots, {} interned strings, {:.1f} MB of deltas".format(len(store), len(store.strings), store.nbytes / 1e6))
+
+	for change in store.get_candidate_changes():
+		print("{date}: {candidates} candidates, added {added}, removed {removed}".format(**change))
+
+	if len(store):
+		print(store.get_discoveries_per_year_by_method().to_string())
+
+
+if __name__ == '__main__':
+	main()
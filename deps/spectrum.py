@@ -0,0 +1,208 @@
+import numpy as np
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Black body spectra of the host stars (the 'graph out the black body spectrum of a system's star' TODO in explore.main).
+#
+# The Planck function is evaluated for a chunk of stars over the whole wavelength grid in one broadcast (stars x wavelengths)
+# in float32. iter_spectra hands the spectra over one chunk at a time and the band fractions are integrated inside the loop,
+# so memory stays bounded however many stars there are - only compute_spectra, for the few stars of a chart, returns them all
+# at once. Within a chunk only the distinct temperatures are computed, and the most recently used spectra are cached by
+# (temperature, grid), as lots of stars share the same catalogued temperature.
+#
+# Units: wavelengths are given in nm, spectral radiance is returned in W m^-2 sr^-1 um^-1.
+
+# Planck's radiation constants in micrometre units, so the float32 maths stays well within range
+C1 = 1.191042972e8	# 2hc^2 / W um^4 m^-2 sr^-1
+C2 = 14387.7688		# hc/k / um K
+WIEN = 2897.771955	# Wien's displacement constant / um K
+SB_CONST = 5.670374419e-8 # Stefan-Boltzmann constant
+
+# Bands of interest for the band flux columns, in nm
+BANDS = {
+	'ultraviolet': (100, 400),
+	'photosynthetic': (400, 700), # photosynthetically active radiation
+	'near_infrared': (700, 2500)
+}
+
+# bound the size of one chunk of the stars x wavelengths array (working on a chunk takes a few times this)
+MAX_CHUNK_BYTES = 8 * 1024 * 1024
+
+# bound the memory held by the cache of spectra, the least recently used are dropped first
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+
+# (temperature, grid key) -> spectrum, least recently used first. Stages run on threads, so it is used under the lock.
+spectrum_cache = OrderedDict()
+spectrum_cache_bytes = 0
+spectrum_cache_lock = threading.Lock()
+
+
+def wavelength_grid(start_nm=100, stop_nm=5000, points=1000, log=False):
+	'''
+	A grid of wavelengths in nm, evenly or logarithmically spaced.
+	'''
+	if log:
+		return np.geomspace(start_nm, stop_nm, points).astype(np.float32)
+	return np.linspace(start_nm, stop_nm, points, dtype=np.float32)
+
+
+def get_grid_key(grid_nm):
+	grid_nm = np.ascontiguousarray(grid_nm, dtype=np.float32)
+	return hashlib.sha1(grid_nm.tobytes()).hexdigest()
+
+
+def planck(temperatures, grid_nm):
+	'''
+	Spectral radiance of black bodies at each temperature (K) over the grid, as a float32 array of shape (stars, wavelengths).
+	No caching or chunking - see compute_spectra for that.
+	'''
+	wavelength_um = np.asarray(grid_nm, dtype=np.float32)[np.newaxis, :] / np.float32(1000)
+	temperatures = np.asarray(temperatures, dtype=np.float32)[:, np.newaxis]
+
+	with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+		# expm1 keeps the precision at long wavelengths, and overflows to inf (radiance 0) at very short ones
+		radiance = np.float32(C1) / wavelength_um**5 / np.expm1(np.float32(C2) / (wavelength_um * temperatures))
+
+	radiance[~np.isfinite(radiance)] = 0
+	return radiance
+
+
+def get_cached_spectra(temperatures, grid_key):
+	'''
+	The cached spectrum of each temperature (None where there isn't one), marking them as recently used.
+	'''
+	with spectrum_cache_lock:
+		spectra = [spectrum_cache.get((temp, grid_key)) for temp in temperatures]
+		for temp, spectrum in zip(temperatures, spectra):
+			if spectrum is not None:
+				spectrum_cache.move_to_end((temp, grid_key))
+	return spectra
+
+
+def cache_spectra(temperatures, spectra, grid_key, max_cache_bytes=MAX_CACHE_BYTES):
+	global spectrum_cache_bytes
+
+	with spectrum_cache_lock:
+		for temp, spectrum in zip(temperatures, spectra):
+			# a copy, so the cache doesn't keep the whole chunk it came from alive
+			spectrum = spectrum.copy()
+			previous = spectrum_cache.pop((temp, grid_key), None)
+			if previous is not None:
+				spectrum_cache_bytes -= previous.nbytes
+			spectrum_cache[(temp, grid_key)] = spectrum
+			spectrum_cache_bytes += spectrum.nbytes
+
+		while spectrum_cache and spectrum_cache_bytes > max_cache_bytes:
+			_, dropped = spectrum_cache.popitem(last=False)
+			spectrum_cache_bytes -= dropped.nbytes
+
+
+def get_chunk_size(grid_nm, max_chunk_bytes=MAX_CHUNK_BYTES):
+	'''
+	Number of stars in a chunk of at most max_chunk_bytes of float32 spectra.
+	'''
+	return max(1, int(max_chunk_bytes // (len(grid_nm) * 4)))
+
+
+def iter_spectra(temperatures, grid_nm, max_chunk_bytes=MAX_CHUNK_BYTES):
+	'''
+	Black body spectra of the stars a chunk at a time: yields (start, stop, spectra) with spectra the float32 (stop - start,
+	wavelengths) spectra of temperatures[start:stop], at most max_chunk_bytes. Stars with no temperature get a row of NaN.
+	'''
+	grid_nm = np.asarray(grid_nm, dtype=np.float32)
+	grid_key = get_grid_key(grid_nm)
+	temperatures = np.asarray(temperatures, dtype=float)
+	chunk_size = get_chunk_size(grid_nm, max_chunk_bytes)
+
+	for start in range(0, len(temperatures), chunk_size):
+		chunk = temperatures[start:start + chunk_size]
+		known = np.isfinite(chunk) & (chunk > 0)
+		unique_temps, inverse = np.unique(chunk[known], return_inverse=True)
+
+		unique_spectra = np.empty((len(unique_temps), len(grid_nm)), dtype=np.float32)
+		cached = get_cached_spectra(unique_temps, grid_key)
+		missing = np.array([spectrum is None for spectrum in cached], dtype=bool)
+		for i in np.flatnonzero(~missing):
+			unique_spectra[i] = cached[i]
+		if missing.any():
+			unique_spectra[missing] = planck(unique_temps[missing], grid_nm)
+			cache_spectra(unique_temps[missing], unique_spectra[missing], grid_key)
+
+		spectra = np.full((len(chunk), len(grid_nm)), np.nan, dtype=np.float32)
+		spectra[known] = unique_spectra[inverse]
+		yield start, start + len(chunk), spectra
+
+
+def compute_spectra(temperatures, grid_nm, max_chunk_bytes=MAX_CHUNK_BYTES):
+	'''
+	Black body spectrum of every star, shape (stars, wavelengths), float32. Stars with no temperature get a row of NaN.
+
+	This is the whole array at once, for the few stars of a chart - anything over the whole catalog should reduce each chunk
+	of iter_spectra instead.
+	'''
+	grid_nm = np.asarray(grid_nm, dtype=np.float32)
+	spectra = np.empty((len(temperatures), len(grid_nm)), dtype=np.float32)
+	for start, stop, chunk in iter_spectra(temperatures, grid_nm, max_chunk_bytes):
+		spectra[start:stop] = chunk
+	return spectra
+
+
+def get_trapezoid_weights(grid):
+	'''
+	Weights of the trapezoid rule over grid, so the integral of each row of y is y @ weights - one matrix-vector product
+	rather than the temporaries of np.trapezoid.
+	'''
+	gaps = np.diff(grid)
+	weights = np.zeros(len(grid))
+	weights[:-1] += gaps / 2
+	weights[1:] += gaps / 2
+	return weights
+
+
+def compute_band_fractions(temperatures, bands=BANDS, points_per_band=200):
+	'''
+	The fraction of each star's total output emitted in each band. The band is integrated numerically on its own grid and
+	divided by the total radiance of a black body (sigma T^4 / pi), so the answer doesn't depend on where a grid is cut off.
+
+	Returns a dict of band name -> array of fractions (NaN where there is no temperature).
+	'''
+	temperatures = np.asarray(temperatures, dtype=float)
+	with np.errstate(invalid='ignore'):
+		total = SB_CONST * temperatures**4 / np.pi # W m^-2 sr^-1
+
+	fractions = {}
+	for name, (low_nm, high_nm) in bands.items():
+		grid_nm = wavelength_grid(low_nm, high_nm, points_per_band)
+		weights = get_trapezoid_weights(grid_nm.astype(np.float64) / 1000)
+
+		# integrate over wavelength in um, accumulating in float64, one chunk of stars at a time
+		band_radiance = np.empty(len(temperatures))
+		for start, stop, spectra in iter_spectra(temperatures, grid_nm):
+			band_radiance[start:stop] = spectra.astype(np.float64) @ weights
+		with np.errstate(invalid='ignore', divide='ignore'):
+			fractions[name] = band_radiance / total
+
+	return fractions
+
+
+def compute_peak_wavelength(temperatures):
+	'''
+	Wavelength (nm) of peak emission from Wien's displacement law.
+	'''
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return WIEN / np.asarray(temperatures, dtype=float) * 1000
+
+
+def add_band_flux_columns(exoplanets, bands=BANDS):
+	'''
+	Add the peak wavelength and the fraction of output in each band (e.g. 'stellar_photosynthetic_fraction') of each
+	planet's host star as columns. Returns the dataframe.
+	'''
+	temperatures = exoplanets['stellar_effective_temperature_black_body_radiation'].to_numpy(dtype=float)
+
+	exoplanets['stellar_peak_wavelength_nm'] = compute_peak_wavelength(temperatures)
+	for name, fraction in compute_band_fractions(temperatures, bands).items():
+		exoplanets['stellar_{}_fraction'.format(name)] = fraction
+
+	return exoplanets
@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+from pathlib import Path
+
+from . import exoplanet_catalog as ec
+
+# Export every host system as a 3D map which a viewer can stream in a bit at a time. Systems are placed in 3D (light years,
+# equatorial coordinates with the Sun at the origin) from their distance and sky position, then put into an octree. Every node
+# of the octree stores the number of systems / habitable-zone planets beneath it and has its own small binary tile, so a viewer
+# can draw the coarse levels first and only fetch the detail for the part of the map it is looking at.
+#
+# Leaf tiles hold every system in that cube. Tiles of inner nodes hold a level-of-detail sample of the systems below them,
+# preferring the ones with habitable-zone planets and then the ones with the most planets.
+#
+# Tile format (little endian):
+#	header	- 4 byte magic b'HOMT', uint16 version, uint16 unused, uint32 number of records
+#	records	- TILE_DTYPE, one per system
+#	names	- utf-8 host star names, one per record, separated by '\n'
+
+TILE_MAGIC = b'HOMT'
+TILE_VERSION = 1
+TILE_HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u2'), ('unused', '<u2'), ('count', '<u4')])
+TILE_DTYPE = np.dtype([
+	('x', '<f4'), ('y', '<f4'), ('z', '<f4'),	# light years
+	('planets', '<u2'),							# planets in the system
+	('habitable', '<u2'),						# planets in the habitable zone
+	('system_id', '<u4')						# row of the system in systems.bin, for looking up more detail
+])
+
+VIEWER_FILE = Path(__file__).parent / 'star_map_viewer.html'
+
+
+def compute_system_positions(distance_ly, ra_degrees, dec_degrees):
+	'''
+	Cartesian position of each system from its distance and sky coordinates. x points at ra = 0, z at the north celestial pole.
+	'''
+	ra = np.radians(ra_degrees)
+	dec = np.radians(dec_degrees)
+	cos_dec = np.cos(dec)
+	return np.column_stack((distance_ly * cos_dec * np.cos(ra), distance_ly * cos_dec * np.sin(ra), distance_ly * np.sin(dec)))
+
+
+def build_systems_table(exoplanets):
+	'''
+	One row per host system with its position and planet counts. Systems without a distance or sky position can't be placed
+	and are left out.
+	'''
+	exoplanets = exoplanets.assign(in_habitable_zone=(exoplanets['is_planet_habitable'] == 1).astype(int))
+
+	per_system = exoplanets.groupby('name_of_host_star', sort=True).agg(
+		distance=('distance_to_system_in_light_years', 'first'),
+		ra=('right_ascension_degrees', 'first'),
+		dec=('declination_degrees', 'first'),
+		planets=('name_of_planet', 'size'),
+		habitable=('in_habitable_zone', 'sum'))
+
+	per_system = per_system.dropna(subset=['distance', 'ra', 'dec'])
+
+	positions = compute_system_positions(per_system['distance'].to_numpy(dtype=float), per_system['ra'].to_numpy(dtype=float),
+		per_system['dec'].to_numpy(dtype=float))
+
+	systems = pd.DataFrame({
+		'name_of_host_star': per_system.index.to_numpy(),
+		'x': positions[:, 0], 'y': positions[:, 1], 'z': positions[:, 2],
+		'distance': per_system['distance'].to_numpy(dtype=float),
+		'planets': per_system['planets'].to_numpy(),
+		'habitable': per_system['habitable'].to_numpy()
+	})
+
+	return systems
+
+
+def get_lod_order(systems):
+	'''
+	Priority of each system for the level-of-detail samples: habitable-zone planets first, then most planets, then nearest.
+	Returns the rank of each system (0 = most important).
+	'''
+	order = np.lexsort((systems['distance'].to_numpy(), -systems['planets'].to_numpy(), -systems['habitable'].to_numpy()))
+	rank = np.empty(len(order), dtype=np.int64)
+	rank[order] = np.arange(len(order))
+	return rank
+
+
+def build_octree(positions, habitable, rank, max_points_per_leaf=256, lod_points=128, max_depth=12):
+	'''
+	Build the octree. Returns a list of nodes (dicts), the root first. Each node has its id (the path of octant digits from the
+	root, e.g. 'r', 'r3', 'r37'), bounds, counts, children and the indices of the systems in its tile.
+	'''
+	# a cube around every system, centred on the middle of their extent
+	low = positions.min(axis=0)
+	high = positions.max(axis=0)
+	centre = (low + high) / 2
+	half_size = max(float((high - low).max()) / 2, 1.0) * 1.0001
+
+	nodes = []
+	stack = [('r', centre, half_size, np.arange(len(positions)), 0)]
+
+	while stack:
+		node_id, centre, half_size, members, depth = stack.pop()
+
+		node = {
+			'id': node_id,
+			'centre': [float(c) for c in centre],
+			'half_size': float(half_size),
+			'count': int(len(members)),
+			'habitable_count': int(habitable[members].sum()),
+			'habitable_systems': int((habitable[members] > 0).sum()),
+			'children': []
+		}
+		nodes.append(node)
+
+		if len(members) <= max_points_per_leaf or depth >= max_depth:
+			node['leaf'] = True
+			node['members'] = members
+			continue
+
+		node['leaf'] = False
+
+		# level of detail sample - the most important systems beneath this node
+		if len(members) > lod_points:
+			node['members'] = members[np.argpartition(rank[members], lod_points)[:lod_points]]
+		else:
+			node['members'] = members
+
+		# octant of each member: bit 0 = x above the centre, bit 1 = y, bit 2 = z
+		above = positions[members] >= centre
+		octant = above[:, 0] * 1 + above[:, 1] * 2 + above[:, 2] * 4
+
+		order = np.argsort(octant, kind='stable')
+		sorted_octants = octant[order]
+		starts = np.searchsorted(sorted_octants, np.arange(9))
+
+		child_half = half_size / 2
+		for child in range(8):
+			child_members = members[order[starts[child]:starts[child + 1]]]
+			if len(child_members) == 0:
+				continue
+
+			offset = np.array([child & 1, (child >> 1) & 1, (child >> 2) & 1]) * 2 - 1
+			child_id = node_id + str(child)
+			node['children'].append(child_id)
+			stack.append((child_id, centre + offset * child_half, child_half, child_members, depth + 1))
+
+	return nodes
+
+
+def encode_tile(systems, members):
+	'''
+	Pack the systems at members into the binary tile format.
+	'''
+	members = np.sort(members)
+
+	records = np.zeros(len(members), dtype=TILE_DTYPE)
+	records['x'] = systems['x'].to_numpy()[members]
+	records['y'] = systems['y'].to_numpy()[members]
+	records['z'] = systems['z'].to_numpy()[members]
+	records['planets'] = np.minimum(systems['planets'].to_numpy()[members], np.iinfo(np.uint16).max)
+	records['habitable'] = np.minimum(systems['habitable'].to_numpy()[members], np.iinfo(np.uint16).max)
+	records['system_id'] = members
+
+	header = np.zeros(1, dtype=TILE_HEADER_DTYPE)
+	header['magic'] = TILE_MAGIC
+	header['version'] = TILE_VERSION
+	header['count'] = len(members)
+
+	names = '\n'.join(systems['name_of_host_star'].to_numpy()[members].astype(str)).encode('utf-8')
+
+	return header.tobytes() + records.tobytes() + names
+
+
+def decode_tile(data):
+	'''
+	Read a tile back into (records, names). Used to check tiles, and by anything in python which wants to read the map.
+	'''
+	header = np.frombuffer(data, dtype=TILE_HEADER_DTYPE, count=1)[0]
+	if header['magic'] != TILE_MAGIC:
+		raise ValueError('Not a star map tile')
+
+	count = int(header['count'])
+	records_end = TILE_HEADER_DTYPE.itemsize + count * TILE_DTYPE.itemsize
+	records = np.frombuffer(data, dtype=TILE_DTYPE, count=count, offset=TILE_HEADER_DTYPE.itemsize)
+	names = data[records_end:].decode('utf-8').split('\n') if count else []
+
+	return records, names
+
+
+def export_star_map(exoplanets, output_dir='./output/star_map', max_points_per_leaf=256, lod_points=128):
+	'''
+	Write the octree tiles, the full systems table and the manifest into output_dir, along with the static viewer.
+
+	Returns the manifest (also written as manifest.json).
+	'''
+	print("Info - Exporting the 3D star map..")
+	exoplanets = ec.as_dataframe(exoplanets)
+
+	if 'right_ascension_degrees' not in exoplanets.columns or 'declination_degrees' not in exoplanets.columns:
+		print("Error - The catalog has no ra / dec columns (the archive export needs them) so the star map can't be built.")
+		return None
+
+	output_dir = Path(output_dir)
+	tiles_dir = output_dir / 'tiles'
+	if tiles_dir.is_dir():
+		shutil.rmtree(tiles_dir) # old tiles may no longer be part of the tree
+	tiles_dir.mkdir(parents=True, exist_ok=True)
+
+	systems = build_systems_table(exoplanets)
+	positions = systems[['x', 'y', 'z']].to_numpy()
+
+	manifest = {
+		'format': {
+			'magic': TILE_MAGIC.decode(),
+			'version': TILE_VERSION,
+			'header': [[name, str(TILE_HEADER_DTYPE[name])] for name in TILE_HEADER_DTYPE.names],
+			'record': [[name, str(TILE_DTYPE[name])] for name in TILE_DTYPE.names],
+			'record_size': TILE_DTYPE.itemsize,
+			'units': 'light years, equatorial (x towards ra 0, z towards the north celestial pole)'
+		},
+		'systems': int(len(systems)),
+		'nodes': []
+	}
+
+	if len(systems):
+		nodes = build_octree(positions, systems['habitable'].to_numpy(), get_lod_order(systems), max_points_per_leaf, lod_points)
+
+		for node in nodes:
+			tile_name = node['id'] + '.bin'
+			with open(tiles_dir / tile_name, 'wb') as f:
+				f.write(encode_tile(systems, node.pop('members') if 'members' in node else np.array([], dtype=np.int64)))
+			node['tile'] = 'tiles/' + tile_name
+
+		# every node knows its tile's size, so the viewer can budget what it loads
+		for node in nodes:
+			node['tile_bytes'] = os.path.getsize(output_dir / node['tile'])
+
+		manifest['nodes'] = nodes
+
+	# every system in one tile too, indexed by system_id, for looking up a single system
+	with open(output_dir / 'systems.bin', 'wb') as f:
+		f.write(encode_tile(systems, np.arange(len(systems))))
+
+	with open(output_dir / 'manifest.json', 'w') as f:
+		json.dump(manifest, f, indent=1)
+
+	if VIEWER_FILE.is_file():
+		shutil.copy(VIEWER_FILE, output_dir / 'index.html')
+
+	print("Info - Star map: {} systems in {} tiles.".format(len(systems), len(manifest['nodes'])))
+
+	return manifest
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 import sys
+import argparse
+import os
 import matplotlib.pyplot as plt
 from pathlib import Path
 
@@ -8,11 +10,82 @@ from pathlib import Path
 # and can be found in the /deps/ folder
 from deps import data_cleansing as dc
 from deps import plot_logic as pl
-from deps import phys_and_math as pam
 from deps import consts as consts
+from deps import figure_cache as fc
+from deps import figure_manager as fm
+from deps import pipeline as pp
+from deps import star_map as sm
+from deps import spectrum as spec
+from deps import mass_radius as mr
+from deps import exoplanet_catalog as ec
+from deps import artifact_writer as aw
+from deps import predicates as pred
+from deps import aggregate_cube as agg
+from deps import downloader as dl
+from deps import ingest_profile as ip
+from deps import similarity as sim
+from deps import catalog_versions as cv
+from deps import occurrence as occ
+from deps import catalog_build as cb
 
 
-def main():
+def parse_args(argv=None):
+	'''
+	Command line options. With no options the program runs once as it always has.
+	'''
+	parser = argparse.ArgumentParser(description='HOME - Habitable or Mapped Exoplanets')
+	parser.add_argument('--serve', action='store_true',
+		help='keep the cleaned catalog loaded and answer queries over localhost http (or a unix socket) instead of running once')
+	parser.add_argument('--host', default='127.0.0.1', help='address for --serve to listen on')
+	parser.add_argument('--port', type=int, default=8765, help='port for --serve to listen on')
+	parser.add_argument('--socket', default=None, help='serve on this unix socket path instead of a tcp port')
+	parser.add_argument('--force-plots', action='store_true',
+		help='re-render every figure even if its inputs match the fingerprint in ./output/figure_manifest.json')
+	parser.add_argument('--host-star', nargs='+', default=None, help='only run for planets of these host stars, e.g. TRAPPIST-1')
+	parser.add_argument('--planet', nargs='+', default=None, help='only run for these planets')
+	parser.add_argument('--discovery-method', nargs='+', default=None, help='only run for planets found by these methods, e.g. Transit')
+	parser.add_argument('--max-distance', type=float, default=None, help='only run for planets within this many light years')
+	parser.add_argument('--disc-year', nargs='+', type=int, default=None, help='only run for planets discovered in these years')
+	parser.add_argument('--refresh', action='store_true',
+		help='download the latest archive export first (only if it has changed) and run on that instead of the xl')
+	parser.add_argument('--albedo', type=float, default=consts.get_bond_albedo(),
+		help='Bond albedo for the model equilibrium temperature of the planets (default: %(default)s)')
+	parser.add_argument('--export', nargs='+', choices=aw.EXPORT_FORMATS + ('none',), default=None, metavar='FORMAT',
+		help='formats to write the cleaned catalog in, in the background: xlsx, csv and / or sqlite, or none '
+			'(default: {})'.format(' '.join(consts.get_export_formats())))
+	parser.add_argument('--export-in-process', action='store_true',
+		help='write the exports from a separate process instead of a background thread')
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+
+	args = parse_args(argv)
+
+	if args.serve:
+		# imported here as the service switches matplotlib to a non-interactive backend
+		from deps import catalog_service as cs
+		cs.serve(args.host, args.port, args.socket)
+		return
+
+	# figures whose inputs haven't changed since the last run are skipped, unless asked otherwise
+	fc.set_force_render(args.force_plots)
+
+	# the xl / csv / sqlite copies are written in the background while the analysis carries on
+	export_formats = None if args.export is None else [f for f in args.export if f != 'none']
+	writer = aw.configure(export_formats, args.export_in_process)
+
+	# only the matching planets are read, merged, derived, plotted and reported. Subset runs write their figures into their own
+	# folder and don't overwrite the cleaned catalog exports, which are of the full archive.
+	filters = pred.clean_filters({'host': args.host_star, 'planet': args.planet, 'discovery_method': args.discovery_method,
+		'max_distance': args.max_distance, 'disc_year': args.disc_year})
+	output_dir = './output'
+	catalog_export_formats = writer.formats
+	if pred.is_active(filters):
+		output_dir = os.path.join(output_dir, 'subsets', pred.describe(filters))
+		os.makedirs(output_dir, exist_ok=True)
+		catalog_export_formats = []
+		print("Info - Running for the planets matching {}, figures go in {}".format(filters, output_dir))
 
 	# This dataset has a gaps of imbalanced missing data and duplicates. ~ 32 000 rows of data in the imbalanced dataset.
 	# This script is designed to work with the dataset from: 
@@ -43,62 +116,181 @@ def main():
 	CLEAN_DATA_FILE_PATH = consts.get_clean_data_file_path()
 	INPUT_DATA_PATH = consts.get_input_data_path()
 
+	if args.refresh:
+		# the export grows as planets are found, so there is no fixed length to check it against
+		INPUT_DATA_PATH, _ = dl.refresh_archive()
+		LENGTH_OF_LIST = None
+
 	# set some rules for debug output - I dont want rows, but columns in full:
 	pd.set_option('display.max_columns', None)
-	pd.options.mode.chained_assignment = None  # turn off warnings as they are used in a safe way
+	# stages never change a DataFrame they are given, they change a copy - with copy on write only the columns written to are
+	# actually copied. The catalog is frozen once it is built, so it can't be changed at all (see deps/catalog_versions.py).
+	ec.enable_copy_on_write()
+
+	# The program is split into stages (ingest -> clean -> plots -> report), each stage's result is cached under ./cache/ with a
+	# hash of its inputs, parameters and code. Only the stages where something has changed are re-run, so there is no need to
+	# delete the santisised xl by hand any more after changing the cleaning code.
+	stages = build_stages(INPUT_DATA_PATH, CLEAN_DATA_FILE_PATH, LENGTH_OF_LIST, catalog_export_formats, args.albedo, filters, output_dir)
+	pipeline = pp.Pipeline(stages, consts.get_cache_dir())
+	try:
+		pipeline.run()
+	finally:
+		# wait for the background exports, and make sure any that failed are seen
+		export_errors = aw.close()
+
+	for report in pipeline.get_value('report'):
+		print(report)
+
+	for line in pipeline.get_value('earth_similarity_ranking'):
+		print(line)
+
+	if export_errors:
+		sys.exit("Error - {} background export(s) failed, see above.".format(len(export_errors)))
+
+
+def export_catalog(exoplanets, clean_data_file_path, formats):
+	'''
+	Queue the santisised xl (for debugging and for the catalog service) and any other copies on the background writer.
+	'''
+	return aw.export(exoplanets, clean_data_file_path, formats)
+
+
+def write_catalog_version(exoplanets, versions_dir):
+	'''
+	Write the catalog as the next version in versions_dir, for the catalog service and other processes (which carry on
+	reading the version they have until they move to the new one).
+	'''
+	number = cv.write_version(exoplanets, versions_dir, note='explore.py')
+	print("Info - Published version {} of the catalog to {}".format(number, versions_dir))
+	return number
+
+
+def get_habitable_subset(exoplanets):
+	return exoplanets[exoplanets['is_planet_habitable'] == 1]
+
+
+def build_stages(input_data_path, clean_data_file_path, len_of_list, export_formats=None, albedo=None, filters=None,
+		output_dir='./output'):
+	'''
+	Declare every stage of the program, with its inputs, parameters and the code it depends on. export_formats and albedo
+	default to consts.get_export_formats() and consts.get_bond_albedo(). filters restricts the run to some planets (see
+	deps/predicates.py), output_dir is where the figures and star map go. The stages up to the catalog are declared in
+	deps/catalog_build.py.
+	'''
+	filters = pred.clean_filters(filters)
+
+	def output(file_name):
+		return os.path.join(output_dir, file_name)
+
+	if export_formats is None:
+		export_formats = consts.get_export_formats()
+
+	plot_code = [fc, fm, ec, agg]
+	gravity_code = plot_code + [pl.plot_g_force_scatter, pl.get_g_force_data]
+
+	stages = cb.get_catalog_stages(input_data_path, len_of_list, albedo, filters) + [
+		pp.Stage('ingest_profile_report', ip.write_profile_report, inputs=['ingest_profile'],
+			params={'savepath': output('ingest_profile.txt')}, outputs=[output('ingest_profile.txt')], code=[ip]),
+
+		# exports for debugging / the catalog service, written in the background
+		pp.Stage('catalog_exports', export_catalog, inputs=['exoplanet_catalog'],
+			params={'clean_data_file_path': clean_data_file_path, 'formats': list(export_formats)},
+			outputs=list(aw.get_export_paths(clean_data_file_path, export_formats).values()), code=[aw]),
+
+		pp.Stage('habitable_subset', get_habitable_subset, inputs=['exoplanet_catalog']),
 
-	# Check if there is the santisised xl, if not it is first run (or changes to code) so import large dataset, otherwise import sanitised 
-	# dataset to save load times..
-	# Just remember to delete this file if you make changes to clean_data_exoplanets or similar.
-	if Path(CLEAN_DATA_FILE_PATH).is_file():
-		print("Importing sanitised data..")
-		exoplanets = pd.read_excel(CLEAN_DATA_FILE_PATH)
-	
-	else:
-		print("Importing un-sanitised data.. This could take a while depending on the size of the input data.")
+		# counts by discovery method / year / type / habitability / distance / system size, which the histograms are sliced from
+		pp.Stage('aggregate_cube', agg.build_cube, inputs=['exoplanet_catalog'], code=[agg, ec]),
 
-		# create sqlite database for the master data
-		dc.convert_xl_to_sql()
+		# produce a scatter plot for planet mass against the temperature (K) of its host star, is there a correlation? 
+		# TODO - this should also take into account the distance from the host star - probably use 'orbital_period_widest_radius_in_AU' for this.
+		pp.Stage('scatter_plot_mass_vs_temp', pl.scatter_plot_for_planet_mass_vs_solar_temp, inputs=['exoplanet_catalog'],
+			params={'savepath': output('scatter_plot_mass_vs_temp.png'),
+				'graph_title': 'A graph to show the mass (1e29) (kg) of known exoplanets orbiting stars of a \ncertain temperature (K), with earth denoted as an orange dot.'},
+			outputs=[output('scatter_plot_mass_vs_temp.png')], code=plot_code, lock='pyplot'),
 
-		# first create data frame with CSV in, ~ 30 000 rows.
-		master_data = pd.read_excel(INPUT_DATA_PATH)
+		# A histogram to show the frequency of host stars with different numbers of exoplanets.
+		# TODO - it would be interesting to add additional data to this histogram, size of star, temperature, habitability etc.
+		# Could I analyse the data to show those in habitabiltiy zone AND multiple planets? Would they look similar to our solar system in terms
+		# of their composition?
+		pp.Stage('histogram_exoplanets_per_star', pl.histogram_exoplanets_per_star, inputs=['aggregate_cube'],
+			params={'savepath': output('histogram_exoplanets_per_star.png'),
+				'graph_title': 'A histogram to show the frequency of exoplanets orbiting a host star.'},
+			outputs=[output('histogram_exoplanets_per_star.png')], code=plot_code, lock='pyplot'),
 
-		# Examine the shape
-		print("Shape of the import: {}".format(master_data.shape))
+		# plot habitable exos
+		pp.Stage('habitable_scatter_plot_mass_vs_temp', pl.scatter_plot_for_planet_mass_vs_solar_temp, inputs=['habitable_subset'],
+			params={'savepath': output('habitable_scatter_plot_mass_vs_temp.png'),
+				'graph_title': 'A graph to show the mass (1e28) (kg) of known exoplanets in the habitable zone orbiting \nstars of a certain temperature (K), ' + 
+				'with earth \ndenoted as an orange dot.'},
+			outputs=[output('habitable_scatter_plot_mass_vs_temp.png')], code=plot_code, lock='pyplot'),
+		pp.Stage('habitable_histogram_exoplanets_per_star', pl.histogram_exoplanets_per_star, inputs=['aggregate_cube'],
+			params={'savepath': output('habitable_histogram_exoplanets_per_star.png'), 'selection': {'is_planet_habitable': 1},
+				'graph_title': 'A histogram to show the frequency of exoplanets with at least one \nin the habitable range orbiting a host star.'},
+			outputs=[output('habitable_histogram_exoplanets_per_star.png')], code=plot_code, lock='pyplot'),
 
-		# Clean & format the data
-		exoplanets = dc.data_cleansing_methods(master_data, LENGTH_OF_LIST, CLEAN_DATA_FILE_PATH)
+		# graph the gravitational forces for both habitable planets and non-habitable.
+		pp.Stage('g_force_graphs', pl.graph_gravity, inputs=['exoplanet_catalog', 'habitable_subset'],
+			params={'savepathall': output('g_force_all_exoplanets.png'), 'savepathhab': output('g_force_habitable_exoplanets.png'),
+				'savepathallradius': output('g_force_all_exoplanets_radius.png'), 'savepathhabradius': output('g_force_all_exoplanets_habitable_radius.png'),
+				'savepathpie': output('g_force_all_exoplanets_habitable_pie_chart.png')},
+			outputs=[output('g_force_all_exoplanets.png'), output('g_force_habitable_exoplanets.png'),
+				output('g_force_all_exoplanets_radius.png'), output('g_force_all_exoplanets_habitable_radius.png'),
+				output('g_force_all_exoplanets_habitable_pie_chart.png')], code=gravity_code, lock='pyplot'),
 
+		# not currently used in the analysis (see compute_planet_state_from_temperature), cached so wikipedia is only scraped once
+		pp.Stage('element_state_changes', dc.scrape_wikipedia_data_regarding_state_change,
+			code=[dl]),
 
-	# produce a scatter plot for planet mass against the temperature (K) of its host star, is there a correlation? 
-	# TODO - this should also take into account the distance from the host star - probably use 'orbital_period_widest_radius_in_AU' for this.
-	pl.scatter_plot_for_planet_mass_vs_solar_temp(exoplanets, 
-		'./output/scatter_plot_mass_vs_temp.png', 
-		'A graph to show the mass (1e29) (kg) of known exoplanets orbiting stars of a \ncertain temperature (K), with earth denoted as an orange dot.')
+		# graph the density's and thus planet state of each planet
+		# 0 flag just for formatting logic
+		pp.Stage('density_all_planets', pl.graph_density, inputs=['exoplanet_catalog'],
+			params={'savepath': output('density_all_planets.png'), 'savepath_histogram': output('density_all_planets-histogram.png'), 'hab': 0},
+			outputs=[output('density_all_planets.png'), output('density_all_planets-histogram.png')], code=plot_code, lock='pyplot'),
+		pp.Stage('density_hab_planets', pl.graph_density, inputs=['habitable_subset'],
+			params={'savepath': output('density_hab_planets.png'), 'savepath_histogram': output('density_hab_planets-histogram.png')},
+			outputs=[output('density_hab_planets.png'), output('density_hab_planets-histogram.png')], code=plot_code, lock='pyplot'),
 
-	# A histogram to show the frequency of host stars with different numbers of exoplanets.
-	# TODO - it would be interesting to add additional data to this histogram, size of star, temperature, habitability etc.
-	# Could I analyse the data to show those in habitabiltiy zone AND multiple planets? Would they look similar to our solar system in terms
-	# of their composition?
-	pl.histogram_exoplanets_per_star(exoplanets, './output/histogram_exoplanets_per_star.png', 
-		'A histogram to show the frequency of exoplanets orbiting a host star.')
+		# the black body spectrum of the stars hosting the optimal planets for life, against the Sun
+		pp.Stage('black_body_spectrum', pl.graph_black_body_spectrum, inputs=['exoplanet_catalog'],
+			params={'savepath': output('black_body_spectrum_of_host_stars.png'),
+				'graph_title': 'The black body spectrum of the host stars of potentially habitable planets, compared to the Sun. \nThe shaded band is the visible / photosynthetic range.'},
+			outputs=[output('black_body_spectrum_of_host_stars.png')], code=plot_code + [spec, pl.filter_optimal_planets_for_life], lock='pyplot'),
 
-	# plot habitable exos
-	habitable = pl.graph_habitable_exoplanets(exoplanets)
+		# bias corrected planets per star over period x radius and period x mass, with bootstrapped confidence intervals
+		pp.Stage('occurrence_period_radius', occ.compute_occurrence_grid, inputs=['exoplanet_catalog'],
+			params={'y_column': 'planet_radius_compared_to_earth', 'n_bootstrap': consts.get_bootstrap_draws()}, code=[occ, ec]),
+		pp.Stage('occurrence_period_mass', occ.compute_occurrence_grid, inputs=['exoplanet_catalog'],
+			params={'y_column': 'planet_mass_compared_to_earth', 'n_bootstrap': consts.get_bootstrap_draws()}, code=[occ, ec]),
+		pp.Stage('occurrence_period_radius_plot', pl.plot_occurrence_grid, inputs=['occurrence_period_radius'],
+			params={'savepath': output('occurrence_period_radius.png'), 'ylabel': 'Radius of the planet / Earth radii',
+				'graph_title': 'Planets per star by orbital period and radius, corrected for the detection bias of each discovery method.'},
+			outputs=[output('occurrence_period_radius.png')], code=plot_code + [pl.plot_occurrence_grid], lock='pyplot'),
+		pp.Stage('occurrence_period_mass_plot', pl.plot_occurrence_grid, inputs=['occurrence_period_mass'],
+			params={'savepath': output('occurrence_period_mass.png'), 'ylabel': 'Mass of the planet / Earth masses',
+				'graph_title': 'Planets per star by orbital period and mass, corrected for the detection bias of each discovery method.'},
+			outputs=[output('occurrence_period_mass.png')], code=plot_code + [pl.plot_occurrence_grid], lock='pyplot'),
 
-	# graph the gravitational forces for both habitable planets and non-habitable.
-	pl.graph_gravity(exoplanets, habitable, './output/g_force_all_exoplanets.png', './output/g_force_habitable_exoplanets.png')
+		# place every host system in 3D and write the streaming star map (tiles + manifest + viewer)
+		pp.Stage('star_map', sm.export_star_map, inputs=['exoplanet_catalog'], params={'output_dir': output('star_map')},
+			outputs=[output('star_map/manifest.json')], code=[ec]),
 
-	pam.compute_planet_state_from_temperature(exoplanets)
+		pp.Stage('report', pl.format_optimal_planets_for_life, inputs=['exoplanet_catalog'],
+			code=[pl.filter_optimal_planets_for_life, pl.round_it, mr, ec]),
 
-	# graph the density's and thus planet state of each planet
-	# 0 flag just for formatting logic
-	pl.graph_density(exoplanets, './output/density_all_planets.png', './output/density_all_planets-histogram.png', 0)
-	pl.graph_density(habitable, './output/density_hab_planets.png', './output/density_hab_planets-histogram.png')
+		# every planet scored by its Earth Similarity Index, and the most Earth-like
+		pp.Stage('similarity_index', sim.SimilarityIndex.from_catalog, inputs=['exoplanet_catalog'], code=[sim, ec]),
+		pp.Stage('earth_similarity_ranking', sim.format_earth_like_ranking, inputs=['similarity_index'], params={'k': 10}, code=[sim]),
+	]
 
-	pl.print_optimal_planets_for_life(exoplanets)
+	if not filters:
+		# only the full catalog is published for the service, not a subset
+		versions_dir = consts.get_catalog_versions_dir()
+		stages.append(pp.Stage('catalog_version', write_catalog_version, inputs=['exoplanet_catalog'],
+			params={'versions_dir': versions_dir}, outputs=[os.path.join(versions_dir, 'current.json')], code=[cv]))
 
+	return stages
 
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()